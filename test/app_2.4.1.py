@@ -8,6 +8,7 @@ from PyQt6.QtWidgets import (
     QFileDialog, QMessageBox, QGridLayout, QComboBox, QInputDialog
 )
 from openpyxl.utils import column_index_from_string
+from xlsx_reader import iter_xlsx_rows
 
 DEFAULTS_PATH = "folder_paths.json"
 
@@ -215,7 +216,8 @@ class ExcelScannerGUI(QWidget):
         keywords = [k.strip() for k in keyword_str.split(",") if k.strip()]
 
         try:
-            result = self.scan_excel_with_pandas(
+            scan = self.scan_excel_streaming if file_path.lower().endswith(".xlsx") else self.scan_excel_with_pandas
+            result = scan(
                 file_path, keywords, start_col_idx, end_col_idx, start_row_idx, end_row_idx
             )
             formatted_result = json.dumps(result, indent=4)
@@ -233,6 +235,24 @@ class ExcelScannerGUI(QWidget):
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to process file: {e}")
 
+    def scan_excel_streaming(self, file_path, keywords, start_col=0, end_col=19, start_row=0, end_row=58):
+        # Only the rows up to end_row are inflated and parsed; the rest of the sheet is never read
+        result = {}
+        for row_idx, cells in iter_xlsx_rows(file_path, max_rows=end_row + 1):
+            if row_idx < start_row:
+                continue
+            for col_idx, value in cells:
+                if not (start_col <= col_idx <= end_col):
+                    continue
+                cell_value = value.strip()
+                if not cell_value:
+                    continue
+                matched_keywords = [k for k in keywords if k.lower() in cell_value.lower()]
+                if matched_keywords:
+                    cell_address = f"{chr(65 + col_idx)}{row_idx + 1}"
+                    result[cell_address] = {k: cell_value for k in matched_keywords}
+        return result
+
     def scan_excel_with_pandas(self, file_path, keywords, start_col=0, end_col=19, start_row=0, end_row=58):
         df = pd.read_excel(file_path, header=None)
         result = {}
@@ -8,7 +8,18 @@ import sys
 import re
 import os
 import json
+import hashlib
+import fnmatch
+import mmap
+import tempfile
+import socket
+import struct
+import ctypes
 import subprocess
+import zipfile
+import xml.etree.ElementTree as ElementTree
+import time
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from threading import Thread
 from PySide6.QtWidgets import (
@@ -19,8 +30,32 @@ from PySide6.QtWidgets import (
 )
 from PySide6.QtCore import QSettings, Qt, Signal, QObject, QTimer
 import pandas as pd
+import numpy as np
 import concurrent.futures
+import multiprocessing
 import threading
+from collections import deque
+from collections.abc import Iterator
+import itertools
+import shutil
+import copy
+import io
+
+from xlsx_reader import (XLSX_NS, CellStyles, SharedStrings, column_index, first_sheet_part,
+                         iter_xlsx_rows, split_cell_ref, xlsx_row_cells)
+
+# Optional faster JSON encoder for exports
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional Arrow/Parquet support for the columnar export
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 # Supported file types for searching
 SUPPORTED_EXTENSIONS = ['.xlsx', '.xls', '.csv', '.txt']
@@ -34,206 +69,3997 @@ NETWORK_FOLDERS = {
     "Service": r"\\192.168.0.105\Service"
 }
 
+# Folder shortcuts and per-root limits (same format as folder_paths.json)
+FOLDERS_CONFIG_PATH = Path(__file__).with_name("folder_paths.json")
 
-class SettingsDialog(QDialog):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Search Settings")
-        self.setModal(True)
-        self.resize(400, 300)
+# Worker budget (upper bound for the adaptive controller) for each root of a multi-root search
+# unless overridden in the folders config
+DEFAULT_ROOT_WORKERS = 8
+
+# Adaptive worker count: start value when nothing is remembered for a folder, and the hard ceiling
+DEFAULT_WORKERS = 4
+MAX_ADAPTIVE_WORKERS = 32
+FILE_TIMEOUT = 30  # seconds before a file is reported as timed out
+
+# Quotation file names such as ST-2025-02-463_(CUSTOMER) encode year, month and sequence
+QUOTATION_NAME_PATTERN = re.compile(r'ST-(\d{4})-(\d{2})-(\d+)', re.IGNORECASE)
+
+# Files at or above this size go to the slow lane, which may use at most a quarter of the workers
+LARGE_FILE_BYTES = 2 * 1024 * 1024
+
+# Small files are grouped into batches (one task each) of at most this many files / bytes
+BATCH_MAX_FILES = 16
+BATCH_BYTES = 1024 * 1024
+
+# Per-share I/O limits (bytes_per_sec 0 = unlimited); override per root under "Limits" in the folders config
+DEFAULT_SHARE_LIMITS = {"max_open": 4, "bytes_per_sec": 0}
+# Gentler limits for background scans, applied to full-share sweeps during daytime hours ("Profiles")
+DEFAULT_BACKGROUND_PROFILE = {"max_open": 1, "bytes_per_sec": 2 * 1024 * 1024, "daytime_hours": [8, 19]}
+
+# Local per-user directory for snapshots and other cached state
+APP_DATA_DIR = Path.home() / ".keyword_search_app"
+SNAPSHOT_DIR = APP_DATA_DIR / "snapshots"
+WORKER_TUNING_PATH = APP_DATA_DIR / "worker_tuning.json"
+ROW_INDEX_DIR = APP_DATA_DIR / "row_index"
+TEMPLATE_PATH = APP_DATA_DIR / "quotation_template.json"
+HEADER_DIR = APP_DATA_DIR / "headers"
+SHEET_CACHE_DIR = APP_DATA_DIR / "sheet_cache"
+INDEX_DIR = APP_DATA_DIR / "index"
+
+# Searches run in a helper process so parsing never competes with the GUI for the GIL
+USE_SCAN_ENGINE = True
+ENGINE_FLUSH_INTERVAL = 0.05  # seconds between batched event messages from the helper
+ENGINE_MAX_RESTARTS = 3  # automatic resumes of one search after the helper crashed
+
+# Memory budget: the helper process is recycled after this many files or above this RSS, and new
+# files are held back while the system has less than min_available_mb free
+DEFAULT_MEMORY_BUDGET = {"recycle_files": 2000, "recycle_rss_mb": 1024, "min_available_mb": 512}
+MEMORY_CHECK_INTERVAL = 0.5  # seconds between memory samples
+
+# Grids decoded in worker processes are handed back as memory-mapped files in this folder
+GRID_SPILL_DIR = Path(tempfile.gettempdir()) / "keyword_search_grids"
+GRID_MAGIC = b"KSGRID02"
+GRID_HEADER = struct.Struct("<8sqqqqq")  # magic, nrows, ncols, ncells, nstrings, data_bytes
+
+# Decoded workbook sheets are kept as grid files in SHEET_CACHE_DIR, keyed on path, size and mtime;
+# the least recently used go beyond the disk budget
+USE_SHEET_CACHE = True
+SHEET_CACHE_BUDGET_MB = 2048
+
+# Inverted index of a folder's workbooks: read-only segment files opened through mmap, each with a
+# file table, a sorted term dictionary and varint postings of (file, sheet, row, col) per term.
+# Builds append segments; past INDEX_MAX_SEGMENTS they are merged into one in the background.
+# Besides words, segments hold the trigrams of each distinct text's normalized form (lowercase
+# letters and digits) as "#abc" terms, posted once per text at its first cell
+INDEX_MAGIC = b"KSIDX002"
+INDEX_WORDS_MAGIC = b"KSIDX001"  # Older segments: words only
+INDEX_HEADER = struct.Struct("<8sqqqqq")  # magic, nfiles, nterms, path_bytes, term_bytes, posting_bytes
+INDEX_TOKEN_PATTERN = re.compile(r'\w+')
+INDEX_SEGMENT_FILES = 500
+INDEX_MAX_SEGMENTS = 8
+INDEX_MERGE_BATCH_BYTES = 2 * 1024 * 1024  # Postings decoded at a time while merging
+TRIGRAM_PREFIX = "#"  # Sorts before every word, so trigram terms come first in the dictionary
+NORMALIZE_PATTERN = re.compile(r'[\W_]+')
+MEMORY_INDEX_FOLDERS = 4  # Ad-hoc folders whose in-memory index is kept
+
+# Fuzzy search: at most this many edits (and one per three characters of the keyword)
+FUZZY_MAX_EDITS = 2
+
+# Quotation fields read by templates (see test/app.py): labels, and how far from a label its
+# value may sit when it isn't in the same cell
+QUOTATION_FIELD_LABELS = ['Quotation No', 'Product :', 'Brand :', 'Model :', 'Capacity :', 'Pan Size :']
+TEMPLATE_MAX_OFFSET = 3
+
+# Streamed JSON arrays are encoded this many elements at a time
+JSON_CHUNK_ITEMS = 1000
+
+# Bulk exports keep these next to the <stem>.json outputs in the save folder: the manifest of
+# exported source versions (reruns skip unchanged files) and the report of files that failed
+EXPORT_MANIFEST_NAME = ".export_manifest.json"
+EXPORT_ERRORS_NAME = "export_errors.json"
+
+# Columnar export: one Parquet dataset (hive-partitioned by quotation year) holding a row per
+# non-empty cell; strings are dictionary-encoded and the pages compressed
+PARQUET_DATASET_NAME = "quotations_parquet"
+PARQUET_COMPRESSION = "zstd"
+PARQUET_ROW_GROUP_ROWS = 128 * 1024
+
+# Summary rows of an export are the cells mentioning one of these
+SUMMARY_PATTERN = re.compile(r'total|subtotal|amount|gst|tax', re.IGNORECASE)
+
+# Header blob in H1 ("Quotation No. : ...\nDate: ... Currency: ..."): labels of its typed fields,
+# matched in one pass; the parsed fields are stored per folder as the columns of a header table
+HEADER_CELL = "H1"
+HEADER_LABELS = {
+    "quotation_no": r"Quotation\s+No\.?",
+    "date": r"Date",
+    "currency": r"Currency",
+    "payment_term": r"Payment\s+Term",
+    "sales_person": r"Sales\s+Person",
+    "email_address": r"Email\s+Address",
+}
+HEADER_LABEL_PATTERN = re.compile(
+    r'\b(?:' + "|".join(f"(?P<{name}>{label})" for name, label in HEADER_LABELS.items()) + r')\s*:[ \t]*',
+    re.IGNORECASE)
+HEADER_COLUMNS = ["file", "size", "mtime", "company"] + list(HEADER_LABELS)
+
+# Boolean queries: terms combined with AND, OR, NOT and parentheses (adjacent terms are AND'ed).
+# A term is a word, a "quoted phrase" or field:value, where field is a header field (company,
+# quotation_no, date, ...), a labelled quotation field (brand, model, ...) or cell:A7[=text]
+QUERY_TOKEN_PATTERN = re.compile(r'\(|\)|[^\s()"]*"[^"]*"|[^\s()]+')
+QUERY_OPERATORS = {"AND", "OR", "NOT", "(", ")"}
+QUERY_HEADER_FIELDS = ["company"] + list(HEADER_LABELS)
+QUERY_LABEL_FIELDS = {label.strip(" :.").lower().replace(" ", "_"): label for label in QUOTATION_FIELD_LABELS
+                      if label.strip(" :.").lower().replace(" ", "_") not in QUERY_HEADER_FIELDS}
+CELL_REF_PATTERN = re.compile(r'^[A-Z]{1,3}[1-9]\d*$')
+
+# Row index: the raw XML is scanned for these tags, in chunks of ROW_INDEX_CHUNK bytes
+ROW_INDEX_CHUNK = 1 << 16
+ROOT_TAG_PATTERN = re.compile(rb'<((?:[\w.-]+:)?worksheet)\b[^>]*>')
+ROW_TAG_PATTERN = re.compile(rb'<(?:[\w.-]+:)?row\b[^>]*>')
+ROW_NUMBER_PATTERN = re.compile(rb'\sr=["\'](\d+)')
+SHEET_DATA_END_PATTERN = re.compile(rb'</(?:[\w.-]+:)?sheetData>')
+
+# Network share reachability probing
+SHARE_PROBE_TIMEOUT = 2.0  # seconds per probe, far below the SMB timeout
+SHARE_STATUS_TTL = 60  # seconds before a cached up/down state is re-probed
+SMB_PORT = 445
+
+
+def unc_share(path_str):
+    """Return (host, share) for a UNC path like \\\\host\\share\\dir, or None for local paths"""
+    path_str = str(path_str).replace("/", "\\")
+    if not path_str.startswith("\\\\"):
+        return None
+    parts = path_str[2:].split("\\")
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        return None
+    return parts[0].lower(), parts[1].lower()
+
+
+def load_folders_config(config_path=FOLDERS_CONFIG_PATH):
+    """Load folder shortcuts and per-root limits, falling back to NETWORK_FOLDERS"""
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not load folder config {config_path}: {e}")
+        config = {}
+    return {
+        "Folders": config.get("Folders") or dict(NETWORK_FOLDERS),
+        "Limits": config.get("Limits", {}),
+        "Profiles": config.get("Profiles", {})
+    }
+
+
+def normalized_real_path(path):
+    """Normalize a path for overlap checks (resolves links, case-folds on Windows)"""
+    return os.path.normcase(os.path.realpath(str(path)))
+
+
+def plan_search_roots(roots):
+    """Drop roots that resolve to the same folder and find nested roots to prune from their parents
+
+    Returns a list of (name, root_path, excluded_paths). A nested root (e.g. Service\\Quotation\\SIM
+    inside Service) is scanned once, by its own root, and skipped while walking the parent.
+    """
+    real_paths = {}
+    for name, path in roots.items():
+        key = normalized_real_path(path)
+        if key in real_paths.values():
+            print(f"Skipping root {name}: same folder as another root")
+            continue
+        real_paths[name] = key
+
+    plan = []
+    for name, key in real_paths.items():
+        prefix = key.rstrip(os.sep) + os.sep
+        excluded = {other for other in real_paths.values() if other != key and other.startswith(prefix)}
+        plan.append((name, Path(roots[name]), excluded))
+    return plan
+
+
+def is_excluded_folder(entry, excluded):
+    """Whether a directory entry is one of the excluded (normalized real) paths
+
+    Resolving a path costs a round trip on a share, so only links and folders on the way to an
+    excluded path are resolved; any other folder's real path is the path it was listed under.
+    """
+    path = os.path.normcase(os.path.abspath(entry.path))
+    if path in excluded:
+        return True
+    prefix = path.rstrip(os.sep) + os.sep
+    if entry.is_symlink() or any(other.startswith(prefix) for other in excluded):
+        return normalized_real_path(entry.path) in excluded
+    return False
+
+
+def walk_root_files(root, excluded=(), should_stop=lambda: False):
+    """Recursively yield (path, size, mtime) for supported files under root, skipping excluded subfolders"""
+    stack = [str(root)]
+    while stack and not should_stop():
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except (PermissionError, OSError) as e:
+            print(f"Skipped folder {folder}: {e}")
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if excluded and is_excluded_folder(entry, excluded):
+                        continue
+                    stack.append(entry.path)
+                elif not entry.name.startswith("~$") \
+                        and Path(entry.name).suffix.lower() in SUPPORTED_EXTENSIONS:
+                    stat = entry.stat()
+                    yield Path(entry.path), stat.st_size, stat.st_mtime
+            except (PermissionError, OSError) as e:
+                print(f"Skipped file {entry.path}: {e}")
+
+
+def scan_priority(file_path, mtime, keywords):
+    """Sort key for scan order: names containing a keyword first, then newest by mtime
+
+    Files without a known mtime come last, newest quotation number first.
+    """
+    name = file_path.name.lower()
+    name_hit = any(keyword.lower() in name for keyword in keywords)
+    match = QUOTATION_NAME_PATTERN.search(file_path.name)
+    quotation = tuple(-int(group) for group in match.groups()) if match else (0, 0, 0)
+    return not name_hit, mtime is None, -(mtime or 0), quotation
+
+
+def parse_date_filter(text):
+    """Parse YYYY-MM-DD or a relative 'Nd' (N days ago) into a timestamp; empty text gives None"""
+    text = text.strip()
+    if not text:
+        return None
+    match = re.fullmatch(r'(\d+)\s*d', text, re.IGNORECASE)
+    if match:
+        return time.time() - int(match.group(1)) * 86400
+    return time.mktime(time.strptime(text, "%Y-%m-%d"))
+
+
+def parse_size_filter(text):
+    """Parse a size range in KB such as '10-500', '-500' or '10-' into (min_bytes, max_bytes)"""
+    text = text.strip()
+    if not text:
+        return None, None
+    low, sep, high = text.partition('-')
+    if not sep:
+        raise ValueError(f"Invalid size range: {text}")
+    low = int(float(low) * 1024) if low.strip() else None
+    high = int(float(high) * 1024) if high.strip() else None
+    return low, high
+
+
+class FileFilter:
+    """Query filters checked against directory listing metadata before a file is queued
+
+    name_pattern is a glob (e.g. ST-2025-*) or, prefixed with 're:', a regular expression.
+    """
+
+    def __init__(self, modified_after=None, modified_before=None, min_size=None, max_size=None,
+                 name_pattern=""):
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+        self.min_size = min_size
+        self.max_size = max_size
+        self.name_regex = None
+        if name_pattern.startswith("re:"):
+            self.name_regex = re.compile(name_pattern[3:], re.IGNORECASE)
+        elif name_pattern:
+            self.name_regex = re.compile(fnmatch.translate(name_pattern), re.IGNORECASE)
+
+    def is_active(self):
+        return any(value is not None for value in (self.modified_after, self.modified_before,
+                                                   self.min_size, self.max_size, self.name_regex))
+
+    def matches(self, file_path, size, mtime):
+        if self.name_regex and not self.name_regex.search(file_path.name):
+            return False
+        if self.min_size is not None and size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size is not None and size > self.max_size:
+            return False
+        if self.modified_after is not None and mtime is not None and mtime < self.modified_after:
+            return False
+        if self.modified_before is not None and mtime is not None and mtime >= self.modified_before:
+            return False
+        return True
+
+
+def load_worker_tuning(root):
+    """Best in-flight file count remembered for a root folder, or None"""
+    try:
+        with open(WORKER_TUNING_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f).get(os.path.normcase(str(root)))
+    except (OSError, ValueError):
+        return None
+
+
+def save_worker_tuning(root, workers):
+    try:
+        with open(WORKER_TUNING_PATH, 'r', encoding='utf-8') as f:
+            tuning = json.load(f)
+    except (OSError, ValueError):
+        tuning = {}
+    tuning[os.path.normcase(str(root))] = workers
+    try:
+        APP_DATA_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = WORKER_TUNING_PATH.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(tuning, f, indent=2)
+        os.replace(tmp_path, WORKER_TUNING_PATH)
+    except OSError as e:
+        print(f"Failed to save worker tuning: {e}")
+
+
+def process_rss():
+    """Resident set size of the current process in bytes (0 if unknown)"""
+    if sys.platform == "win32":
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+        ctypes.windll.psapi.GetProcessMemoryInfo.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulong]
+        if ctypes.windll.psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                                    counters.cb):
+            return counters.WorkingSetSize
+        return 0
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def available_memory():
+    """Physical memory available to new allocations in bytes, or None if unknown"""
+    if sys.platform == "win32":
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong)] + [
+                (name, ctypes.c_ulonglong) for name in (
+                    "ullTotalPhys", "ullAvailPhys", "ullTotalPageFile", "ullAvailPageFile",
+                    "ullTotalVirtual", "ullAvailVirtual", "ullAvailExtendedVirtual")]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(status)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def scan_folder_entries(folder_path):
+    """List supported files in a folder as {name: (size, mtime)} using a single os.scandir pass"""
+    entries = {}
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            try:
+                if entry.name.startswith("~$"):  # Ignore temporary Excel lock files
+                    continue
+                if Path(entry.name).suffix.lower() not in SUPPORTED_EXTENSIONS:
+                    continue
+                if not entry.is_file():
+                    continue
+                # On Windows the stat result comes from the directory listing itself (no extra round trip)
+                stat = entry.stat()
+                entries[entry.name] = (stat.st_size, stat.st_mtime)
+            except (PermissionError, OSError) as e:
+                print(f"Skipped file {entry.path}: {e}")
+    return entries
+
+
+def snapshot_path(folder_path):
+    """Snapshot file for a folder, named after a hash of its normalized path"""
+    key = hashlib.sha1(os.path.normcase(str(folder_path)).encode("utf-8")).hexdigest()
+    return SNAPSHOT_DIR / f"{key}.json"
+
+
+def load_folder_snapshot(folder_path):
+    """Load the last persisted listing of a folder, or None if there is none"""
+    try:
+        with open(snapshot_path(folder_path), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("folder") != str(folder_path):
+            return None
+        return {name: (size, mtime) for name, size, mtime in data.get("entries", [])}
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def save_folder_snapshot(folder_path, entries):
+    """Persist a folder listing in a compact form: [[name, size, mtime], ...]"""
+    try:
+        SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        path = snapshot_path(folder_path)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "folder": str(folder_path),
+                "entries": [[name, size, mtime] for name, (size, mtime) in entries.items()]
+            }, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Failed to save snapshot for {folder_path}: {e}")
+
+
+def cell_ref(row, col):
+    """Cell reference of a 0-based (row, col), e.g. (11, 1) -> "B12" """
+    letters = ""
+    col += 1
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return f"{letters}{row + 1}"
+
+
+def row_index_path(file_path):
+    """Row index sidecar for a workbook, named after a hash of its normalized path"""
+    key = hashlib.sha1(os.path.normcase(str(file_path)).encode("utf-8")).hexdigest()
+    return ROW_INDEX_DIR / f"{key}.rowidx"
+
+
+class SheetRowIndex:
+    """Byte offsets of the <row> elements in the uncompressed XML of a workbook's first sheet
+
+    Row i spans starts[i] up to the next row's start (or the end of <sheetData>), so a few rows
+    can be cut out of the stream and parsed on their own inside a copy of the root tag.
+    Sidecar layout: one line of JSON metadata, then int64 rows[n] and int64 starts[n].
+    """
+
+    def __init__(self, part, root_tag, root_end, rows, starts, end):
+        self.part = part
+        self.root_tag = root_tag  # Carries the namespace declarations the row fragments need
+        self.root_end = root_end
+        self.rows = np.asarray(rows, dtype=np.int64)  # 0-based, ascending as the format requires
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.end = end
+
+    @classmethod
+    def build(cls, archive, part):
+        """Index a worksheet in one pass over its inflated bytes, without parsing the XML"""
+        rows, starts = [], []
+        root_tag = root_end = end = None
+        buffer, base = b"", 0  # base: offset of buffer[0] in the uncompressed stream
+        with archive.open(part) as stream:
+            while end is None:
+                chunk = stream.read(ROW_INDEX_CHUNK)
+                buffer += chunk
+                if root_tag is None:
+                    match = ROOT_TAG_PATTERN.search(buffer)
+                    if match:
+                        root_tag, root_end = match.group(), b"</" + match.group(1) + b">"
+                pos = 0
+                for match in ROW_TAG_PATTERN.finditer(buffer):
+                    number = ROW_NUMBER_PATTERN.search(match.group())
+                    if number is None:
+                        raise ValueError(f"{part}: rows without a row number can't be indexed")
+                    rows.append(int(number.group(1)) - 1)
+                    starts.append(base + match.start())
+                    pos = match.end()
+                match = SHEET_DATA_END_PATTERN.search(buffer, pos)
+                if match:
+                    end = base + match.start()
+                elif not chunk:
+                    raise ValueError(f"{part}: no end of sheetData")
+                else:
+                    # Keep any partial tag at the end of the buffer for the next chunk
+                    cut = buffer.rfind(b"<", pos)
+                    cut = len(buffer) if cut == -1 else cut
+                    base += cut
+                    buffer = buffer[cut:]
+        if root_tag is None:
+            raise ValueError(f"{part}: no worksheet tag")
+        if any(later <= earlier for earlier, later in zip(rows, rows[1:])):
+            raise ValueError(f"{part}: rows are out of order")
+        return cls(part, root_tag, root_end, rows, starts, end)
+
+    @classmethod
+    def load(cls, file_path, size, mtime):
+        """Cached index of this version of the workbook, or None"""
+        try:
+            with open(row_index_path(file_path), 'rb') as f:
+                data = json.loads(f.readline())
+                if [data["file"], data["size"], data["mtime"]] != [str(file_path), size, mtime]:
+                    return None
+                arrays = np.frombuffer(f.read(), dtype=np.int64).reshape(2, -1)
+            return cls(data["part"], data["root_tag"].encode("utf-8"), data["root_end"].encode("utf-8"),
+                       arrays[0], arrays[1], data["end"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, file_path, size, mtime):
+        try:
+            ROW_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            path = row_index_path(file_path)
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps({
+                    "file": str(file_path), "size": size, "mtime": mtime, "part": self.part,
+                    "root_tag": self.root_tag.decode("utf-8"), "root_end": self.root_end.decode("utf-8"),
+                    "end": self.end
+                }, separators=(',', ':')).encode("utf-8") + b"\n")
+                f.write(self.rows.tobytes())
+                f.write(self.starts.tobytes())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to save row index for {file_path}: {e}")
+
+    def spans(self, rows):
+        """Byte ranges covering the given rows (those that exist), merged where they touch"""
+        wanted = np.unique(np.fromiter(rows, dtype=np.int64))
+        positions = np.searchsorted(self.rows, wanted)
+        positions = positions[positions < len(self.rows)]
+        spans = []
+        for i in positions[self.rows[positions] == wanted[:len(positions)]]:
+            start = int(self.starts[i])
+            stop = int(self.starts[i + 1]) if i + 1 < len(self.starts) else self.end
+            if spans and spans[-1][1] == start:
+                spans[-1][1] = stop
+            else:
+                spans.append([start, stop])
+        return spans
+
+
+def load_row_index(file_path, archive):
+    """Row index of a workbook's first sheet, built on first use and cached per size and mtime"""
+    stat = file_path.stat()
+    index = SheetRowIndex.load(file_path, stat.st_size, stat.st_mtime)
+    if index is None:
+        index = SheetRowIndex.build(archive, first_sheet_part(archive))
+        index.save(file_path, stat.st_size, stat.st_mtime)
+    return index
+
+
+def read_xlsx_rows(file_path, rows):
+    """{row: [(col, text), ...]} for the given 0-based rows of the first sheet of an .xlsx
+
+    Only the byte ranges of those rows are parsed. The bytes before them still have to be
+    inflated, but nothing after the last requested row is.
+    """
+    file_path = Path(file_path)
+    wanted = set(rows)
+    with zipfile.ZipFile(file_path) as archive:
+        try:
+            index = load_row_index(file_path, archive)
+        except ValueError as e:
+            # Unusual sheet layout: fall back to streaming the rows from the top
+            print(f"Row index unavailable for {file_path}: {e}")
+            return {row: cells for row, cells in iter_xlsx_rows(file_path, max(wanted, default=-1) + 1)
+                    if row in wanted}
+
+        fragments = []
+        with archive.open(index.part) as stream:
+            for start, stop in index.spans(wanted):
+                stream.seek(start)  # Forward only: skipped bytes are inflated, never parsed
+                fragments.append(stream.read(stop - start))
+        root = ElementTree.fromstring(index.root_tag + b"".join(fragments) + index.root_end)
+
+        styles = CellStyles(archive)
+        shared_strings = SharedStrings(archive)
+        try:
+            result = {}
+            for element in root.iter(f"{XLSX_NS}row"):
+                cells = xlsx_row_cells(element, shared_strings, styles)
+                if cells:
+                    result[int(element.get("r")) - 1] = cells
+            return result
+        finally:
+            shared_strings.close()
+
+
+def read_xlsx_cells(file_path, refs):
+    """{ref: text} for cell references such as "A7" or "H1"; empty cells are left out"""
+    coords = {ref: split_cell_ref(ref) for ref in refs}
+    rows = read_xlsx_rows(file_path, {row for row, _ in coords.values()})
+    cells = {}
+    for ref, (row, col) in coords.items():
+        for cell_col, text in rows.get(row, ()):
+            if cell_col == col:
+                cells[ref] = text
+    return cells
+
+
+def read_sheet_frame(file_path, max_rows=None):
+    """Read the first sheet (or a CSV) as a header-less string DataFrame"""
+    if file_path.suffix.lower() in ['.xls', '.xlsx']:
+        return pd.read_excel(file_path, header=None, dtype=str, nrows=max_rows)
+    return pd.read_csv(file_path, header=None, dtype=str, nrows=max_rows)
+
+
+def read_sheet_grid(file_path, max_rows=None):
+    """Read the first sheet (or a CSV) as a SheetGrid; the DataFrame is dropped right away"""
+    return SheetGrid.from_frame(read_sheet_frame(file_path, max_rows))
+
+
+class SheetGrid:
+    """Non-empty cells of a sheet: int32 (row, col) coordinates in row-major order plus int32 codes
+    into a table of interned strings, so repeated texts are stored once and matched once
+    """
+
+    def __init__(self, nrows, ncols, rows, cols, codes, strings):
+        self.nrows = nrows
+        self.ncols = ncols
+        self.rows = rows
+        self.cols = cols
+        self.codes = codes
+        self.strings = strings
+        self.nstrings = len(strings)
+
+    @classmethod
+    def from_frame(cls, df):
+        values = df.to_numpy(dtype=object)
+        rows, cols = np.nonzero(pd.notna(values))
+        codes, strings = pd.factorize(values[rows, cols])
+        return cls(values.shape[0], values.shape[1], rows.astype(np.int32), cols.astype(np.int32),
+                   codes.astype(np.int32), [str(text) for text in strings])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def string(self, code):
+        return self.strings[code]
+
+    def text(self, index):
+        return self.string(int(self.codes[index]))
+
+    def cell(self, row, col):
+        """Text of one cell (0-based), or None if it is empty"""
+        lo = int(np.searchsorted(self.rows, row, side='left'))
+        hi = int(np.searchsorted(self.rows, row, side='right'))
+        index = lo + int(np.searchsorted(self.cols[lo:hi], col))
+        if index < hi and self.cols[index] == col:
+            return self.text(index)
+        return None
+
+    def cells(self):
+        """Yield (row, col, text) for every non-empty cell in row-major order"""
+        for index in range(len(self.rows)):
+            yield int(self.rows[index]), int(self.cols[index]), self.text(index)
+
+    def end_row(self, end_keywords):
+        """First row with a cell containing one of the keywords (case-insensitive), else nrows"""
+        lowered = [keyword.lower() for keyword in end_keywords]
+        if not lowered or not len(self.rows):
+            return self.nrows
+        # Each distinct text is tested once, then the result is spread over the cells using it
+        is_end = np.fromiter((any(keyword in self.string(code).lower() for keyword in lowered)
+                              for code in range(self.nstrings)), dtype=bool, count=self.nstrings)
+        end_rows = self.rows[is_end[self.codes]]
+        return int(end_rows[0]) if len(end_rows) else self.nrows
+
+    def match_texts(self, predicate, end_row, max_col, limit=10):
+        """Distinct texts above end_row and left of max_col that satisfy predicate, in row-major order"""
+        in_window = (self.rows < end_row) & (self.cols < max_col)
+        codes, first = np.unique(self.codes[in_window], return_index=True)
+        matched = []
+        for code in codes[np.argsort(first)]:
+            text = self.string(int(code))
+            if predicate(text):
+                matched.append(text)
+                if len(matched) >= limit:
+                    break
+        return matched
+
+    def close(self):
+        """Release the grid's storage; nothing to do for a grid held in memory"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def head(self, nrows):
+        """The first nrows rows (like reading with nrows); shares the arrays of this grid"""
+        if nrows is None or nrows >= self.nrows:
+            return self
+        end = int(np.searchsorted(self.rows, nrows))
+        grid = copy.copy(self)
+        grid.rows, grid.cols, grid.codes = self.rows[:end], self.cols[:end], self.codes[:end]
+        # Like the Excel readers, drop trailing empty rows and columns
+        grid.nrows = int(grid.rows[-1]) + 1 if end else 0
+        grid.ncols = int(grid.cols.max()) + 1 if end else 0
+        return grid
+
+    def dense_rows(self, end_row, max_col):
+        """Rows above end_row as lists of max_col texts, with "" for empty cells (like fillna(""))"""
+        nrows, ncols = min(end_row, self.nrows), min(max_col, self.ncols)
+        dense = [[""] * ncols for _ in range(nrows)]
+        for index in np.flatnonzero((self.rows < nrows) & (self.cols < ncols)):
+            dense[self.rows[index]][self.cols[index]] = self.text(index)
+        return dense
+
+    def to_frame(self):
+        """Dense DataFrame in the same shape pd.read_excel(header=None, dtype=str) would give"""
+        values = np.full((self.nrows, self.ncols), np.nan, dtype=object)
+        for row, col, text in self.cells():
+            values[row, col] = text
+        return pd.DataFrame(values)
+
+
+def sheet_cells(file_path):
+    """{(row, col): text} for every non-empty cell of the first sheet"""
+    if file_path.suffix.lower() == '.xlsx':
+        return {(row, col): text for row, cells in iter_xlsx_rows(file_path) for col, text in cells}
+    with load_sheet_grid(file_path) as grid:
+        return {(row, col): text for row, col, text in grid.cells()}
+
+
+def field_value(label, text):
+    """Rest of the line after a label inside a cell, without the separator ("Brand : X" -> "X")"""
+    start = text.lower().find(label.lower())
+    rest = text[start + len(label):] if start != -1 else text
+    return rest.split("\n", 1)[0].lstrip(" .:\t").strip()
+
+
+def locate_fields(cells, labels):
+    """Anchor cell and value offset of each label found in the cells (full scan, row-major)"""
+    fields = []
+    ordered = sorted(cells.items())
+    for label in labels:
+        anchor = next((pos for pos, text in ordered if label.lower() in text.lower()), None)
+        if anchor is None:
+            continue
+        row, col = anchor
+        offset = [0, 0]
+        if not field_value(label, cells[anchor]):
+            # The value is in the next filled cell to the right, else just below the label
+            right = [c for r, c in cells if r == row and col < c <= col + TEMPLATE_MAX_OFFSET]
+            below = [r for r, c in cells if c == col and row < r <= row + TEMPLATE_MAX_OFFSET]
+            if right:
+                offset = [0, min(right) - col]
+            elif below:
+                offset = [min(below) - row, 0]
+        fields.append({"label": label, "anchor": cell_ref(row, col), "offset": offset})
+    return fields
+
+
+class QuotationTemplate:
+    """Field coordinates learned from a sample quotation, compiled into a cell-fetch plan
+
+    Each field is an anchor cell that must contain the label plus the offset of its value cell
+    (0, 0 when the value follows the label in the same cell).
+    """
+
+    def __init__(self, labels, fields):
+        self.labels = labels
+        self.fields = fields
+        # Plan: (label, anchor, value cell) and the rows that hold them, read in one pass
+        self.plan = []
+        for field in fields:
+            row, col = split_cell_ref(field["anchor"])
+            self.plan.append((field["label"], (row, col), (row + field["offset"][0], col + field["offset"][1])))
+        self.rows = sorted({pos[0] for _, anchor, value in self.plan for pos in (anchor, value)})
+
+    @classmethod
+    def learn(cls, file_path, labels=QUOTATION_FIELD_LABELS):
+        fields = locate_fields(sheet_cells(file_path), labels)
+        if not fields:
+            raise ValueError(f"None of the fields were found in {file_path.name}")
+        return cls(labels, fields)
+
+    def values(self, cells):
+        """{label: value} if every anchor still holds its label, else None"""
+        if not self.plan:
+            return None
+        result = {}
+        for label, anchor, value_cell in self.plan:
+            if label.lower() not in cells.get(anchor, "").lower():
+                return None
+            text = cells.get(value_cell, "")
+            result[label] = field_value(label, text) if value_cell == anchor else text.strip()
+        return result
+
+    def apply(self, file_path):
+        """Read only the planned cells (through the row index for .xlsx); None if the file doesn't fit"""
+        if file_path.suffix.lower() == '.xlsx':
+            rows = read_xlsx_rows(file_path, self.rows)
+            cells = {(row, col): text for row, row_cells in rows.items() for col, text in row_cells}
+        else:
+            cells = sheet_cells(file_path)
+        return self.values(cells)
+
+    def extract(self, file_path):
+        """Field values of a file: the compiled plan when the file fits it, else a full scan"""
+        result = self.apply(file_path)
+        if result is None:
+            cells = sheet_cells(file_path)
+            result = QuotationTemplate(self.labels, locate_fields(cells, self.labels)).values(cells)
+        return result
+
+
+def load_template():
+    """The learned quotation template, or None"""
+    try:
+        with open(TEMPLATE_PATH, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return QuotationTemplate(data["labels"], data["fields"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_template(template):
+    try:
+        APP_DATA_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = TEMPLATE_PATH.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"labels": template.labels, "fields": template.fields}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, TEMPLATE_PATH)
+    except OSError as e:
+        print(f"Failed to save template: {e}")
+
+
+def parse_header_blob(text):
+    """Typed fields of the merged H1 header cell: company (first line), quotation_no, date
+    (ISO YYYY-MM-DD), currency, payment_term, sales_person and email_address"""
+    fields = {"company": text.split("\n", 1)[0].strip()}
+    matches = list(HEADER_LABEL_PATTERN.finditer(text))
+    for match, following in zip(matches, matches[1:] + [None]):
+        # A value runs up to the next label or the end of its line
+        value = text[match.end():following.start() if following else len(text)]
+        fields.setdefault(match.lastgroup, value.split("\n", 1)[0].strip())
+    if fields.get("date"):
+        date = pd.to_datetime(fields["date"], dayfirst=True, errors="coerce")
+        fields["date"] = None if pd.isna(date) else date.strftime("%Y-%m-%d")
+    return fields
+
+
+def read_header_fields(file_path):
+    """Parsed header of a quotation: the H1 cell, else the first cell mentioning a quotation number"""
+    if file_path.suffix.lower() == '.xlsx':
+        text = read_xlsx_cells(file_path, [HEADER_CELL]).get(HEADER_CELL, "")
+        cells = None
+    else:
+        cells = sheet_cells(file_path)
+        text = cells.get(split_cell_ref(HEADER_CELL), "")
+    if not HEADER_LABEL_PATTERN.search(text):
+        cells = sheet_cells(file_path) if cells is None else cells
+        text = next((text for _, text in sorted(cells.items()) if "quotation no" in text.lower()), "")
+    return parse_header_blob(text) if text else {}
+
+
+def grid_header_fields(grid):
+    """Parsed header of an already decoded sheet, found the same way as read_header_fields"""
+    text = grid.cell(*split_cell_ref(HEADER_CELL)) or ""
+    if not HEADER_LABEL_PATTERN.search(text):
+        text = next((grid.string(int(code)) for code in grid.codes
+                     if "quotation no" in grid.string(int(code)).lower()), "")
+    return parse_header_blob(text) if text else {}
+
+
+def query_term_field(token):
+    """Whether a query token is field:value with a known field"""
+    field, sep, value = token.partition(":")
+    field = field.lower()
+    return bool(sep and value) and (field in QUERY_HEADER_FIELDS or field in QUERY_LABEL_FIELDS or field == "cell")
+
+
+def query_term(token):
+    """("term", field, value) of a query token; field is None for a plain word or phrase"""
+    if not query_term_field(token):
+        return ("term", None, token.strip('"'))
+    field, _, value = token.partition(":")
+    field, value = field.lower(), value.strip('"')
+    if field == "cell":
+        ref, _, text = value.partition("=")
+        text = text.strip('"')
+        if not CELL_REF_PATTERN.match(ref.upper()):
+            raise ValueError(f"Not a cell reference: {ref}")
+        return ("term", "cell", (*split_cell_ref(ref.upper()), text))
+    return ("term", field, value)
+
+
+def is_boolean_query(text):
+    """Whether the keyword input uses the query syntax rather than a ;-separated keyword list
+
+    Parentheses, quotes and fields always mean a query; a bare AND/OR/NOT only when the text also
+    parses as one, as these are keywords too (e.g. "Brand : AND").
+    """
+    tokens = QUERY_TOKEN_PATTERN.findall(text)
+    if any(token in ("(", ")") or '"' in token or query_term_field(token) for token in tokens):
+        return True
+    if any(token in QUERY_OPERATORS for token in tokens):
+        try:
+            parse_query(text)
+        except ValueError:
+            return False
+        return True
+    return False
+
+
+def parse_query(text):
+    """Query tree of nested ("or", [...]), ("and", [...]), ("not", node) and ("term", field, value)
+
+    NOT binds tightest, then AND (explicit or implied between terms), then OR.
+    """
+    tokens = QUERY_TOKEN_PATTERN.findall(text)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or():
+        nodes = [parse_and()]
+        while peek() == "OR":
+            take()
+            nodes.append(parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and():
+        nodes = [parse_not()]
+        while peek() not in (None, "OR", ")"):
+            if peek() == "AND":
+                take()
+            nodes.append(parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_not():
+        if peek() == "NOT":
+            take()
+            return ("not", parse_not())
+        return parse_atom()
+
+    def parse_atom():
+        token = peek()
+        if token is None or token in ("AND", "OR", ")"):
+            raise ValueError("Query ends early or has a misplaced operator" if token is None
+                             else f"Unexpected {token}")
+        take()
+        if token == "(":
+            node = parse_or()
+            if peek() != ")":
+                raise ValueError("Missing )")
+            take()
+            return node
+        return query_term(token)
+
+    if not tokens:
+        raise ValueError("Empty query")
+    node = parse_or()
+    if pos < len(tokens):
+        raise ValueError(f"Unexpected {tokens[pos]}")
+    return node
+
+
+def keywords_query(keywords):
+    """Query tree of a plain ;-separated keyword search (any keyword)"""
+    return ("or", [("term", None, keyword) for keyword in keywords])
+
+
+def parse_header_query(text):
+    """[(column, op, value), ...] from e.g. "Sales Person = WINSTON NG and Date in 2025-07"
+
+    Operators: = (equal, ignoring case), ~ (contains) and "in" (date prefix, or a comma-separated list).
+    """
+    clauses = []
+    for part in re.split(r'\s+and\s+', text.strip(), flags=re.IGNORECASE):
+        match = re.fullmatch(r'(.+?)\s*(=|~|\bin\b)\s*(.+)', part, flags=re.IGNORECASE)
+        if not match:
+            raise ValueError(f"Can't read filter: {part}")
+        column = re.sub(r'[\s.]+', '_', match.group(1).strip().lower()).strip('_')
+        if column not in HEADER_COLUMNS:
+            raise ValueError(f"Unknown header field: {match.group(1)}")
+        clauses.append((column, match.group(2).lower(), match.group(3).strip()))
+    return clauses
+
+
+def header_filter_mask(table, clauses):
+    """Boolean mask of the header table rows matching every clause"""
+    mask = pd.Series(True, index=table.index)
+    for column, op, value in clauses:
+        values = table[column].fillna("").astype(str)
+        if op == "=":
+            mask &= values.str.casefold() == value.casefold()
+        elif op == "~":
+            mask &= values.str.contains(value, case=False, regex=False)
+        elif column == "date":
+            mask &= values.str.startswith(value)
+        else:
+            mask &= values.str.casefold().isin([item.strip().casefold() for item in value.split(",")])
+    return mask
+
+
+def header_table_path(folder_path):
+    """Header table of a folder, named after a hash of its normalized path"""
+    key = hashlib.sha1(os.path.normcase(str(folder_path)).encode("utf-8")).hexdigest()
+    return HEADER_DIR / f"{key}.json"
+
+
+def load_header_table(folder_path):
+    """Parsed headers of a folder's files as a DataFrame with HEADER_COLUMNS (empty if none yet)"""
+    try:
+        with open(header_table_path(folder_path), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("folder") == str(folder_path):
+            return pd.DataFrame(data["columns"], columns=HEADER_COLUMNS)
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return pd.DataFrame(columns=HEADER_COLUMNS)
+
+
+def save_header_table(folder_path, table):
+    """Persist the header table column by column"""
+    try:
+        HEADER_DIR.mkdir(parents=True, exist_ok=True)
+        path = header_table_path(folder_path)
+        tmp_path = path.with_suffix(".tmp")
+        columns = {column: table[column].tolist() for column in HEADER_COLUMNS}
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"folder": str(folder_path), "columns": columns}, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Failed to save header table for {folder_path}: {e}")
+
+
+class JsonStreamWriter:
+    """Writes JSON to a temp file next to the target, which replaces the target only when complete
+
+    Iterators (e.g. generators of rows) anywhere in the value are written one element at a time,
+    so a document with a huge array never exists in memory as a whole. With indent=None values are
+    compact, and with lines=True (JSON Lines) each record is one compact line. The text is the same
+    as json.dump would write; orjson encodes it if it is installed.
+    """
+
+    def __init__(self, path, indent=2, lines=False):
+        self.path = Path(path)
+        self.indent = None if lines else indent
+        self.lines = lines
+        self.file = None
+        self.tmp_path = None
+        if self.indent:
+            self.encoder = json.JSONEncoder(indent=self.indent, ensure_ascii=False)
+        else:
+            self.encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def __enter__(self):
+        fd, self.tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.path.parent)
+        self.file = os.fdopen(fd, 'w', encoding='utf-8', newline='\n')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+    def encode(self, value, level=0):
+        """One value as JSON text, indented to sit at the given nesting level"""
+        if orjson is not None and self.indent in (None, 2):
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if self.indent else 0)
+            text = orjson.dumps(value, option=option).decode("utf-8")
+        else:
+            text = self.encoder.encode(value)
+        if self.indent and level:
+            text = text.replace("\n", "\n" + " " * (self.indent * level))
+        return text
+
+    def write(self, value):
+        """Write one document (or, with lines=True, one line per element of an iterator)"""
+        if self.lines:
+            records = value if isinstance(value, Iterator) else iter([value])
+            while True:
+                chunk = list(itertools.islice(records, JSON_CHUNK_ITEMS))
+                if not chunk:
+                    break
+                self.file.write("".join(self.encode(record) + "\n" for record in chunk))
+        else:
+            self.write_value(value, 0)
+
+    def write_value(self, value, level):
+        if isinstance(value, Iterator):
+            self.write_array(value, level)
+        elif isinstance(value, dict) and contains_iterator(value):
+            self.write_object(value, level)
+        else:
+            self.file.write(self.encode(value, level))
+
+    def write_array(self, items, level):
+        # Elements are encoded a chunk at a time: one encoder call per chunk, spliced in without
+        # the chunk's own brackets, gives the same text as encoding the whole array at once
+        closing = "\n" + " " * (self.indent * level) if self.indent else ""
+        self.file.write("[")
+        first = True
+        while True:
+            chunk = list(itertools.islice(items, JSON_CHUNK_ITEMS))
+            if not chunk:
+                break
+            if any(contains_iterator(item) for item in chunk):
+                for item in chunk:
+                    self.file.write((closing if first else "," + closing) + (" " * self.indent if self.indent else ""))
+                    self.write_value(item, level + 1)
+                    first = False
+                continue
+            text = self.encode(chunk, level)
+            self.file.write(("" if first else ",") + text[1:len(text) - 1 - len(closing)])
+            first = False
+        self.file.write("]" if first else closing + "]")
+
+    def write_object(self, value, level):
+        # Same layout as json.dump with this indent: one member per line
+        newline = "\n" + " " * (self.indent * (level + 1)) if self.indent else ""
+        self.file.write("{")
+        for i, (key, item) in enumerate(value.items()):
+            self.file.write(("," if i else "") + newline)
+            self.file.write(json.dumps(str(key), ensure_ascii=False) + (": " if self.indent else ":"))
+            self.write_value(item, level + 1)
+        self.file.write(("\n" + " " * (self.indent * level) if self.indent else "") + "}")
+
+
+def contains_iterator(value):
+    if isinstance(value, Iterator):
+        return True
+    if isinstance(value, dict):
+        return any(contains_iterator(item) for item in value.values())
+    return False
+
+
+def write_grid_file(grid, path):
+    """Write a SheetGrid to a flat binary grid file
+
+    Layout: header, int32 rows[n], int32 cols[n], int32 codes[n] (row-major order),
+    int64 offsets[nstrings + 1], UTF-8 data of the interned strings.
+    """
+    encoded = [grid.string(code).encode("utf-8") for code in range(grid.nstrings)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+
+    with open(path, 'wb') as f:
+        f.write(GRID_HEADER.pack(GRID_MAGIC, grid.nrows, grid.ncols, len(grid), len(encoded), int(offsets[-1])))
+        f.write(grid.rows.astype(np.int32).tobytes())
+        f.write(grid.cols.astype(np.int32).tobytes())
+        f.write(grid.codes.astype(np.int32).tobytes())
+        if len(grid) % 2:
+            f.write(b"\0" * 4)  # Keep the offsets 8-byte aligned
+        f.write(offsets.tobytes())
+        f.write(b"".join(encoded))
+
+
+def extract_grid_file(file_path, max_rows=None):
+    """Process-pool task: decode a workbook and return only the path of its grid file"""
+    GRID_SPILL_DIR.mkdir(parents=True, exist_ok=True)
+    fd, grid_path = tempfile.mkstemp(suffix=".grid", dir=GRID_SPILL_DIR)
+    os.close(fd)
+    try:
+        with load_sheet_grid(Path(file_path), max_rows) as grid:
+            write_grid_file(grid, grid_path)
+    except Exception:
+        os.remove(grid_path)
+        raise
+    return grid_path
+
+
+class MappedGrid(SheetGrid):
+    """Read-only, memory-mapped view of a grid file; strings are only decoded when accessed"""
+
+    def __init__(self, path, delete_on_close=True):
+        self.path = path
+        self.delete_on_close = delete_on_close
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, nrows, ncols, ncells, nstrings, data_bytes = GRID_HEADER.unpack_from(self.mm, 0)
+        if magic != GRID_MAGIC:
+            self.mm.close()
+            raise ValueError(f"Not a grid file: {path}")
+        pos = GRID_HEADER.size
+        rows = np.frombuffer(self.mm, dtype=np.int32, count=ncells, offset=pos)
+        pos += 4 * ncells
+        cols = np.frombuffer(self.mm, dtype=np.int32, count=ncells, offset=pos)
+        pos += 4 * ncells
+        codes = np.frombuffer(self.mm, dtype=np.int32, count=ncells, offset=pos)
+        pos += 4 * ncells + (4 if ncells % 2 else 0)
+        self.offsets = np.frombuffer(self.mm, dtype=np.int64, count=nstrings + 1, offset=pos)
+        self.data_start = pos + 8 * (nstrings + 1)
+        super().__init__(nrows, ncols, rows, cols, codes, ())
+        self.nstrings = nstrings
+
+    def string(self, code):
+        start = self.data_start + int(self.offsets[code])
+        end = self.data_start + int(self.offsets[code + 1])
+        return self.mm[start:end].decode("utf-8")
+
+    def close(self):
+        if self.mm.closed:
+            return
+        # The numpy views must go before the mapping can be closed
+        self.rows = self.cols = self.codes = self.offsets = None
+        self.mm.close()
+        if self.delete_on_close:
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                print(f"Failed to remove grid file {self.path}: {e}")
+
+
+class SheetCache:
+    """Grid files of decoded workbook sheets, shared by every process of the app
+
+    A file is named by a key of its source's path, size and mtime, so a changed workbook is never
+    served stale; the key only needs a stat of the workbook, never a read. Hits are memory-mapped
+    and touched; once the cache outgrows its budget, the least recently used files are removed.
+    Grids from get, load and lookup must be closed (they are context managers).
+    """
+
+    def __init__(self, directory=SHEET_CACHE_DIR, budget_mb=SHEET_CACHE_BUDGET_MB):
+        self.directory = Path(directory)
+        self.budget = budget_mb * 1024 * 1024
+        self.used = None  # Bytes in the cache, counted on the first write
+        self.lock = threading.Lock()
+
+    def key(self, file_path):
+        stat = file_path.stat()
+        source = f"{os.path.normcase(os.path.abspath(str(file_path)))}\0{stat.st_size}\0{stat.st_mtime_ns}"
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """The cached grid of a key (memory-mapped), or None"""
+        path = self.directory / f"{key}.grid"
+        try:
+            grid = MappedGrid(str(path), delete_on_close=False)
+        except (OSError, ValueError, struct.error):
+            return None
+        try:
+            os.utime(path)  # Recently used
+        except OSError:
+            pass
+        return grid
+
+    def put(self, key, grid):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{key}.grid"
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        os.close(fd)
+        try:
+            write_grid_file(grid, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to cache sheet {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self.lock:
+            if self.used is None:
+                self.used = sum(entry.stat().st_size for entry in os.scandir(self.directory))
+            else:
+                self.used += path.stat().st_size
+            if self.used > self.budget:
+                self.evict()
+
+    def evict(self):
+        """Remove the least recently used grid files until the cache fits its budget"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.used = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.used <= self.budget:
+                break
+            try:
+                os.remove(path)
+                self.used -= size
+            except OSError:
+                pass  # Still mapped by a reader (Windows), or already gone
+
+    def load(self, file_path, max_rows=None):
+        """The first sheet of a workbook from the cache, decoding and caching it on a miss"""
+        try:
+            key = self.key(file_path)
+        except OSError:
+            return read_sheet_grid(file_path, max_rows)
+        grid = self.get(key)
+        if grid is None:
+            grid = read_sheet_grid(file_path)
+            self.put(key, grid)
+        return grid.head(max_rows)
+
+    def lookup(self, file_path, max_rows=None):
+        """The cached first sheet of a workbook, or None without decoding anything"""
+        try:
+            grid = self.get(self.key(file_path))
+        except OSError:
+            return None
+        return grid.head(max_rows) if grid is not None else None
+
+
+SHEET_CACHE = SheetCache() if USE_SHEET_CACHE else None
+
+
+def load_sheet_grid(file_path, max_rows=None):
+    """read_sheet_grid through the sheet cache for workbooks (CSV files are read directly)"""
+    if SHEET_CACHE is None or file_path.suffix.lower() not in ['.xls', '.xlsx']:
+        return read_sheet_grid(file_path, max_rows)
+    return SHEET_CACHE.load(file_path, max_rows)
+
+
+class GridProcessPool:
+    """Decodes workbooks in worker processes; only grid file paths cross the process boundary"""
+
+    def __init__(self, max_workers=None):
+        # Spawned workers don't inherit the GUI's threads and Qt state
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def map_grids(self, files, max_rows=None, window=None, slot=None):
+        """Yield (file_path, MappedGrid or exception) as files finish; callers must close each grid
+
+        At most `window` files (default twice the workers) are in flight or waiting to be consumed,
+        so the spill directory holds a bounded number of grid files however many files are mapped.
+        slot(file_path), if given, returns a context manager entered before a file is submitted and
+        exited when its worker is done with it (e.g. a share governor slot).
+        """
+        window = window or 2 * self.max_workers
+        pending_files = iter(files)
+        futures = {}
+
+        def submit_next():
+            for f in itertools.islice(pending_files, window - len(futures)):
+                held = slot(f) if slot else nullcontext()
+                held.__enter__()
+                future = self.executor.submit(extract_grid_file, str(f), max_rows)
+                # Released from the executor's thread as soon as the file is decoded (or cancelled)
+                future.add_done_callback(lambda _, held=held: held.__exit__(None, None, None))
+                futures[future] = f
+
+        try:
+            submit_next()
+            while futures:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    f = futures.pop(future)
+                    try:
+                        result = MappedGrid(future.result())
+                    except Exception as e:
+                        result = e
+                    yield f, result
+                submit_next()
+        finally:
+            # The consumer stopped early: drop queued files and the grids nobody will read
+            for future in futures:
+                if not future.cancel() and not future.exception():
+                    try:
+                        os.remove(future.result())
+                    except OSError:
+                        pass
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def normalize_text(text):
+    """Lowercase letters and digits of a text, as matched by trigrams and fuzzy search"""
+    return NORMALIZE_PATTERN.sub("", text.lower())
+
+
+def text_trigrams(text):
+    """Distinct trigrams of a text's normalized form"""
+    text = normalize_text(text)
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def fuzzy_max_edits(keyword, max_edits):
+    """Edits allowed for a keyword: up to max_edits, and one per three normalized characters"""
+    return min(max_edits, len(normalize_text(keyword)) // 3)
+
+
+def fuzzy_distance(pattern, text, max_edits):
+    """Fewest edits turning a normalized pattern into some part of a normalized text, or None if
+    more than max_edits (Myers' bit-parallel algorithm, one pass over the text)"""
+    m = len(pattern)
+    if not m:
+        return 0
+    peq = {}
+    for i, char in enumerate(pattern):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    full, last = (1 << m) - 1, 1 << (m - 1)
+    pv, mv, score = full, 0, m
+    best = m
+    for char in text:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        # The match may start anywhere in the text, so no edit is carried into the first row
+        ph = (ph << 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+        best = min(best, score)
+    return best if best <= max_edits else None
+
+
+def encode_varints(values):
+    """LEB128 bytes of non-negative integers, and the number of bytes of each"""
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        nbytes += rest > 0
+        rest >>= np.uint64(7)
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    starts = np.cumsum(nbytes) - nbytes
+    rest = values.copy()
+    for k in range(int(nbytes.max()) if len(values) else 0):
+        active = np.flatnonzero(nbytes > k)
+        more = (nbytes[active] > k + 1).astype(np.uint8) << 7
+        out[starts[active] + k] = (rest[active] & np.uint64(0x7F)).astype(np.uint8) | more
+        rest[active] >>= np.uint64(7)
+    return out.tobytes(), nbytes
+
+
+def decode_varints(data):
+    """Integers (uint64) of a buffer of LEB128 varints"""
+    data = np.asarray(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    values = (data[starts] & 0x7F).astype(np.uint64)
+    # Most values fit in one byte; only the longer ones take further rounds
+    longer = np.flatnonzero(ends > starts)
+    k = 1
+    while len(longer):
+        values[longer] |= (data[starts[longer] + k] & 0x7F).astype(np.uint64) << np.uint64(7 * k)
+        longer = longer[ends[longer] > starts[longer] + k]
+        k += 1
+    return values
+
+
+def segmented_cumsum(values, starts):
+    """Cumulative sums that restart wherever starts is True (starts[0] must be True)"""
+    totals = np.cumsum(values)
+    first = np.flatnonzero(starts)
+    base = (totals[first] - values[first])[np.cumsum(starts) - 1]
+    return totals - base
+
+
+def expand_postings(values, term_starts):
+    """(file_ids, sheets, rows, cols) of postings decoded from their varint fields
+
+    Per posting: file id delta (absolute at the start of a term), sheet, row delta (absolute at the
+    start of a file or sheet) and col.
+    """
+    fields = values.reshape(-1, 4).astype(np.int64)
+    file_deltas, sheets, row_values, cols = fields.T
+    file_ids = segmented_cumsum(file_deltas, term_starts)
+    new_run = term_starts | (file_deltas != 0)
+    new_run[1:] |= sheets[1:] != sheets[:-1]
+    return file_ids, sheets, segmented_cumsum(row_values, new_run), cols
+
+
+def encode_postings(t, f, sh, r, c, nterms):
+    """Varint bytes of postings sorted by term (0 to nterms - 1), file, sheet, row and col, the
+    byte offset of each term's postings (nterms + 1 of them) and each term's doc freq"""
+    term_starts = np.ones(len(t), dtype=bool)
+    term_starts[1:] = t[1:] != t[:-1]
+    new_file = term_starts.copy()
+    new_file[1:] |= f[1:] != f[:-1]
+    new_run = new_file.copy()
+    new_run[1:] |= sh[1:] != sh[:-1]
+    file_deltas = f.copy()
+    file_deltas[1:] -= np.where(term_starts[1:], 0, f[:-1])
+    row_values = r.copy()
+    row_values[1:] -= np.where(new_run[1:], 0, r[:-1])
+    postings, nbytes = encode_varints(np.column_stack([file_deltas, sh, row_values, c]).ravel())
+
+    posting_ends = np.zeros(len(t) + 1, dtype=np.int64)
+    np.cumsum(nbytes.reshape(-1, 4).sum(axis=1), out=posting_ends[1:])
+    first_posting = np.zeros(nterms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(t, minlength=nterms), out=first_posting[1:])
+    doc_freqs = np.bincount(t[new_file], minlength=nterms).astype(np.int32)
+    return postings, posting_ends[first_posting], doc_freqs
+
+
+def encode_postings_after(previous, f, sh, r, c):
+    """Varint bytes and doc freq of more postings of one term, following the posting previous
+    (file, sheet, row, col) or starting the term when it is None"""
+    if previous is None:
+        postings, _, doc_freqs = encode_postings(np.zeros(len(f), dtype=np.int64), f, sh, r, c, 1)
+        return postings, int(doc_freqs[0])
+    # Encode behind the previous posting, then drop its bytes (and its file from the count)
+    head = np.asarray(previous, dtype=np.int64)
+    postings, _, doc_freqs = encode_postings(np.zeros(len(f) + 1, dtype=np.int64),
+                                             *(np.r_[head[k], a] for k, a in enumerate((f, sh, r, c))), 1)
+    return postings[len(encode_varints(head)[0]):], int(doc_freqs[0]) - 1
+
+
+def write_index_segment(path, paths, sizes, mtimes, terms, term_ids, file_ids, sheets, rows, cols,
+                        magic=INDEX_MAGIC):
+    """Write an index segment from the postings (term_ids[i], file_ids[i], sheets[i], rows[i], cols[i])"""
+    # Terms are numbered in sorted order; terms without postings are dropped
+    counts = np.bincount(term_ids, minlength=len(terms))
+    order = [index for index in sorted(range(len(terms)), key=terms.__getitem__) if counts[index]]
+    rank = np.full(len(terms), -1, dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    t = rank[term_ids]
+    sort = np.lexsort((cols, rows, sheets, file_ids, t))
+    postings, posting_offsets, doc_freqs = encode_postings(
+        *(np.asarray(a, dtype=np.int64)[sort] for a in (t, file_ids, sheets, rows, cols)), len(order))
+    write_index_file(path, paths, sizes, mtimes, [terms[index] for index in order],
+                     posting_offsets, doc_freqs, postings, magic)
+
+
+def write_index_file(path, paths, sizes, mtimes, terms, posting_offsets, doc_freqs, postings,
+                     magic=INDEX_MAGIC):
+    """Write an index segment to a path (atomically) or a binary file object; postings are bytes,
+    or a binary file read from its start
+
+    Layout: header, int64 sizes[nfiles], float64 mtimes[nfiles], int64 path offsets[nfiles + 1],
+    int64 term offsets[nterms + 1], int64 posting offsets[nterms + 1], int32 doc freqs[nterms]
+    (padded to 8 bytes), then the UTF-8 paths, the sorted terms (each followed by a newline) and
+    the postings of each term, sorted by file, sheet, row and col.
+    """
+    nterms = len(terms)
+    encoded_paths = [str(p).encode("utf-8") for p in paths]
+    path_offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in encoded_paths], out=path_offsets[1:])
+    encoded_terms = [term.encode("utf-8") + b"\n" for term in terms]
+    term_offsets = np.zeros(nterms + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in encoded_terms], out=term_offsets[1:])
+
+    def write(out):
+        out.write(INDEX_HEADER.pack(magic, len(paths), nterms, int(path_offsets[-1]),
+                                    int(term_offsets[-1]), int(posting_offsets[-1])))
+        out.write(np.asarray(sizes, dtype=np.int64).tobytes())
+        out.write(np.asarray(mtimes, dtype=np.float64).tobytes())
+        for array in (path_offsets, term_offsets, np.asarray(posting_offsets, dtype=np.int64),
+                      np.asarray(doc_freqs, dtype=np.int32)):
+            out.write(array.tobytes())
+        if nterms % 2:
+            out.write(b"\0" * 4)  # Keep the blobs 8-byte aligned
+        out.write(b"".join(encoded_paths))
+        out.write(b"".join(encoded_terms))
+        if isinstance(postings, bytes):
+            out.write(postings)
+        else:
+            postings.seek(0)
+            shutil.copyfileobj(postings, out, 1024 * 1024)
+
+    if not isinstance(path, (str, os.PathLike)):
+        write(path)
+        return
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=Path(path).parent)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            write(out)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class IndexSegment:
+    """Read-only, memory-mapped index segment; nothing is decoded until it is looked up
+
+    Segments kept in memory (see MEMORY_INDEXES) are read the same way from their bytes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if isinstance(path, bytes):
+            self.mm = path
+        else:
+            with open(path, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, nfiles, nterms, path_bytes, term_bytes, posting_bytes = INDEX_HEADER.unpack_from(self.mm, 0)
+        if magic not in (INDEX_MAGIC, INDEX_WORDS_MAGIC):
+            self.close()
+            raise ValueError(f"Not an index segment: {path}")
+        self.trigrams = magic == INDEX_MAGIC
+        self.nfiles, self.nterms = nfiles, nterms
+        pos = INDEX_HEADER.size
+        self.sizes = np.frombuffer(self.mm, dtype=np.int64, count=nfiles, offset=pos)
+        pos += 8 * nfiles
+        self.mtimes = np.frombuffer(self.mm, dtype=np.float64, count=nfiles, offset=pos)
+        pos += 8 * nfiles
+        self.path_offsets = np.frombuffer(self.mm, dtype=np.int64, count=nfiles + 1, offset=pos)
+        pos += 8 * (nfiles + 1)
+        self.term_offsets = np.frombuffer(self.mm, dtype=np.int64, count=nterms + 1, offset=pos)
+        pos += 8 * (nterms + 1)
+        self.posting_offsets = np.frombuffer(self.mm, dtype=np.int64, count=nterms + 1, offset=pos)
+        pos += 8 * (nterms + 1)
+        self.doc_freqs = np.frombuffer(self.mm, dtype=np.int32, count=nterms, offset=pos)
+        pos += 4 * nterms + (4 if nterms % 2 else 0)
+        self.paths_start = pos
+        self.terms_start = pos + path_bytes
+        self.postings_start = self.terms_start + term_bytes
+        self.term_bytes = term_bytes
+
+    def file_paths(self):
+        blob = self.mm[self.paths_start:self.terms_start]
+        offsets = self.path_offsets.tolist()
+        return [blob[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+    def file_path(self, file_id):
+        start = self.paths_start + int(self.path_offsets[file_id])
+        end = self.paths_start + int(self.path_offsets[file_id + 1])
+        return self.mm[start:end].decode("utf-8")
+
+    def term(self, index):
+        start = self.terms_start + int(self.term_offsets[index])
+        end = self.terms_start + int(self.term_offsets[index + 1]) - 1
+        return self.mm[start:end].decode("utf-8")
+
+    def term_position(self, key):
+        """Index of the first term in the sorted dictionary not below key (UTF-8 bytes)"""
+        lo, hi = 0, self.nterms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.terms_start + int(self.term_offsets[mid])
+            if self.mm[start:self.terms_start + int(self.term_offsets[mid + 1]) - 1] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find_term(self, term):
+        """Index of a term in the sorted dictionary, or -1"""
+        index = self.term_position(term.encode("utf-8"))
+        return index if index < self.nterms and self.term(index) == term else -1
+
+    def terms_containing(self, text):
+        """Indexes of the words (not trigram terms) that contain text"""
+        key = text.encode("utf-8")
+        found = []
+        # Trigram terms sort first; words begin after the last of them
+        words_start = self.term_position(chr(ord(TRIGRAM_PREFIX) + 1).encode("utf-8"))
+        pos = self.mm.find(key, self.terms_start + int(self.term_offsets[words_start]),
+                           self.terms_start + self.term_bytes)
+        while pos != -1:
+            index = int(np.searchsorted(self.term_offsets, pos - self.terms_start, side='right')) - 1
+            found.append(index)
+            # Continue after this term
+            pos = self.mm.find(key, self.terms_start + int(self.term_offsets[index + 1]),
+                               self.terms_start + self.term_bytes)
+        return found
+
+    def posting_values(self, indexes):
+        """Decoded varint fields of the postings of one or more terms, and where each term begins"""
+        indexes = np.atleast_1d(np.asarray(indexes, dtype=np.int64))
+        starts = self.posting_offsets[indexes]
+        lengths = self.posting_offsets[indexes + 1] - starts
+        data = np.frombuffer(self.mm, dtype=np.uint8, count=int(self.posting_offsets[-1]),
+                             offset=self.postings_start)
+        if len(indexes) == 1:
+            values = decode_varints(data[int(starts[0]):int(starts[0] + lengths[0])])
+            term_starts = np.zeros(len(values) // 4, dtype=bool)
+            term_starts[:1] = True
+            return values, term_starts
+        # Gather the byte ranges of all terms at once, marking where each one begins
+        range_starts = np.cumsum(lengths) - lengths
+        data = data[np.repeat(starts - range_starts, lengths) + np.arange(int(lengths.sum()))]
+        range_first = np.zeros(len(data), dtype=bool)
+        range_first[range_starts[lengths > 0]] = True
+        ends = np.flatnonzero(data < 0x80)
+        value_starts = np.zeros(len(ends), dtype=np.int64)
+        value_starts[1:] = ends[:-1] + 1
+        return decode_varints(data), range_first[value_starts[::4]]
+
+    def postings(self, indexes):
+        """(file_ids, sheets, rows, cols) of the postings of one or more terms, term by term"""
+        return expand_postings(*self.posting_values(indexes))
+
+    def file_ids(self, indexes):
+        """Sorted ids of the files holding any of the given terms"""
+        values, term_starts = self.posting_values(indexes)
+        ids = segmented_cumsum(values[0::4].astype(np.int64), term_starts)
+        if len(term_starts) and term_starts.sum() > 1:
+            return np.unique(ids)
+        first = np.ones(len(ids), dtype=bool)
+        first[1:] = ids[1:] != ids[:-1]
+        return ids[first]
+
+    def terms(self):
+        """The whole sorted term dictionary"""
+        return bytes(self.mm[self.terms_start:self.postings_start]).decode("utf-8").split("\n")[:-1]
+
+    def range_postings(self, lo, hi):
+        """(term_ids, file_ids, sheets, rows, cols) of the postings of terms lo to hi - 1 (for merging)"""
+        start, end = int(self.posting_offsets[lo]), int(self.posting_offsets[hi])
+        data = np.frombuffer(self.mm, dtype=np.uint8, count=end - start, offset=self.postings_start + start)
+        values = decode_varints(data)
+        # Byte offset of each posting, to find where each term's postings begin
+        value_starts = np.zeros(len(values), dtype=np.int64)
+        value_starts[1:] = np.flatnonzero(data < 0x80)[:-1] + 1
+        first_posting = np.searchsorted(value_starts[::4], self.posting_offsets[lo:hi + 1] - start)
+        term_ids = np.repeat(np.arange(lo, hi), np.diff(first_posting))
+        term_starts = np.zeros(len(term_ids), dtype=bool)
+        term_starts[first_posting[:-1][np.diff(first_posting) > 0]] = True
+        return (term_ids,) + expand_postings(values, term_starts)
+
+    def term_posting_chunks(self, index, max_bytes):
+        """(file_ids, sheets, rows, cols) of one term's postings, in pieces of up to max_bytes"""
+        start, end = int(self.posting_offsets[index]), int(self.posting_offsets[index + 1])
+        data = np.frombuffer(self.mm, dtype=np.uint8, count=end - start, offset=self.postings_start + start)
+        previous = None
+        pos = 0
+        while pos < len(data):
+            # Cut after the last whole posting (4 varints) in the window
+            window = data[pos:pos + max(max_bytes, 40)]
+            ends = np.flatnonzero(window < 0x80)
+            if pos + len(window) < len(data):
+                ends = ends[3::4]
+            values = decode_varints(window[:int(ends[-1]) + 1])
+            pos += int(ends[-1]) + 1
+            # Decode behind the previous posting so deltas continue from it
+            if previous is not None:
+                values = np.r_[np.asarray(previous + (0,), dtype=np.uint64), values]
+            term_starts = np.zeros(len(values) // 4, dtype=bool)
+            term_starts[0] = True
+            file_ids, sheets, rows, cols = expand_postings(values, term_starts)
+            if previous is not None:
+                file_ids, sheets, rows, cols = file_ids[1:], sheets[1:], rows[1:], cols[1:]
+            previous = (int(file_ids[-1]), int(sheets[-1]), int(rows[-1]))
+            yield file_ids, sheets, rows, cols
+
+    def close(self):
+        # The numpy views must go before the mapping can be closed
+        self.sizes = self.mtimes = self.path_offsets = self.term_offsets = None
+        self.posting_offsets = self.doc_freqs = None
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+
+
+def index_dir(folder_path):
+    """Index directory of a folder, keyed on its path as typed (no realpath: that would be a round
+    trip to the share, and this is called on the GUI thread)"""
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(str(folder_path))).encode("utf-8")).hexdigest()[:16]
+    return INDEX_DIR / key
+
+
+def index_segment_paths(directory):
+    """Segment files of an index, oldest first"""
+    return sorted(Path(directory).glob("seg-*.kidx"))
+
+
+class FolderIndex:
+    """All segments of a folder's index; for a file indexed more than once the newest segment wins
+
+    Files are numbered across segments, each segment's after the previous one's, so lookups
+    yield sorted arrays of file numbers instead of sets of paths. Given sources (segment bytes),
+    the index is the in-memory one of an ad-hoc folder instead of the segment files.
+    """
+
+    def __init__(self, directory, sources=None):
+        self.directory = Path(directory)
+        self.in_memory = sources is not None
+        self.segments = []
+        for source in index_segment_paths(self.directory) if sources is None else sources:
+            try:
+                self.segments.append(IndexSegment(source if self.in_memory else str(source)))
+            except (OSError, ValueError, struct.error) as e:
+                print(f"Skipped index segment {'(in memory)' if self.in_memory else source}: {e}")
+        self.term_cache = {}
+        self.bases = np.zeros(len(self.segments) + 1, dtype=np.int64)
+        np.cumsum([segment.nfiles for segment in self.segments], out=self.bases[1:])
+        self.entries = {}  # path -> (file number, size, mtime)
+        live = np.zeros(int(self.bases[-1]), dtype=bool)
+        for number in range(len(self.segments) - 1, -1, -1):
+            segment = self.segments[number]
+            base = int(self.bases[number])
+            stats = zip(segment.file_paths(), segment.sizes.tolist(), segment.mtimes.tolist())
+            for file_id, (path, size, mtime) in enumerate(stats):
+                if path not in self.entries:
+                    self.entries[path] = (base + file_id, size, mtime)
+                    live[base + file_id] = True
+        # Per-segment views of which files are the newest entry of their path
+        self.live = [live[self.bases[number]:self.bases[number + 1]] for number in range(len(self.segments))]
+        # Substrings are only looked up by trigram when every live file has them
+        self.trigrams = all(segment.trigrams for segment, segment_live in zip(self.segments, self.live)
+                            if segment_live.any())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    def stat(self, path):
+        """(size, mtime) a file had when it was indexed, or None"""
+        entry = self.entries.get(path)
+        return entry[1:] if entry else None
+
+    def has_trigrams(self, path):
+        """Whether a file's entry holds trigrams (it was indexed after they were introduced)"""
+        entry = self.entries.get(path)
+        if entry is None:
+            return False
+        return self.segments[int(np.searchsorted(self.bases, entry[0], side='right')) - 1].trigrams
+
+    def term_indexes(self, token, whole=True):
+        """[(segment number, term index), ...] of the terms equal to (or containing) a token"""
+        key = (token, whole)
+        if key not in self.term_cache:
+            found = []
+            for number, segment in enumerate(self.segments):
+                if whole:
+                    index = segment.find_term(token)
+                    found.extend([(number, index)] if index != -1 else [])
+                else:
+                    found.extend((number, index) for index in segment.terms_containing(token))
+            self.term_cache[key] = found
+        return self.term_cache[key]
+
+    def doc_freq(self, token, whole=True):
+        """Number of indexed files with the token (an upper bound when matching inside terms)"""
+        return sum(int(self.segments[number].doc_freqs[index])
+                   for number, index in self.term_indexes(token, whole))
+
+    def files_with_token(self, token, whole=True, cell=None):
+        """Sorted numbers of the files with a cell containing the token (as a whole term, or inside
+        one), optionally only in the cell at a 0-based (row, col)"""
+        by_segment = {}
+        for number, index in self.term_indexes(token, whole):
+            by_segment.setdefault(number, []).append(index)
+        found = []
+        for number, indexes in sorted(by_segment.items()):
+            segment = self.segments[number]
+            if cell is None:
+                ids = segment.file_ids(indexes)
+            else:
+                ids, _, rows, cols = segment.postings(indexes)
+                ids = np.unique(ids[(rows == cell[0]) & (cols == cell[1])])
+            found.append(ids[self.live[number][ids]] + self.bases[number])
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+    def term_tokens(self, field, value, exact_match):
+        """[(token, whole, cell)] every file satisfying a query term has, or None if unknown
+
+        A cell matching a value (whole, or as a substring) contains every word of it, each one a
+        whole term or part of one, and its text every trigram of it. Dates are normalized when
+        parsed, so they aren't looked up.
+        """
+        if field == "cell":
+            row, col, value = value
+        if field == "date" or not value:
+            return None
+        whole = exact_match and field is None
+        if not whole and self.trigrams and len(normalize_text(value)) >= 3:
+            # A substring's trigrams all belong to the text holding it (posted at its first cell,
+            # so not for a particular cell)
+            found = [(TRIGRAM_PREFIX + gram, True, None) for gram in text_trigrams(value)]
+        else:
+            tokens = INDEX_TOKEN_PATTERN.findall(value.lower())
+            if not tokens:
+                return None
+            found = [(token, whole, (row, col) if field == "cell" else None) for token in set(tokens)]
+        if field in QUERY_LABEL_FIELDS:
+            label = QUERY_LABEL_FIELDS[field].lower()
+            if self.trigrams:
+                found += [(TRIGRAM_PREFIX + gram, True, None) for gram in text_trigrams(label)]
+            else:
+                found += [(token, False, None) for token in INDEX_TOKEN_PATTERN.findall(label)]
+        return found
+
+    def fuzzy_files(self, text, max_edits):
+        """Numbers of the files with a text that may be within max_edits edits of text (in part),
+        or None when the index can't tell
+
+        Each edit breaks at most three trigrams, so such a text shares at least all but
+        3 * max_edits of the keyword's distinct trigrams.
+        """
+        grams = text_trigrams(text)
+        needed = len(grams) - 3 * max_edits
+        if not self.trigrams or needed <= 0:
+            return None
+        by_segment = {}
+        for gram in grams:
+            for number, index in self.term_indexes(TRIGRAM_PREFIX + gram):
+                by_segment.setdefault(number, []).append(index)
+        found = []
+        for number, indexes in sorted(by_segment.items()):
+            if len(indexes) < needed:
+                continue
+            # Count the keyword's trigrams per text (identified by its first cell)
+            ids, sheets, rows, cols = self.segments[number].postings(indexes)
+            order = np.lexsort((cols, rows, sheets, ids))
+            ids, sheets, rows, cols = ids[order], sheets[order], rows[order], cols[order]
+            new_text = np.ones(len(ids), dtype=bool)
+            new_text[1:] = ((ids[1:] != ids[:-1]) | (sheets[1:] != sheets[:-1])
+                            | (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1]))
+            starts = np.flatnonzero(new_text)
+            counts = np.diff(np.r_[starts, len(ids)])
+            ids = np.unique(ids[starts[counts >= needed]])
+            found.append(ids[self.live[number][ids]] + self.bases[number])
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+    def estimate(self, node, exact_match):
+        """Upper bound of the indexed files matching a query node (inf if unknown)"""
+        kind = node[0]
+        if kind == "term":
+            tokens = self.term_tokens(node[1], node[2], exact_match)
+            return min(self.doc_freq(token, whole) for token, whole, _ in tokens) if tokens else float("inf")
+        if kind == "or":
+            return sum(self.estimate(child, exact_match) for child in node[1])
+        if kind == "and":
+            return min(self.estimate(child, exact_match) for child in node[1])
+        return float("inf")
+
+    def query_files(self, node, exact_match):
+        """Numbers of the indexed files that may satisfy a query node, or None when the index can't
+        narrow it down
+
+        AND intersects its operands rarest first (by document frequency) and stops once nothing
+        is left; NOT can't be answered from words alone, so it narrows nothing.
+        """
+        kind = node[0]
+        if kind == "term":
+            tokens = self.term_tokens(node[1], node[2], exact_match)
+            if tokens is None:
+                return None
+            node = ("and", [("token",) + token for token in tokens])
+            kind = "and"
+        if kind == "token":
+            return self.files_with_token(*node[1:])
+        if kind == "fuzzy":
+            return self.fuzzy_files(node[1], node[2])
+        if kind == "or":
+            found = []
+            for child in node[1]:
+                files = self.query_files(child, exact_match)
+                if files is None:
+                    return None
+                found.append(files)
+            return np.unique(np.concatenate(found))
+        if kind == "and":
+            found = None
+            for child in sorted(node[1], key=lambda child: self.token_estimate(child, exact_match)):
+                # A word every indexed file has (e.g. a header label) can't rule any out
+                if (child[0] == "token" and child[2] and child[3] is None
+                        and self.doc_freq(child[1]) >= self.bases[-1]):
+                    continue
+                files = self.query_files(child, exact_match)
+                if files is not None:
+                    found = files if found is None else np.intersect1d(found, files, assume_unique=True)
+                if found is not None and not len(found):
+                    break
+            return found
+        return None
+
+    def token_estimate(self, node, exact_match):
+        if node[0] == "token":
+            return self.doc_freq(node[1], node[2])
+        return self.estimate(node, exact_match)
+
+    def candidates(self, files, file_stats, query, exact_match):
+        """Files a query still has to check, and how many the index ruled out
+
+        Files that aren't indexed or changed since are always kept.
+        """
+        possible = self.query_files(query, exact_match)
+        if possible is None:
+            return list(files), 0
+        matched = np.zeros(int(self.bases[-1]), dtype=bool)
+        matched[possible] = True
+        kept = []
+        for f in files:
+            entry = self.entries.get(str(f))
+            if entry is None or matched[entry[0]] or entry[1:] != tuple(file_stats.get(str(f), ())):
+                kept.append(f)
+        return kept, len(files) - len(kept)
+
+
+class IndexWriter:
+    """Collects the postings of decoded sheets and appends them to an index as a new segment
+    (or, without a directory, makes an in-memory segment of them)"""
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory) if directory is not None else None
+        self.paths, self.sizes, self.mtimes = [], [], []
+        self.terms = {}  # term -> term id
+        self.chunks = []  # (term_ids, file_ids, sheets, rows, cols) per added sheet
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, file_path, size, mtime, grid, sheet=0):
+        file_id = len(self.paths)
+        self.paths.append(str(file_path))
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+
+        # Each distinct text is tokenized once; its terms are spread over the cells using it
+        term_ptr = np.zeros(grid.nstrings + 1, dtype=np.int64)
+        string_terms = []
+        for code in range(grid.nstrings):
+            tokens = set(INDEX_TOKEN_PATTERN.findall(grid.string(code).lower()))
+            string_terms.extend(self.terms.setdefault(token, len(self.terms)) for token in tokens)
+            term_ptr[code + 1] = len(string_terms)
+        string_terms = np.asarray(string_terms, dtype=np.int64)
+        counts = np.diff(term_ptr)[grid.codes]
+        cells = np.repeat(np.arange(len(grid.codes)), counts)
+        within = np.arange(len(cells)) - np.repeat(np.cumsum(counts) - counts, counts)
+        term_ids = string_terms[term_ptr[grid.codes][cells] + within]
+        self.chunks.append((term_ids, np.full(len(cells), file_id), np.full(len(cells), sheet),
+                            grid.rows[cells], grid.cols[cells]))
+
+        # Trigrams of each distinct text, posted once at the first cell using it
+        gram_ids, gram_cells = [], []
+        codes, first_cells = np.unique(grid.codes, return_index=True)
+        for code, cell in zip(codes.tolist(), first_cells.tolist()):
+            grams = text_trigrams(grid.string(code))
+            gram_ids.extend(self.terms.setdefault(TRIGRAM_PREFIX + gram, len(self.terms)) for gram in grams)
+            gram_cells.extend([cell] * len(grams))
+        cells = np.asarray(gram_cells, dtype=np.int64)
+        self.chunks.append((np.asarray(gram_ids, dtype=np.int64), np.full(len(cells), file_id),
+                            np.full(len(cells), sheet), grid.rows[cells], grid.cols[cells]))
+
+    def collected(self):
+        """Terms (by term id) and the (term_ids, file_ids, sheets, rows, cols) of what was added"""
+        terms = [None] * len(self.terms)
+        for term, term_id in self.terms.items():
+            terms[term_id] = term
+        columns = [np.concatenate([chunk[k] for chunk in self.chunks]) if self.chunks else np.zeros(0, np.int64)
+                   for k in range(5)]
+        return terms, columns
+
+    def segment_bytes(self):
+        """What was added, as a segment kept in memory"""
+        out = io.BytesIO()
+        terms, columns = self.collected()
+        write_index_segment(out, self.paths, self.sizes, self.mtimes, terms, *columns)
+        return out.getvalue()
+
+    def commit(self):
+        """Write what was added as the next segment of the index"""
+        if not self.paths:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        terms, columns = self.collected()
+        with INDEX_LOCK:
+            segments = index_segment_paths(self.directory)
+            number = int(segments[-1].stem.split("-")[1]) + 1 if segments else 1
+            write_index_segment(self.directory / f"seg-{number:08d}.kidx", self.paths, self.sizes,
+                                self.mtimes, terms, *columns)
+        self.paths, self.sizes, self.mtimes = [], [], []
+        self.terms, self.chunks = {}, []
+
+
+INDEX_LOCK = threading.Lock()
+INDEX_MERGES = set()  # Index directories being merged
+MEMORY_INDEXES = {}  # Index directory -> segments (bytes) made by searches of a folder without an index
+
+
+def open_folder_index(folder_path):
+    """A folder's index: its segment files, else the in-memory one of earlier searches, or None"""
+    directory = index_dir(folder_path)
+    if index_segment_paths(directory):
+        return FolderIndex(directory)
+    with INDEX_LOCK:
+        sources = list(MEMORY_INDEXES.get(directory, ()))
+    return FolderIndex(directory, sources) if sources else None
+
+
+def remember_memory_segments(folder_path, segments):
+    """Add segments to a folder's in-memory index; only the MEMORY_INDEX_FOLDERS folders
+    extended last keep theirs"""
+    if not segments:
+        return
+    directory = index_dir(folder_path)
+    with INDEX_LOCK:
+        MEMORY_INDEXES[directory] = MEMORY_INDEXES.pop(directory, []) + segments
+        while len(MEMORY_INDEXES) > MEMORY_INDEX_FOLDERS:
+            del MEMORY_INDEXES[next(iter(MEMORY_INDEXES))]
+
+
+def merge_index_segments(directory):
+    """Compact all segments of an index into one holding only the newest entry of each file
+
+    The merged segment takes the place of the newest one it includes, so segments written
+    meanwhile stay newer. Postings are merged a range of terms at a time through a spill file,
+    so memory stays bounded however large the index grows. The merge reads and writes without
+    INDEX_LOCK (commits only add newer segments); the lock is held just to swap the segments.
+    """
+    with tempfile.TemporaryFile(dir=directory) as spill:
+        index = FolderIndex(directory)
+        try:
+            if len(index.segments) <= 1:
+                return
+            paths, sizes, mtimes, file_maps = [], [], [], []
+            for number, segment in enumerate(index.segments):
+                live = np.flatnonzero(index.live[number])
+                file_map = np.full(segment.nfiles, -1, dtype=np.int64)
+                file_map[live] = np.arange(len(paths), len(paths) + len(live))
+                file_maps.append(file_map)
+                paths.extend(segment.file_path(file_id) for file_id in live.tolist())
+                sizes.extend(segment.sizes[live].tolist())
+                mtimes.extend(segment.mtimes[live].tolist())
+
+            # Each segment's sorted terms map (in order) into the sorted union of them all
+            segment_terms = [segment.terms() for segment in index.segments]
+            terms = sorted(set().union(*segment_terms))
+            term_numbers = {term: number for number, term in enumerate(terms)}
+            term_maps = [np.array([term_numbers[term] for term in current], dtype=np.int64)
+                         for current in segment_terms]
+            del segment_terms, term_numbers
+
+            # Ranges of terms with about INDEX_MERGE_BATCH_BYTES of postings each; larger terms
+            # get a range of their own
+            term_bytes = np.zeros(len(terms), dtype=np.int64)
+            for segment, term_map in zip(index.segments, term_maps):
+                term_bytes[term_map] += np.diff(segment.posting_offsets)
+            targets = np.arange(INDEX_MERGE_BATCH_BYTES, int(term_bytes.sum()), INDEX_MERGE_BATCH_BYTES)
+            cuts = np.searchsorted(np.cumsum(term_bytes), targets, side='right')
+            large = np.flatnonzero(term_bytes > INDEX_MERGE_BATCH_BYTES)
+            bounds = np.unique(np.r_[0, cuts, large, large + 1, len(terms)]).tolist()
+
+            posting_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            doc_freqs = np.zeros(len(terms), dtype=np.int32)
+            for lo, hi in zip(bounds, bounds[1:]):
+                if term_bytes[lo] > INDEX_MERGE_BATCH_BYTES:
+                    # Stream a large term piece by piece, segment after segment
+                    previous, written, doc_freq = None, 0, 0
+                    for number, (segment, term_map) in enumerate(zip(index.segments, term_maps)):
+                        local = int(np.searchsorted(term_map, lo))
+                        if local == len(term_map) or term_map[local] != lo:
+                            continue
+                        for file_ids, sheets, rows, cols in segment.term_posting_chunks(local,
+                                                                                        INDEX_MERGE_BATCH_BYTES):
+                            keep = index.live[number][file_ids]
+                            if not keep.any():
+                                continue
+                            f = file_maps[number][file_ids[keep]]
+                            sh, r, c = sheets[keep], rows[keep], cols[keep]
+                            postings, count = encode_postings_after(previous, f, sh, r, c)
+                            spill.write(postings)
+                            written += len(postings)
+                            doc_freq += count
+                            previous = (int(f[-1]), int(sh[-1]), int(r[-1]), int(c[-1]))
+                    posting_offsets[hi] = posting_offsets[lo] + written
+                    doc_freqs[lo] = doc_freq
+                    continue
+                columns = []
+                for number, (segment, term_map) in enumerate(zip(index.segments, term_maps)):
+                    first, last = np.searchsorted(term_map, [lo, hi]).tolist()
+                    term_ids, file_ids, sheets, rows, cols = segment.range_postings(first, last)
+                    keep = index.live[number][file_ids]
+                    columns.append((term_map[term_ids[keep]] - lo, file_maps[number][file_ids[keep]],
+                                    sheets[keep], rows[keep], cols[keep]))
+                # Files are numbered segment by segment, so a stable sort by term keeps each term's
+                # postings sorted by file
+                t, f, sh, r, c = (np.concatenate([chunk[k] for chunk in columns]) for k in range(5))
+                order = np.argsort(t, kind='stable')
+                postings, offsets, freqs = encode_postings(t[order], f[order], sh[order], r[order],
+                                                           c[order], hi - lo)
+                spill.write(postings)
+                posting_offsets[lo + 1:hi + 1] = posting_offsets[lo] + offsets[1:]
+                doc_freqs[lo:hi] = freqs
+            target = Path(index.segments[-1].path)
+            old_paths = [Path(segment.path) for segment in index.segments[:-1]]
+            magic = INDEX_MAGIC if index.trigrams else INDEX_WORDS_MAGIC
+        finally:
+            index.close()
+
+        # Terms left only in replaced entries have no postings (and so no bytes) any more
+        kept = np.flatnonzero(doc_freqs)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                write_index_file(out, paths, sizes, mtimes, [terms[number] for number in kept.tolist()],
+                                 np.r_[posting_offsets[kept], posting_offsets[-1]], doc_freqs[kept], spill,
+                                 magic)
+            with INDEX_LOCK:
+                os.replace(tmp_path, target)
+                for path in old_paths:
+                    os.remove(path)
+        except OSError as e:
+            # e.g. a segment still mapped by a reader on Windows; the next merge retries
+            print(f"Failed to merge index segments in {directory}: {e}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def maybe_merge_index(directory):
+    """Merge an index in the background once it has too many segments"""
+    if len(index_segment_paths(directory)) <= INDEX_MAX_SEGMENTS:
+        return
+    # Claim the directory under the lock so two builds finishing together start one merge
+    with INDEX_LOCK:
+        if directory in INDEX_MERGES:
+            return
+        INDEX_MERGES.add(directory)
+
+    def merge():
+        try:
+            merge_index_segments(directory)
+        finally:
+            with INDEX_LOCK:
+                INDEX_MERGES.discard(directory)
+
+    Thread(target=merge, daemon=True).start()
+
+
+class SettingsDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Search Settings")
+        self.setModal(True)
+        self.resize(400, 300)
+
+        layout = QVBoxLayout(self)
+        form_layout = QFormLayout()
+
+        # Column end keywords
+        self.col_end_input = QTextEdit()
+        self.col_end_input.setMaximumHeight(80)
+        self.col_end_input.setPlaceholderText("Enter keywords separated by semicolons (e.g., E. & O.E.;SUB-TOTAL)")
+        form_layout.addRow("Column End Keywords:", self.col_end_input)
+
+        # Row end column
+        self.row_end_input = QLineEdit()
+        self.row_end_input.setPlaceholderText("Enter column letter (e.g., N)")
+        form_layout.addRow("Row End Column:", self.row_end_input)
+
+        # Max rows to scan
+        self.max_rows_input = QLineEdit()
+        self.max_rows_input.setPlaceholderText("Enter maximum rows to scan (default: 1000)")
+        form_layout.addRow("Max Rows to Scan:", self.max_rows_input)
+
+        # Early exit after the first K matching files
+        self.max_matches_input = QLineEdit()
+        self.max_matches_input.setPlaceholderText("Stop after this many matching files (default: 0 = all)")
+        form_layout.addRow("Stop After Matches:", self.max_matches_input)
+
+        # Typos a fuzzy search allows
+        self.fuzzy_edits_input = QLineEdit()
+        self.fuzzy_edits_input.setPlaceholderText(f"Edits allowed in fuzzy matches (default: {FUZZY_MAX_EDITS})")
+        form_layout.addRow("Fuzzy Max Edits:", self.fuzzy_edits_input)
+
+        # Memory budget for long scans
+        self.recycle_files_input = QLineEdit()
+        self.recycle_files_input.setPlaceholderText(
+            f"Restart the scan engine after this many files (default: {DEFAULT_MEMORY_BUDGET['recycle_files']})")
+        form_layout.addRow("Recycle After Files:", self.recycle_files_input)
+
+        self.recycle_rss_input = QLineEdit()
+        self.recycle_rss_input.setPlaceholderText(
+            f"Restart the scan engine above this memory use (default: {DEFAULT_MEMORY_BUDGET['recycle_rss_mb']})")
+        form_layout.addRow("Recycle Above (MB):", self.recycle_rss_input)
+
+        self.min_available_input = QLineEdit()
+        self.min_available_input.setPlaceholderText(
+            f"Hold back new files below this free memory (default: {DEFAULT_MEMORY_BUDGET['min_available_mb']})")
+        form_layout.addRow("Min Free Memory (MB):", self.min_available_input)
+
+        layout.addLayout(form_layout)
+
+        # Buttons
+        button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        button_box.accepted.connect(self.accept)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+
+    def get_settings(self):
+        col_end_text = self.col_end_input.toPlainText().strip()
+        col_end_keywords = set()
+        if col_end_text:
+            col_end_keywords = {k.strip() for k in col_end_text.split(';') if k.strip()}
+
+        row_end = self.row_end_input.text().strip().upper()
+        if not row_end:
+            row_end = 'N'
+
+        max_rows = self.max_rows_input.text().strip()
+        try:
+            max_rows = int(max_rows) if max_rows else 1000
+        except ValueError:
+            max_rows = 1000
+
+        max_matches = self.max_matches_input.text().strip()
+        try:
+            max_matches = max(0, int(max_matches)) if max_matches else 0
+        except ValueError:
+            max_matches = 0
+
+        fuzzy_max_edits = self.fuzzy_edits_input.text().strip()
+        try:
+            fuzzy_max_edits = max(0, int(fuzzy_max_edits)) if fuzzy_max_edits else FUZZY_MAX_EDITS
+        except ValueError:
+            fuzzy_max_edits = FUZZY_MAX_EDITS
+
+        memory_budget = {}
+        for key, line_edit in (("recycle_files", self.recycle_files_input),
+                               ("recycle_rss_mb", self.recycle_rss_input),
+                               ("min_available_mb", self.min_available_input)):
+            try:
+                memory_budget[key] = max(1, int(line_edit.text().strip()))
+            except ValueError:
+                memory_budget[key] = DEFAULT_MEMORY_BUDGET[key]
+
+        return col_end_keywords, row_end, max_rows, max_matches, fuzzy_max_edits, memory_budget
+
+    def set_settings(self, col_end_keywords, row_end, max_rows, max_matches, fuzzy_max_edits, memory_budget):
+        self.col_end_input.setPlainText(';'.join(col_end_keywords))
+        self.row_end_input.setText(row_end)
+        self.max_rows_input.setText(str(max_rows))
+        self.max_matches_input.setText(str(max_matches))
+        self.fuzzy_edits_input.setText(str(fuzzy_max_edits))
+        self.recycle_files_input.setText(str(memory_budget["recycle_files"]))
+        self.recycle_rss_input.setText(str(memory_budget["recycle_rss_mb"]))
+        self.min_available_input.setText(str(memory_budget["min_available_mb"]))
+
+
+class FolderListingWorker(QObject):
+    # Signal carrying the fresh listing back to the main thread
+    listing_ready = Signal(str, object)  # folder_path, {name: (size, mtime)}
+
+    def __init__(self, folder_path):
+        super().__init__()
+        self.folder_path = folder_path
+
+    def run(self):
+        try:
+            entries = scan_folder_entries(self.folder_path)
+        except (PermissionError, OSError) as e:
+            # Keep whatever the snapshot showed if the folder can't be reached
+            print(f"Failed to list {self.folder_path}: {e}")
+            return
+        save_folder_snapshot(self.folder_path, entries)
+        self.listing_ready.emit(str(self.folder_path), entries)
+
+
+class ShareProber(QObject):
+    # Signal emitted whenever a share has been probed
+    status_changed = Signal(str, bool)  # share name, reachable
+
+    def __init__(self, shares, timeout=SHARE_PROBE_TIMEOUT, ttl=SHARE_STATUS_TTL):
+        super().__init__()
+        self.shares = shares
+        self.timeout = timeout
+        self.ttl = ttl
+        self.status = {}  # share name -> (reachable, checked_at)
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def cached_status(self, name):
+        """Return True/False if the share was probed within the TTL, otherwise None"""
+        with self.lock:
+            entry = self.status.get(name)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def probe_all(self):
+        for name in self.shares:
+            self.probe(name)
+
+    def probe(self, name):
+        """Start a background probe of one share (all shares are probed in parallel)"""
+        with self.lock:
+            if name in self.pending:
+                return
+            self.pending.add(name)
+        Thread(target=self._probe_worker, args=(name,), daemon=True).start()
+
+    def _probe_worker(self, name):
+        reachable = self.check_path(self.shares[name])
+        with self.lock:
+            self.status[name] = (reachable, time.monotonic())
+            self.pending.discard(name)
+        self.status_changed.emit(name, reachable)
+
+    def check_path(self, path_str):
+        # A TCP connect to the SMB port fails fast when the server is down
+        share = unc_share(path_str)
+        if share:
+            try:
+                socket.create_connection((share[0], SMB_PORT), timeout=self.timeout).close()
+            except OSError:
+                return False
+
+        # Bound the filesystem check too; a hung call is left to finish in its daemon thread
+        result = []
+        checker = Thread(target=lambda: result.append(os.path.exists(path_str)), daemon=True)
+        checker.start()
+        checker.join(self.timeout)
+        return bool(result and result[0])
+
+
+class TokenBucket:
+    """Byte-rate limiter; a read larger than the bucket goes into debt and later callers wait it off"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount, should_stop=lambda: False):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        # Sleep in short steps so a stopped search doesn't hang on a long wait
+        deadline = time.monotonic() + wait
+        while not should_stop() and time.monotonic() < deadline:
+            time.sleep(min(0.2, deadline - time.monotonic()))
+
+
+class ShareGovernor:
+    """Caps concurrent opens and bytes per second on one UNC share; foreground work goes first"""
+
+    def __init__(self, limits, background_profile):
+        self.max_open = limits["max_open"]
+        self.background_max_open = min(self.max_open, background_profile["max_open"])
+        self.bucket = TokenBucket(limits["bytes_per_sec"])
+        self.background_bucket = TokenBucket(background_profile["bytes_per_sec"])
+        self.cond = threading.Condition()
+        self.open_count = 0
+        self.background_open = 0
+        self.foreground_waiting = 0
+
+    def can_open(self, background):
+        if self.open_count >= self.max_open:
+            return False
+        if background:
+            # Background scans only get a slot when no foreground search is waiting for one
+            return self.foreground_waiting == 0 and self.background_open < self.background_max_open
+        return True
+
+    @contextmanager
+    def open_slot(self, nbytes, background=False, should_stop=lambda: False):
+        with self.cond:
+            if not background:
+                self.foreground_waiting += 1
+            try:
+                while not self.can_open(background):
+                    self.cond.wait(0.5)
+            finally:
+                if not background:
+                    self.foreground_waiting -= 1
+            self.open_count += 1
+            if background:
+                self.background_open += 1
+        try:
+            if background:
+                self.background_bucket.consume(nbytes, should_stop)
+            self.bucket.consume(nbytes, should_stop)
+            yield
+        finally:
+            with self.cond:
+                self.open_count -= 1
+                if background:
+                    self.background_open -= 1
+                self.cond.notify_all()
+
+
+class ShareGovernors:
+    """One ShareGovernor per UNC host/share, with limits taken from the folders config"""
+
+    def __init__(self, folders_config):
+        self.background_profile = {**DEFAULT_BACKGROUND_PROFILE,
+                                   **folders_config.get("Profiles", {}).get("background", {})}
+        self.governors = {}
+        self.lock = threading.Lock()
+
+        # Several roots can live on one share (SIM and Service); the strictest limit wins
+        self.share_limits = {}
+        for name, path in folders_config["Folders"].items():
+            share = unc_share(path)
+            if not share:
+                continue
+            merged = self.share_limits.setdefault(share, {})
+            for key, value in folders_config["Limits"].get(name, {}).items():
+                if key in DEFAULT_SHARE_LIMITS:
+                    merged[key] = min(merged.get(key, value), value)
+
+    def for_path(self, path):
+        """Governor for the share a path lives on, or None for local paths"""
+        share = unc_share(path)
+        if not share:
+            return None
+        with self.lock:
+            if share not in self.governors:
+                limits = {**DEFAULT_SHARE_LIMITS, **self.share_limits.get(share, {})}
+                self.governors[share] = ShareGovernor(limits, self.background_profile)
+            return self.governors[share]
+
+    def is_daytime(self):
+        start, end = self.background_profile.get("daytime_hours", [0, 0])
+        return start <= time.localtime().tm_hour < end
+
+
+def share_slot(governors, file_path, nbytes=None, background=False, should_stop=lambda: False):
+    """Governor slot for reading a file, or a no-op for local files (or when governors is None)
+
+    nbytes defaults to the file's size.
+    """
+    governor = governors.for_path(file_path) if governors else None
+    if governor is None:
+        return nullcontext()
+    if nbytes is None:
+        try:
+            nbytes = Path(file_path).stat().st_size
+        except OSError:
+            nbytes = 0
+    return governor.open_slot(nbytes, background, should_stop)
+
+
+class AdaptiveConcurrency:
+    """Hill-climbing AIMD controller for the number of files in flight
+
+    Every window of completions the files/s rate is compared with the previous window. A clear gain
+    keeps the current direction, a clear loss reverses it, and a flat rate probes upwards unless
+    per-file latency is climbing (more files in flight only queue up). Steps up add one file,
+    steps down cut the limit by a quarter.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=MAX_ADAPTIVE_WORKERS):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = max(minimum, min(initial, self.maximum))
+        self.best_rate = 0.0
+        self.best_limit = self.limit
+        self.prev_rate = 0.0
+        self.direction = 1
+        self.min_latency = None
+        self.active = 0
+        self.lock = threading.Condition()
+        self.reset_window()
+
+    def reset_window(self):
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.window_latency = 0.0
+
+    @contextmanager
+    def slot(self):
+        """Gate around scanning one file: at most `limit` files are being scanned at once"""
+        with self.lock:
+            while self.active >= self.limit:
+                self.lock.wait(0.5)
+            self.active += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.lock.notify_all()
+            self.record(time.monotonic() - started)
+
+    def record(self, latency):
+        with self.lock:
+            self.window_count += 1
+            self.window_latency += latency
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            if self.window_count >= max(4, self.limit):
+                self.adjust()
+
+    def adjust(self):
+        elapsed = max(time.monotonic() - self.window_start, 1e-6)
+        rate = self.window_count / elapsed
+        avg_latency = self.window_latency / self.window_count
+
+        if rate > self.best_rate:
+            self.best_rate = rate
+            self.best_limit = self.limit
+
+        if rate > self.prev_rate * 1.05:
+            pass  # Keep going the same way
+        elif rate < self.prev_rate * 0.95:
+            self.direction = -self.direction
+        else:
+            self.direction = -1 if avg_latency > 1.5 * max(self.min_latency, 0.001) else 1
+        self.prev_rate = rate
+
+        if self.direction > 0:
+            self.limit = min(self.maximum, self.limit + 1)
+        else:
+            self.limit = max(self.minimum, int(self.limit * 0.75))
+        self.reset_window()
+        self.lock.notify_all()
+
+
+class ScanScheduler:
+    """Hands out files for scanning using the sizes already known from the directory listing
+
+    Small files go through a fast lane in priority order (see scan_priority), large files through a
+    slow lane capped at a quarter of the in-flight limit (at least one), largest first so the longest
+    jobs start early instead of finishing last. Once the fast lane is empty the cap no longer applies.
+    """
+
+    def __init__(self, files, file_stats, keywords=(), large_file_bytes=LARGE_FILE_BYTES):
+        self.large_files = set()
+        self.sizes = {}
+        small, large = [], []
+        for file_path in files:
+            size = file_stats.get(str(file_path), (0, 0))[0]
+            self.sizes[file_path] = size
+            if size >= large_file_bytes:
+                large.append((size, file_path))
+                self.large_files.add(file_path)
+            else:
+                small.append(file_path)
+        small.sort(key=lambda f: scan_priority(f, file_stats.get(str(f), (0, None))[1], keywords))
+        self.fast_lane = deque(small)
+        self.slow_lane = deque(file_path for size, file_path in sorted(large, key=lambda x: x[0], reverse=True))
+        self.large_in_flight = 0
+
+    def next_file(self, limit):
+        """Next file to submit, or None if nothing may be submitted right now"""
+        large_cap = max(1, limit // 4)
+        if self.slow_lane and (self.large_in_flight < large_cap or not self.fast_lane):
+            self.large_in_flight += 1
+            return self.slow_lane.popleft()
+        if self.fast_lane:
+            return self.fast_lane.popleft()
+        return None
+
+    def next_batch(self, limit):
+        """Next group of files for one task: a large file on its own, or a size-balanced run of small ones
+
+        Batches shrink when few files are left so every worker still gets about two batches.
+        """
+        file_path = self.next_file(limit)
+        if file_path is None:
+            return None
+        batch = [file_path]
+        if file_path in self.large_files:
+            return batch
+
+        max_files = max(1, min(BATCH_MAX_FILES, len(self.fast_lane) // (2 * limit)))
+        batch_bytes = self.sizes[file_path]
+        while len(batch) < max_files and self.fast_lane \
+                and batch_bytes + self.sizes[self.fast_lane[0]] <= BATCH_BYTES:
+            file_path = self.fast_lane.popleft()
+            batch_bytes += self.sizes[file_path]
+            batch.append(file_path)
+        return batch
+
+    def file_done(self, file_path):
+        if file_path in self.large_files:
+            self.large_in_flight -= 1
+
+    def requeue(self, files):
+        """Put files handed out but never scanned back at the front of the fast lane, in order"""
+        self.fast_lane.extendleft(reversed(files))
+
+
+class ScanBatch:
+    """Files scanned by one task, in order, and their compact results (matched text or None per file)"""
+
+    def __init__(self, files):
+        self.files = files
+        self.results = []
+        self.last_activity = None  # When the file being scanned started; None while queued
+        self.abandoned = False  # Set on timeout: the task stops after the stuck file
+        self.lock = threading.Lock()  # Guards results, last_activity and abandoned together
+
+
+class SearchWorker(QObject):
+    # Signals to communicate back to the main thread
+    update_result = Signal(str, str, str)  # file_path, file_name, found_text
+    started_file = Signal(str)  # file_path
+    finished_file = Signal(str, str)  # file_path, file_name
+    finished = Signal()
+    progress_update = Signal(int, int)  # current, total
+
+    def __init__(self, files, keywords, exact_match, col_end_keywords=None, row_end='N', max_rows=1000,
+                 max_workers=MAX_ADAPTIVE_WORKERS, file_stats=None, governors=None, background=False,
+                 tuning_key=None, max_matches=0, file_filter=None,
+                 min_available_mb=DEFAULT_MEMORY_BUDGET["min_available_mb"], folder_path=None):
+        super().__init__()
+        self.files = files
+        self.file_filter = file_filter
+        self.folder_path = folder_path  # Folder whose index the files are planned against, if any
+        self.report = {}  # Index planning figures, picklable so the scan engine can send them back
+        self.min_available_mb = min_available_mb
+        self.peak_rss = 0
+        self.memory_low = False
+        self.memory_checked_at = 0.0
+        self.max_matches = max_matches  # Stop after this many matching files (0 = scan everything)
+        self.match_count = 0
+        self.file_stats = file_stats or {}  # str(path) -> (size, mtime) from the directory listing
+        self.governors = governors
+        self.background = background
+        self.keywords = keywords
+        self.exact_match = exact_match
+        self.col_end_keywords = col_end_keywords or set()
+        self.row_end = row_end
+        self.max_rows = max_rows
+        self.should_stop = False
+        self.draining = False  # Finish the files in flight but don't start new ones
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+        # The pool is sized for the ceiling; the controller decides how many files are actually in flight
+        self.tuning_key = tuning_key
+        initial = (load_worker_tuning(tuning_key) if tuning_key else None) or DEFAULT_WORKERS
+        self.concurrency = AdaptiveConcurrency(initial, maximum=max_workers)
+
+        # Set for multi-root searches so results show which root they came from
+        self.root_label = None
+        self.root_path = None
+
+    def stop(self):
+        self.should_stop = True
+        self.executor.shutdown(wait=False)
+
+    def drain(self):
+        self.draining = True
+
+    def plan(self, files):
+        """Files the folder's index (or its in-memory one) can't rule out; without an index, all of them"""
+        if self.folder_path is None:
+            return files
+        started = time.perf_counter()
+        index = open_folder_index(self.folder_path)
+        if index is None:
+            return files
+        with index:
+            candidates, ruled_out = index.candidates(files, self.file_stats, keywords_query(self.keywords),
+                                                     self.exact_match)
+        self.report.update(ruled_out=ruled_out, files=len(files), plan_seconds=time.perf_counter() - started)
+        return candidates
+
+    def get_column_number(self, col_letter):
+        """Convert column letter to number (A=1, B=2, etc.)"""
+        result = 0
+        for char in col_letter:
+            result = result * 26 + (ord(char) - ord('A') + 1)
+        return result
+
+    def display_name(self, file_path):
+        """Name shown in the result list (prefixed with the root label in multi-root searches)"""
+        if self.root_label is None:
+            return file_path.name
+        return f"{self.root_label}: {os.path.relpath(file_path, self.root_path)}"
+
+    def sample_memory(self):
+        """Record peak RSS and whether the system is low on memory (rate limited)"""
+        now = time.monotonic()
+        if now - self.memory_checked_at < MEMORY_CHECK_INTERVAL:
+            return
+        self.memory_checked_at = now
+        self.peak_rss = max(self.peak_rss, process_rss())
+        available = available_memory()
+        self.memory_low = available is not None and available < self.min_available_mb * 1024 * 1024
+
+    def file_size(self, file_path):
+        stat = self.file_stats.get(str(file_path))
+        if stat:
+            return stat[0]
+        try:
+            return file_path.stat().st_size
+        except OSError:
+            return 0
+
+    def search_file(self, file_path):
+        if self.should_stop:
+            return None
+
+        # Files on a network share go through that share's I/O governor
+        governor = self.governors.for_path(file_path) if self.governors else None
+        if governor is None:
+            return self.scan_file(file_path)
+        with governor.open_slot(self.file_size(file_path), self.background, lambda: self.should_stop):
+            if self.should_stop:
+                return None
+            return self.scan_file(file_path)
+
+    def matches_keyword(self, value):
+        if self.exact_match:
+            return any(value.strip() == keyword for keyword in self.keywords)
+        value = value.lower()
+        return any(keyword.lower() in value for keyword in self.keywords)
+
+    def scan_xlsx(self, file_path, max_col, limit=10):
+        """First distinct matching texts above the end row and left of max_col (None if stopped)"""
+        end_keywords = [keyword.lower() for keyword in self.col_end_keywords]
+        seen = {}  # text -> (is an end marker, matches a keyword)
+        matched = []
+        for row, cells in iter_xlsx_rows(file_path, self.max_rows):
+            if self.should_stop:
+                return None
+            found = []
+            for col, text in cells:
+                if text not in seen:
+                    lowered = text.lower()
+                    seen[text] = (any(keyword in lowered for keyword in end_keywords), self.matches_keyword(text))
+                is_end, is_match = seen[text]
+                if is_end:
+                    # The end row and everything below it are outside the search area
+                    return matched
+                if is_match and col < max_col and text not in found and text not in matched:
+                    found.append(text)
+            matched.extend(found)
+            if len(matched) >= limit:
+                return matched[:limit]
+        return matched
+
+    def scan_file(self, file_path):
+        grid = None
+        try:
+            matched_texts = set()
+            file_name = self.display_name(file_path)
+
+            # A sheet decoded before is read from the cache; otherwise stream .xlsx sheets,
+            # stopping at the end row, the row limit or the match cap
+            if file_path.suffix.lower() == '.xlsx' and SHEET_CACHE is not None:
+                grid = SHEET_CACHE.lookup(file_path, self.max_rows)
+            if file_path.suffix.lower() == '.xlsx' and grid is None:
+                texts = self.scan_xlsx(file_path, self.get_column_number(self.row_end))
+                if texts is None:
+                    return None
+                matched_texts.update(texts)
+
+            # Handle other Excel files
+            elif file_path.suffix.lower() in ['.xls', '.xlsx']:
+                # Read the file with limited rows into a sparse grid of the non-empty cells
+                if grid is None:
+                    grid = load_sheet_grid(file_path, self.max_rows)
+                if self.should_stop:
+                    return None
+
+                # Find the actual end row using column end keywords
+                end_row = grid.end_row(self.col_end_keywords)
+
+                # Limit columns based on row_end setting
+                max_col = self.get_column_number(self.row_end)
+
+                # Search only within the limited area (limit matches for performance)
+                matched_texts.update(grid.match_texts(self.matches_keyword, end_row, max_col, limit=10))
+            else:
+                # Handle plain text or CSV files
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    # Read only first 1MB for performance
+                    content = f.read(1024 * 1024)
+                    for keyword in self.keywords:
+                        if self.should_stop:
+                            return None
+                        if self.exact_match:
+                            matches = re.findall(rf'\b{re.escape(keyword)}\b', content)
+                            matched_texts.update(matches[:10])  # Limit matches
+                        else:
+                            if keyword.lower() in content.lower():
+                                matched_texts.add(keyword)
+
+            return (str(file_path), file_name, ", ".join(list(matched_texts)[:10]))
+        except Exception as e:
+            print(f"Failed to read {file_path}: {e}")
+            return None
+        finally:
+            # Unmap a cached sheet right away, so the cache can evict or replace its file
+            if grid is not None:
+                grid.close()
+
+    def run(self):
+        # Prune on listing metadata before anything is queued or opened
+        files = self.files
+        if self.file_filter and self.file_filter.is_active():
+            files = [f for f in files if self.file_filter.matches(f, *self.file_stats.get(str(f), (None, None)))]
+        # Then ask the folder's index: files that can't match are never opened
+        files = self.plan(files)
+
+        total_files = len(files)
+        scheduler = ScanScheduler(files, self.file_stats, self.keywords)
+        in_flight = {}  # future -> ScanBatch
+        completed = 0
+        timed_out = False
+
+        while not self.should_stop:
+            self.sample_memory()
+            # Bounded submission window: about two batches per allowed worker are outstanding
+            while len(in_flight) < 2 * self.concurrency.limit:
+                # Hold back new files while the system is short of memory (unless nothing is running)
+                if in_flight and self.memory_low or self.draining:
+                    break
+                files_batch = scheduler.next_batch(self.concurrency.limit)
+                if files_batch is None or self.should_stop:
+                    break
+                batch = ScanBatch(files_batch)
+                in_flight[self.executor.submit(self.search_batch, batch)] = batch
+            if not in_flight:
+                break
+
+            done, _ = concurrent.futures.wait(in_flight, timeout=1,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in list(in_flight):
+                batch = in_flight[future]
+                if future in done:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"Error processing batch of {len(batch.files)} files: {e}")
+                    handled, results = batch.files, list(batch.results)
+                else:
+                    with batch.lock:
+                        if batch.last_activity is None or now - batch.last_activity < FILE_TIMEOUT:
+                            continue
+                        # Stop waiting for the stuck file only; its thread finishes it in the background
+                        batch.abandoned = True
+                        results = list(batch.results)
+                    timed_out = True
+                    handled = batch.files[:len(results) + 1]
+                    print(f"Timeout reading {handled[-1]}")
+                    # The files after it were never started: scan them in a later batch
+                    scheduler.requeue(batch.files[len(handled):])
+                self.handle_batch(handled, results)
+                for file_path in handled:
+                    scheduler.file_done(file_path)
+                del in_flight[future]
+                completed += len(handled)
+                self.progress_update.emit(completed, total_files)
+
+        if self.tuning_key and completed >= 2 * self.concurrency.best_limit:
+            save_worker_tuning(self.tuning_key, self.concurrency.best_limit)
+        # Don't wait on a thread still stuck in a timed-out file
+        self.executor.shutdown(wait=not in_flight and not timed_out)
+        self.memory_checked_at = 0.0
+        self.sample_memory()
+        self.finished.emit()
+
+    def search_batch(self, batch):
+        """Task body: scan the batch's files one after another, recording only the matched texts"""
+        for file_path in batch.files:
+            if self.should_stop or batch.abandoned:
+                break
+            with self.concurrency.slot():
+                with batch.lock:
+                    if batch.abandoned:
+                        break
+                    batch.last_activity = time.monotonic()
+                self.started_file.emit(str(file_path))
+                result = self.search_file(file_path)
+                with batch.lock:
+                    batch.last_activity = None
+                    batch.results.append(result[2] if result and result[2] else None)
+        return batch.results
+
+    def handle_batch(self, files, results):
+        """Report the files as finished; files past the end of results (stopped or failed) matched nothing"""
+        for file_path, matched_texts in zip(files, results + [None] * (len(files) - len(results))):
+            file_name = self.display_name(file_path)
+            if matched_texts:
+                self.update_result.emit(str(file_path), file_name, matched_texts)
+                self.match_count += 1
+            self.finished_file.emit(str(file_path), file_name)
+
+        # Early exit: don't submit more files once enough matches were found
+        if self.max_matches and self.match_count >= self.max_matches:
+            self.should_stop = True
+
+
+class MultiRootSearchWorker(QObject):
+    # Same signals as SearchWorker so the GUI treats both alike
+    update_result = Signal(str, str, str)  # file_path, file_name, found_text
+    started_file = Signal(str)  # file_path
+    finished_file = Signal(str, str)  # file_path, file_name
+    finished = Signal()
+    progress_update = Signal(int, int)  # current, total
+
+    def __init__(self, roots, keywords, exact_match, col_end_keywords=None, row_end='N', max_rows=1000,
+                 limits=None, governors=None, background=False, max_matches=0, file_filter=None,
+                 min_available_mb=DEFAULT_MEMORY_BUDGET["min_available_mb"], skip_files=None):
+        super().__init__()
+        self.roots = roots  # {name: path}
+        self.keywords = keywords
+        self.exact_match = exact_match
+        self.col_end_keywords = col_end_keywords
+        self.row_end = row_end
+        self.max_rows = max_rows
+        self.limits = limits or {}
+        self.governors = governors
+        self.background = background
+        self.max_matches = max_matches
+        self.file_filter = file_filter
+        self.min_available_mb = min_available_mb
+        self.skip_files = skip_files or set()  # str paths already scanned (when resuming)
+        self.peak_rss = 0
+        self.match_count = 0
+        self.should_stop = False
+        self.draining = False
+        self.workers = []
+        self.lock = threading.Lock()
+        self.done = 0
+        self.total = 0
+
+    def stop(self):
+        self.should_stop = True
+        with self.lock:
+            for worker in self.workers:
+                worker.stop()
+
+    def drain(self):
+        with self.lock:
+            self.draining = True
+            for worker in self.workers:
+                worker.drain()
+
+    def run(self):
+        # Each root is enumerated and searched in its own thread with its own worker budget
+        threads = []
+        for name, root, excluded in plan_search_roots(self.roots):
+            thread = Thread(target=self.search_root, args=(name, root, excluded))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.peak_rss = max([worker.peak_rss for worker in self.workers] + [process_rss()])
+        self.finished.emit()
+
+    def search_root(self, name, root, excluded):
+        files = []
+        file_stats = {}
+        for file_path, size, mtime in walk_root_files(root, excluded, lambda: self.should_stop or self.draining):
+            if self.file_filter and not self.file_filter.matches(file_path, size, mtime):
+                continue
+            if str(file_path) in self.skip_files:
+                continue
+            files.append(file_path)
+            file_stats[str(file_path)] = (size, mtime)
+        if self.should_stop or self.draining or not files:
+            return
+
+        max_workers = self.limits.get(name, {}).get("workers", DEFAULT_ROOT_WORKERS)
+        worker = SearchWorker(files, self.keywords, self.exact_match, self.col_end_keywords,
+                              self.row_end, self.max_rows, max_workers=max_workers, file_stats=file_stats,
+                              governors=self.governors, background=self.background, tuning_key=root,
+                              max_matches=self.max_matches, min_available_mb=self.min_available_mb)
+        worker.root_label = name
+        worker.root_path = root
+        # Merge every root's results into one stream (direct calls: this may run without an event loop)
+        worker.update_result.connect(self.forward_result, Qt.DirectConnection)
+        worker.started_file.connect(self.started_file.emit, Qt.DirectConnection)
+        worker.finished_file.connect(self.file_done, Qt.DirectConnection)
+        with self.lock:
+            if self.should_stop or self.draining:
+                return
+            self.workers.append(worker)
+            self.total += len(files)
+        worker.run()
+
+    def forward_result(self, file_path, file_name, found_text):
+        self.update_result.emit(file_path, file_name, found_text)
+        with self.lock:
+            self.match_count += 1
+            limit_reached = self.max_matches and self.match_count >= self.max_matches
+        if limit_reached:
+            self.stop()
+
+    def file_done(self, file_path, file_name):
+        with self.lock:
+            self.done += 1
+            done, total = self.done, self.total
+        self.finished_file.emit(file_path, file_name)
+        self.progress_update.emit(done, total)
+
+
+class HeaderFilterWorker(QObject):
+    # Same signals as SearchWorker so the GUI treats both alike
+    update_result = Signal(str, str, str)  # file_path, file_name, found_text
+    started_file = Signal(str)  # file_path
+    finished_file = Signal(str, str)  # file_path, file_name
+    finished = Signal()
+    progress_update = Signal(int, int)  # current, total
+
+    def __init__(self, folder_path, files, file_stats, clauses, governors=None):
+        super().__init__()
+        self.folder_path = folder_path
+        self.files = [f for f in files if f.suffix.lower() in ['.xls', '.xlsx']]
+        self.file_stats = file_stats  # str(path) -> (size, mtime)
+        self.clauses = clauses
+        self.governors = governors
+        self.should_stop = False
+
+    def stop(self):
+        self.should_stop = True
+
+    def drain(self):
+        # The stored header table covers the whole folder, so the filter isn't cut short; the scan
+        # engine recycles once it is done
+        pass
+
+    def run(self):
+        # Headers are parsed once per file version; unchanged files come from the stored table
+        table = load_header_table(self.folder_path)
+        known = {record["file"]: record for record in table.to_dict(orient='records')}
+        records = []
+        for done, file_path in enumerate(self.files, 1):
+            if self.should_stop:
+                break
+            size, mtime = self.file_stats.get(str(file_path), (None, None))
+            record = known.get(file_path.name)
+            if record is None or [record["size"], record["mtime"]] != [size, mtime]:
+                self.started_file.emit(str(file_path))
+                record = dict.fromkeys(HEADER_COLUMNS)
+                try:
+                    with share_slot(self.governors, file_path, size, should_stop=lambda: self.should_stop):
+                        record.update(read_header_fields(file_path))
+                except Exception as e:
+                    print(f"Failed to read header of {file_path}: {e}")
+                record.update(file=file_path.name, size=size, mtime=mtime)
+            records.append(record)
+            self.progress_update.emit(done, len(self.files))
+
+        table = pd.DataFrame(records, columns=HEADER_COLUMNS)
+        if not self.should_stop:
+            save_header_table(self.folder_path, table)
+            # The query itself is a column filter over the table
+            matched = table[header_filter_mask(table, self.clauses)]
+            for record in matched.to_dict(orient='records'):
+                summary = ", ".join(f"{column}: {record[column]}" for column, _, _ in self.clauses)
+                self.update_result.emit(str(self.folder_path / record["file"]), record["file"], summary)
+            for file_path in self.files:
+                self.finished_file.emit(str(file_path), file_path.name)
+        self.finished.emit()
+
+
+class QuerySearchWorker(QObject):
+    """Runs a boolean query: the folder's index narrows the files down, then each remaining
+    candidate is checked against the query on its parsed cells (through the sheet cache)"""
+    # Same signals as SearchWorker so the GUI treats both alike
+    update_result = Signal(str, str, str)  # file_path, file_name, found_text
+    started_file = Signal(str)  # file_path
+    finished_file = Signal(str, str)  # file_path, file_name
+    finished = Signal()
+    progress_update = Signal(int, int)  # current, total
+
+    def __init__(self, folder_path, files, file_stats, query, exact_match, col_end_keywords, row_end, max_rows,
+                 governors=None):
+        super().__init__()
+        self.folder_path = folder_path
+        self.files = [f for f in files if f.suffix.lower() in ['.xls', '.xlsx', '.csv']]
+        self.file_stats = file_stats  # str(path) -> (size, mtime)
+        self.query = query
+        self.exact_match = exact_match
+        self.col_end_keywords = col_end_keywords
+        self.max_col = column_index(row_end) + 1
+        self.max_rows = max_rows
+        self.governors = governors
+        # Planning figures and the files checked, picklable so the scan engine can send them back
+        self.report = {"ruled_out": 0, "files": len(self.files), "plan_seconds": 0.0, "checked": []}
+        self.should_stop = False
+        self.draining = False  # Finish the current file but don't start new ones
+
+    def stop(self):
+        self.should_stop = True
+
+    def drain(self):
+        self.draining = True
+
+    def matches(self, value, text):
+        # Plain terms match like the keywords of a normal search
+        if self.exact_match:
+            return text.strip() == value
+        return value.lower() in text.lower()
+
+    def evaluate(self, grid):
+        """Texts that satisfy the query's plain and field terms, or None if the sheet doesn't match"""
+        area = grid.head(self.max_rows)
+        end_row = area.end_row(self.col_end_keywords)
+        area_texts = area.match_texts(lambda text: True, end_row, self.max_col, limit=len(area))
+        texts = header = None  # Every distinct text and the parsed header, when first needed
+        found = []
+
+        def term_matches(field, value):
+            nonlocal texts, header
+            if field is None:
+                return [text for text in area_texts if self.matches(value, text)]
+            if field == "cell":
+                row, col, value = value
+                text = grid.cell(row, col)
+                return [text] if text is not None and value.lower() in text.lower() else []
+            if field in QUERY_LABEL_FIELDS:
+                label = QUERY_LABEL_FIELDS[field]
+                if texts is None:
+                    texts = [grid.string(code) for code in np.unique(grid.codes).tolist()]
+                return [text for text in texts if label.lower() in text.lower()
+                        and value.lower() in field_value(label, text).lower()]
+            if header is None:
+                header = grid_header_fields(grid)
+            return [header[field]] if value.lower() in (header.get(field) or "").lower() else []
+
+        def evaluate(node, collect=True):
+            kind = node[0]
+            if kind == "term":
+                matched = term_matches(node[1], node[2])
+                if collect:
+                    found.extend(text for text in matched if text not in found)
+                return bool(matched)
+            if kind == "not":
+                return not evaluate(node[1], False)
+            if kind == "and":
+                return all(evaluate(child, collect) for child in node[1])
+            return any([evaluate(child, collect) for child in node[1]])
+
+        return found if evaluate(self.query) else None
+
+    def run(self):
+        # Plan against the index first; only the candidates are ever opened
+        started = time.perf_counter()
+        # Files to add to the in-memory index (none when the folder has an index on disk)
+        candidates, stale = self.files, set(self.files)
+        index = open_folder_index(self.folder_path)
+        if index is not None:
+            with index:
+                candidates, self.report["ruled_out"] = index.candidates(self.files, self.file_stats, self.query,
+                                                                        self.exact_match)
+                stale = {f for f in candidates if index.in_memory
+                         and index.stat(str(f)) != tuple(self.file_stats.get(str(f), ()))}
+        self.report["plan_seconds"] = time.perf_counter() - started
+        self.progress_update.emit(0, len(candidates))
+
+        writer, segments = IndexWriter(), []
+        for done, file_path in enumerate(candidates, 1):
+            if self.should_stop or self.draining:
+                break
+            self.started_file.emit(str(file_path))
+            size = self.file_stats.get(str(file_path), (None,))[0]
+            try:
+                with share_slot(self.governors, file_path, size, should_stop=lambda: self.should_stop), \
+                        load_sheet_grid(file_path) as grid:
+                    if file_path in stale and str(file_path) in self.file_stats:
+                        writer.add(file_path, *self.file_stats[str(file_path)], grid)
+                        if len(writer) >= INDEX_SEGMENT_FILES:
+                            segments.append(writer.segment_bytes())
+                            writer = IndexWriter()
+                    found = self.evaluate(grid)
+                if found is not None:
+                    self.file_matched(file_path, found)
+            except Exception as e:
+                print(f"Failed to read {file_path}: {e}")
+            self.file_checked(file_path)
+            self.report["checked"].append(str(file_path))
+            self.progress_update.emit(done, len(candidates))
+        self.search_done()
+
+        # Later searches of an ad-hoc folder plan against what this one decoded
+        if len(writer):
+            segments.append(writer.segment_bytes())
+        remember_memory_segments(self.folder_path, segments)
+        self.finished.emit()
+
+    def file_matched(self, file_path, found):
+        self.update_result.emit(str(file_path), file_path.name, ", ".join(found[:10]))
+
+    def file_checked(self, file_path):
+        self.finished_file.emit(str(file_path), file_path.name)
+
+    def search_done(self):
+        pass
+
+
+class FuzzySearchWorker(QuerySearchWorker):
+    """Ranks files by how few edits turn a keyword into part of one of their cells (normalized to
+    lowercase letters and digits), up to max_edits; only matching files are listed, best first
+
+    The folder's trigram index (or the in-memory one) narrows the files down as for queries.
+    """
+
+    def __init__(self, folder_path, files, file_stats, keywords, max_edits, col_end_keywords, row_end, max_rows,
+                 governors=None):
+        patterns = [(normalize_text(keyword), fuzzy_max_edits(keyword, max_edits)) for keyword in keywords]
+        query = ("or", [("fuzzy", keyword, edits) for keyword, (_, edits) in zip(keywords, patterns)])
+        super().__init__(folder_path, files, file_stats, query, False, col_end_keywords, row_end, max_rows,
+                         governors)
+        self.patterns = [(pattern, edits) for pattern, edits in patterns if pattern]
+        self.ranked = []  # (edits, file_path, closest texts), sorted when the search is done
+
+    def evaluate(self, grid):
+        """(edits, closest texts) of the sheet, or None if no text is close enough"""
+        area = grid.head(self.max_rows)
+        end_row = area.end_row(self.col_end_keywords)
+        best, texts = None, []
+        for text in area.match_texts(lambda text: True, end_row, self.max_col, limit=len(area)):
+            normalized = normalize_text(text)
+            for pattern, max_edits in self.patterns:
+                edits = fuzzy_distance(pattern, normalized, max_edits if best is None else min(best, max_edits))
+                if edits is None:
+                    continue
+                if best is None or edits < best:
+                    best, texts = edits, [text]
+                elif edits == best and text not in texts:
+                    texts.append(text)
+        return (best, texts) if best is not None else None
+
+    def file_matched(self, file_path, found):
+        self.ranked.append((found[0], file_path, found[1]))
+
+    def file_checked(self, file_path):
+        pass
+
+    def search_done(self):
+        self.ranked.sort(key=lambda match: (match[0], match[1].name))
+        for edits, file_path, texts in self.ranked:
+            self.update_result.emit(str(file_path), file_path.name, ", ".join(texts[:10]))
+            self.finished_file.emit(str(file_path), file_path.name)
+        self.report["ranked"] = [(edits, str(file_path), texts[:10]) for edits, file_path, texts in self.ranked]
+
+
+def make_search_worker(kind, kwargs, governors, memory_budget):
+    """Worker for a search request, in the scan engine or in-process: kind is "folder" (SearchWorker),
+    "roots" (MultiRootSearchWorker), "query", "fuzzy" or "headers"; every file read goes through governors
+    """
+    if kind in ("folder", "roots"):
+        worker_class = MultiRootSearchWorker if kind == "roots" else SearchWorker
+        return worker_class(governors=governors, min_available_mb=memory_budget["min_available_mb"], **kwargs)
+    worker_class = {"query": QuerySearchWorker, "fuzzy": FuzzySearchWorker, "headers": HeaderFilterWorker}[kind]
+    return worker_class(governors=governors, **kwargs)
+
+
+def export_output_names(files):
+    """Map each file to its output name: <stem>.json, or <name>.json when stems collide"""
+    stems = {}
+    for file_path in files:
+        stems.setdefault(file_path.stem.lower(), []).append(file_path)
+    return {file_path: f"{file_path.stem if len(same) == 1 else file_path.name}.json"
+            for same in stems.values() for file_path in same}
+
+
+def save_json_atomic(path, data):
+    """Write a small JSON document through a temp file so readers never see it half-written"""
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=Path(path).parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_export_errors(folder, errors):
+    """Write the error report of an export, or remove the one of an earlier export"""
+    errors_path = Path(folder) / EXPORT_ERRORS_NAME
+    if errors:
+        save_json_atomic(errors_path, errors)
+    elif errors_path.exists():
+        os.remove(errors_path)
+
+
+class BulkExportWorker(QObject):
+    """Exports every file to <save folder>/<stem>.json
+
+    Workbooks are decoded in a process pool (a bounded number in flight) and their sections are
+    extracted and streamed to disk here, each output replacing the old one only when complete.
+    The manifest records the size, mtime and extraction settings each output was made from, so a
+    rerun only exports what changed; failures are written to a per-file error report.
+    """
+    progress_update = Signal(int, int)  # current, total
+    finished = Signal(int, int, int)  # exported, skipped, failed
+
+    def __init__(self, files, save_folder, extract, settings_key, max_workers=None, governors=None):
+        super().__init__()
+        self.files = list(files)
+        self.save_folder = Path(save_folder)
+        self.extract = extract  # extract(file_path, grid=None) -> JSON data, as extract_json_data
+        self.settings_key = settings_key
+        self.max_workers = max_workers
+        self.governors = governors  # Files on a share are read in its background I/O profile
+        self.errors = {}  # file path -> error message
+        self.should_stop = False
+
+    def stop(self):
+        self.should_stop = True
+
+    def run(self):
+        self.save_folder.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.save_folder / EXPORT_MANIFEST_NAME
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+
+        # Skip files whose output was made from the same version with the same settings
+        names = export_output_names(self.files)
+        todo = {}  # file path -> (output path, manifest entry)
+        sizes = {}
+        skipped = 0
+        for file_path in self.files:
+            try:
+                stat = file_path.stat()
+            except OSError as e:
+                self.errors[str(file_path)] = str(e)
+                continue
+            entry = [stat.st_size, stat.st_mtime, self.settings_key]
+            sizes[file_path] = stat.st_size
+            output = self.save_folder / names[file_path]
+            if manifest.get(str(file_path)) == entry and output.exists():
+                skipped += 1
+            else:
+                todo[file_path] = (output, entry)
+
+        total = len(self.files)
+        done = skipped + len(self.errors)
+        self.progress_update.emit(done, total)
+
+        def export(file_path, grid=None):
+            output, entry = todo[file_path]
+            try:
+                with JsonStreamWriter(output, indent=2) as writer:
+                    writer.write(self.extract(file_path, grid=grid))
+                manifest[str(file_path)] = entry
+            except Exception as e:
+                self.errors[str(file_path)] = str(e)
+
+        def slot(file_path):
+            return share_slot(self.governors, file_path, sizes[file_path], background=True,
+                              should_stop=lambda: self.should_stop)
+
+        workbooks = [f for f in todo if f.suffix.lower() in ['.xls', '.xlsx']]
+        if workbooks and not self.should_stop:
+            pool = GridProcessPool(self.max_workers)
+            try:
+                for file_path, grid in pool.map_grids(workbooks, slot=slot):
+                    if isinstance(grid, Exception):
+                        self.errors[str(file_path)] = str(grid)
+                    else:
+                        try:
+                            export(file_path, grid)
+                        finally:
+                            grid.close()
+                    done += 1
+                    self.progress_update.emit(done, total)
+                    if self.should_stop:
+                        break
+            finally:
+                pool.shutdown()
+
+        # CSV and text files are cheap enough to extract here
+        for file_path in todo:
+            if self.should_stop:
+                break
+            if file_path.suffix.lower() not in ['.xls', '.xlsx']:
+                with slot(file_path):
+                    export(file_path)
+                done += 1
+                self.progress_update.emit(done, total)
+
+        try:
+            save_json_atomic(manifest_path, manifest)
+            save_export_errors(self.save_folder, self.errors)
+        except OSError as e:
+            print(f"Failed to save export manifest in {self.save_folder}: {e}")
+        exported = done - skipped - len(self.errors)
+        self.finished.emit(exported, skipped, len(self.errors))
 
-        layout = QVBoxLayout(self)
-        form_layout = QFormLayout()
 
-        # Column end keywords
-        self.col_end_input = QTextEdit()
-        self.col_end_input.setMaximumHeight(80)
-        self.col_end_input.setPlaceholderText("Enter keywords separated by semicolons (e.g., E. & O.E.;SUB-TOTAL)")
-        form_layout.addRow("Column End Keywords:", self.col_end_input)
+def first_sheet_name(file_path):
+    """Name of the sheet a SheetGrid is read from (None for CSV files)"""
+    suffix = file_path.suffix.lower()
+    if suffix == '.xlsx':
+        with zipfile.ZipFile(file_path) as archive:
+            workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        return workbook.find(f"{XLSX_NS}sheets/{XLSX_NS}sheet").get("name")
+    if suffix == '.xls':
+        with pd.ExcelFile(file_path) as workbook:
+            return workbook.sheet_names[0]
+    return None
 
-        # Row end column
-        self.row_end_input = QLineEdit()
-        self.row_end_input.setPlaceholderText("Enter column letter (e.g., N)")
-        form_layout.addRow("Row End Column:", self.row_end_input)
 
-        # Max rows to scan
-        self.max_rows_input = QLineEdit()
-        self.max_rows_input.setPlaceholderText("Enter maximum rows to scan (default: 1000)")
-        form_layout.addRow("Max Rows to Scan:", self.max_rows_input)
+def parquet_schema():
+    """Schema of the cell dataset; it never depends on the files exported"""
+    return pa.schema([
+        ("file", pa.string()), ("sheet", pa.string()), ("cell", pa.string()),
+        ("row", pa.int32()), ("col", pa.int32()), ("keyword", pa.string()), ("value", pa.string()),
+    ] + [(column, pa.string()) for column in ["company"] + list(HEADER_LABELS)])
 
-        layout.addLayout(form_layout)
 
-        # Buttons
-        button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
-        button_box.accepted.connect(self.accept)
-        button_box.rejected.connect(self.reject)
-        layout.addWidget(button_box)
+def grid_cell_columns(file_path, sheet, grid, keywords, exact_match):
+    """Columns of the cell dataset for one sheet: a row per non-empty cell, 1-based row/col
 
-    def get_settings(self):
-        col_end_text = self.col_end_input.toPlainText().strip()
-        col_end_keywords = set()
-        if col_end_text:
-            col_end_keywords = {k.strip() for k in col_end_text.split(';') if k.strip()}
+    keyword is the first search keyword the cell matches (as SearchWorker.matches_keyword),
+    tested once per distinct text and spread over the cells through the string codes.
+    """
+    strings = np.array([grid.string(code) for code in range(grid.nstrings)], dtype=object)
+    matched = np.full(grid.nstrings, None, dtype=object)
+    for code, text in enumerate(strings):
+        stripped, lowered = text.strip(), text.lower()
+        matched[code] = next((keyword for keyword in keywords if (stripped == keyword if exact_match
+                              else keyword.lower() in lowered)), None)
+    rows, cols = grid.rows + 1, grid.cols + 1
+    header = grid_header_fields(grid)
+    columns = {
+        "file": [file_path.name] * len(rows),
+        "sheet": [sheet] * len(rows),
+        "cell": [cell_ref(row, col) for row, col in zip(grid.rows.tolist(), grid.cols.tolist())],
+        "row": rows,
+        "col": cols,
+        "keyword": matched[grid.codes],
+        "value": strings[grid.codes],
+    }
+    for column in ["company"] + list(HEADER_LABELS):
+        columns[column] = [header.get(column)] * len(rows)
+    return columns, header
 
-        row_end = self.row_end_input.text().strip().upper()
-        if not row_end:
-            row_end = 'N'
 
-        max_rows = self.max_rows_input.text().strip()
-        try:
-            max_rows = int(max_rows) if max_rows else 1000
-        except ValueError:
-            max_rows = 1000
+class ParquetDatasetWriter:
+    """Writes tables into <folder>/<name>/year=YYYY/part-0.parquet, built in a temp folder that
+    replaces the previous dataset only when the export completes
 
-        return col_end_keywords, row_end, max_rows
+    Tables are buffered per partition so row groups stay large however small each file is.
+    """
 
-    def set_settings(self, col_end_keywords, row_end, max_rows):
-        self.col_end_input.setPlainText(';'.join(col_end_keywords))
-        self.row_end_input.setText(row_end)
-        self.max_rows_input.setText(str(max_rows))
+    def __init__(self, folder, name=PARQUET_DATASET_NAME):
+        self.path = Path(folder) / name
+        self.schema = parquet_schema()
+        self.tmp_path = Path(folder) / f".{name}-{os.getpid()}-{time.time_ns()}"
+        self.tmp_path.mkdir()
+        self.writers = {}
+        self.pending = {}  # partition -> ([tables], rows)
 
+    def write(self, partition, columns):
+        table = pa.Table.from_pydict(columns, schema=self.schema)
+        tables, rows = self.pending.get(partition, ([], 0))
+        tables.append(table)
+        self.pending[partition] = (tables, rows + table.num_rows)
+        if rows + table.num_rows >= PARQUET_ROW_GROUP_ROWS:
+            self.flush(partition)
 
-class SearchWorker(QObject):
-    # Signals to communicate back to the main thread
-    update_result = Signal(str, str, str)  # file_path, file_name, found_text
-    finished_file = Signal(str, str)  # file_path, file_name
-    finished = Signal()
+    def flush(self, partition):
+        tables, _ = self.pending.pop(partition, ([], 0))
+        if not tables:
+            return
+        writer = self.writers.get(partition)
+        if writer is None:
+            part_dir = self.tmp_path / f"year={partition}"
+            part_dir.mkdir()
+            writer = self.writers[partition] = pq.ParquetWriter(
+                part_dir / "part-0.parquet", self.schema,
+                compression=PARQUET_COMPRESSION, use_dictionary=True)
+        writer.write_table(pa.concat_tables(tables), row_group_size=PARQUET_ROW_GROUP_ROWS)
+
+    def close(self, commit=True):
+        try:
+            try:
+                if commit:
+                    for partition in list(self.pending):
+                        self.flush(partition)
+            finally:
+                for writer in self.writers.values():
+                    writer.close()
+        except Exception:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+            raise
+        if not commit:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+            return
+        # Swap the folders; the old dataset is only deleted once the new one is in place
+        old_path = None
+        if self.path.exists():
+            old_path = Path(tempfile.mkdtemp(prefix=f".{self.path.name}-old-", dir=self.path.parent))
+            os.replace(self.path, old_path / self.path.name)
+        os.replace(self.tmp_path, self.path)
+        if old_path:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+
+class ParquetExportWorker(QObject):
+    """Exports the cells of every workbook and CSV file into one Parquet dataset
+
+    Files are decoded in a process pool as for the bulk JSON export; each sheet's cells are tagged
+    with the parsed quotation header and the search keyword they match, and partitioned by the
+    year of the quotation date (or of the ST-YYYY-MM file name, else "unknown").
+    """
     progress_update = Signal(int, int)  # current, total
+    finished = Signal(int, int, int)  # exported, skipped, failed
 
-    def __init__(self, files, keywords, exact_match, col_end_keywords=None, row_end='N', max_rows=1000):
+    def __init__(self, files, save_folder, keywords, exact_match, max_workers=None, governors=None):
         super().__init__()
-        self.files = files
+        self.files = [f for f in files if f.suffix.lower() in ['.xlsx', '.xls', '.csv']]
+        self.save_folder = Path(save_folder)
         self.keywords = keywords
         self.exact_match = exact_match
-        self.col_end_keywords = col_end_keywords or set()
-        self.row_end = row_end
-        self.max_rows = max_rows
+        self.max_workers = max_workers
+        self.governors = governors  # Files on a share are read in its background I/O profile
+        self.errors = {}  # file path -> error message
         self.should_stop = False
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
 
     def stop(self):
         self.should_stop = True
-        self.executor.shutdown(wait=False)
 
-    def get_column_number(self, col_letter):
-        """Convert column letter to number (A=1, B=2, etc.)"""
-        result = 0
-        for char in col_letter:
-            result = result * 26 + (ord(char) - ord('A') + 1)
-        return result
+    def partition(self, file_path, header):
+        if header.get("date"):
+            return header["date"][:4]
+        match = QUOTATION_NAME_PATTERN.search(file_path.name)
+        return match.group(1) if match else "unknown"
 
-    def search_file(self, file_path):
-        if self.should_stop:
-            return None
+    def run(self):
+        self.save_folder.mkdir(parents=True, exist_ok=True)
+        exported = 0
+        dataset = ParquetDatasetWriter(self.save_folder)
+        pool = GridProcessPool(self.max_workers)
+
+        def slot(file_path, nbytes=None):
+            return share_slot(self.governors, file_path, nbytes, background=True,
+                              should_stop=lambda: self.should_stop)
 
         try:
-            matched_texts = set()
-            file_name = file_path.name
+            for done, (file_path, grid) in enumerate(pool.map_grids(self.files, slot=slot), 1):
+                if isinstance(grid, Exception):
+                    self.errors[str(file_path)] = str(grid)
+                else:
+                    try:
+                        # Only the small workbook part is read again, but it is still an open on the share
+                        with slot(file_path, 0):
+                            sheet = first_sheet_name(file_path)
+                        columns, header = grid_cell_columns(file_path, sheet, grid, self.keywords, self.exact_match)
+                        dataset.write(self.partition(file_path, header), columns)
+                        exported += 1
+                    except Exception as e:
+                        self.errors[str(file_path)] = str(e)
+                    finally:
+                        grid.close()
+                self.progress_update.emit(done, len(self.files))
+                if self.should_stop:
+                    break
+        finally:
+            pool.shutdown()
+            try:
+                dataset.close(commit=not self.should_stop)
+            except Exception as e:
+                print(f"Failed to write Parquet dataset in {self.save_folder}: {e}")
+                self.errors[str(dataset.path)] = str(e)
+                exported = 0
+        if self.should_stop:
+            exported = 0  # The previous dataset was kept
+        try:
+            save_export_errors(self.save_folder, self.errors)
+        except OSError as e:
+            print(f"Failed to save export errors in {self.save_folder}: {e}")
+        self.finished.emit(exported, 0, len(self.errors))
 
-            # Handle Excel files
-            if file_path.suffix.lower() in ['.xls', '.xlsx']:
-                # Read the file with limited rows
-                df = pd.read_excel(file_path, header=None, dtype=str, nrows=self.max_rows)
 
-                # Find the actual end row using column end keywords
-                end_row = len(df)
-                if self.col_end_keywords:
-                    for idx, row in df.iterrows():
-                        if self.should_stop:
-                            return None
-                        for value in row:
-                            if isinstance(value, str):
-                                for keyword in self.col_end_keywords:
-                                    if keyword.lower() in value.lower():
-                                        end_row = idx
-                                        break
-                                if end_row != len(df):
-                                    break
-                        if end_row != len(df):
-                            break
+class IndexBuildWorker(QObject):
+    """Adds a folder's new and changed workbooks to its index
 
-                # Limit columns based on row_end setting
-                max_col = self.get_column_number(self.row_end)
+    Sheets are decoded in a process pool (through the sheet cache) and appended to the index as a
+    new segment every INDEX_SEGMENT_FILES files; segments are merged in the background.
+    """
+    progress_update = Signal(int, int)  # current, total
+    finished = Signal(int, int, int)  # indexed, unchanged, failed
 
-                # Search only within the limited area
-                for row_idx in range(min(end_row, len(df))):
-                    if self.should_stop:
-                        return None
-                    row = df.iloc[row_idx]
-                    for col_idx, value in enumerate(row[:max_col]):  # Limit columns
-                        if not isinstance(value, str):
-                            continue
-                        for keyword in self.keywords:
-                            if self.exact_match:
-                                if re.fullmatch(re.escape(keyword), value.strip()):
-                                    matched_texts.add(value)
-                            else:
-                                if keyword.lower() in value.lower():
-                                    matched_texts.add(value)
-                            if len(matched_texts) >= 10:  # Limit matches for performance
-                                break
-                        if len(matched_texts) >= 10:
-                            break
-                    if len(matched_texts) >= 10:
-                        break
-            else:
-                # Handle plain text or CSV files
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    # Read only first 1MB for performance
-                    content = f.read(1024 * 1024)
-                    for keyword in self.keywords:
-                        if self.should_stop:
-                            return None
-                        if self.exact_match:
-                            matches = re.findall(rf'\b{re.escape(keyword)}\b', content)
-                            matched_texts.update(matches[:10])  # Limit matches
-                        else:
-                            if keyword.lower() in content.lower():
-                                matched_texts.add(keyword)
+    def __init__(self, folder_path, files, file_stats, max_workers=None, governors=None):
+        super().__init__()
+        self.directory = index_dir(folder_path)
+        self.files = [f for f in files if f.suffix.lower() in ['.xls', '.xlsx']]
+        self.file_stats = file_stats  # str(path) -> (size, mtime)
+        self.max_workers = max_workers
+        self.governors = governors  # Files on a share are read in its background I/O profile
+        self.errors = {}  # file path -> error message
+        self.should_stop = False
 
-            return (str(file_path), file_name, ", ".join(list(matched_texts)[:10]))
-        except Exception as e:
-            print(f"Failed to read {file_path}: {e}")
-            return None
+    def stop(self):
+        self.should_stop = True
 
     def run(self):
-        total_files = len(self.files)
-        futures = []
+        # Files indexed before trigrams were added are indexed again
+        with FolderIndex(self.directory) as index:
+            todo = [f for f in self.files
+                    if index.stat(str(f)) != tuple(self.file_stats.get(str(f), ()))
+                    or not index.has_trigrams(str(f))]
+        unchanged = len(self.files) - len(todo)
+        self.progress_update.emit(unchanged, len(self.files))
 
-        # Submit all files to thread pool
-        for i, file_path in enumerate(self.files):
-            if self.should_stop:
-                break
-            future = self.executor.submit(self.search_file, file_path)
-            futures.append((future, file_path))
+        writer = IndexWriter(self.directory)
+        indexed = 0
+        pool = GridProcessPool(self.max_workers)
 
-        # Process results as they complete
-        for i, (future, file_path) in enumerate(futures):
-            if self.should_stop:
-                break
+        def slot(file_path):
+            size = self.file_stats.get(str(file_path), (None,))[0]
+            return share_slot(self.governors, file_path, size, background=True, should_stop=lambda: self.should_stop)
 
+        try:
+            for done, (file_path, grid) in enumerate(pool.map_grids(todo, slot=slot), unchanged + 1):
+                if isinstance(grid, Exception):
+                    self.errors[str(file_path)] = str(grid)
+                else:
+                    try:
+                        writer.add(file_path, *self.file_stats[str(file_path)], grid)
+                        indexed += 1
+                    except Exception as e:
+                        self.errors[str(file_path)] = str(e)
+                    finally:
+                        grid.close()
+                if len(writer) >= INDEX_SEGMENT_FILES:
+                    writer.commit()
+                    maybe_merge_index(self.directory)
+                self.progress_update.emit(done, len(self.files))
+                if self.should_stop:
+                    break
+        finally:
+            pool.shutdown()
             try:
-                result = future.result(timeout=30)  # 30 second timeout per file
-                file_name = file_path.name
+                writer.commit()
+            except OSError as e:
+                print(f"Failed to write index segment in {self.directory}: {e}")
+            maybe_merge_index(self.directory)
+        self.finished.emit(indexed, unchanged, len(self.errors))
 
-                if result:
-                    file_path_str, file_name, matched_texts = result
-                    if matched_texts:
-                        self.update_result.emit(file_path_str, file_name, matched_texts)
 
-                self.finished_file.emit(str(file_path), file_name)
-                self.progress_update.emit(i + 1, total_files)
+def scan_engine_main(conn, folders_config):
+    """Entry point of the scan engine helper process
 
-            except concurrent.futures.TimeoutError:
-                print(f"Timeout reading {file_path}")
-                self.finished_file.emit(str(file_path), file_path.name)
-            except Exception as e:
-                print(f"Error processing {file_path}: {e}")
-                self.finished_file.emit(str(file_path), file_path.name)
+    Requests: ("search", search_id, kind, kwargs, memory_budget) with a kind of make_search_worker,
+    ("stop", search_id) and ("quit",).
+    Replies, tagged with the search id: ("events", search_id, [event, ...]) batched every
+    ENGINE_FLUSH_INTERVAL, where an event is ("started", path), ("result", path, name, text),
+    ("file", path, name) or ("progress", done, total), then ("finished", search_id, peak_rss, report)
+    once the search is over, or ("recycle", search_id, peak_rss, report) when the process used up its
+    memory budget; it exits right after and the client resumes in a fresh process. report is the
+    worker's report dict (index planning, fuzzy ranking), or {}.
+    Requests arriving while a search runs are queued, and a search stopped before it started is
+    answered with "finished" right away.
+    """
+    governors = ShareGovernors(folders_config)
+    outbox = []
+    outbox_lock = threading.Lock()
+    files_done = 0  # Files scanned during the lifetime of this process
+    pending = deque()  # Requests received while a search was running
+    stopped = set()  # Searches stopped before they started
+    last_search = 0  # Ids only grow, so stops of this search or older ones are stale
+
+    def post(*event):
+        nonlocal files_done
+        with outbox_lock:
+            outbox.append(event)
+            if event[0] == "file":
+                files_done += 1
+
+    def flush(search_id):
+        with outbox_lock:
+            events = outbox[:]
+            outbox.clear()
+        if events:
+            conn.send(("events", search_id, events))
+
+    def receive():
+        try:
+            return conn.recv()
+        except EOFError:
+            return ("quit",)  # The GUI went away
+
+    while True:
+        message = pending.popleft() if pending else receive()
+        if message[0] == "quit":
+            return
+        if message[0] == "stop" and message[1] > last_search:
+            stopped.add(message[1])
+        if message[0] != "search":
+            continue
+
+        search_id, kind, kwargs, budget = message[1:]
+        last_search = search_id
+        # Its stop may have been queued behind it while the previous search ran
+        while ("stop", search_id) in pending:
+            pending.remove(("stop", search_id))
+            stopped.add(search_id)
+        if search_id in stopped:
+            stopped.discard(search_id)
+            conn.send(("finished", search_id, 0, {}))
+            continue
+        worker = make_search_worker(kind, kwargs, governors, budget)
+        # No event loop runs here, so every signal is delivered as a direct call
+        worker.started_file.connect(lambda path: post("started", path), Qt.DirectConnection)
+        worker.update_result.connect(lambda path, name, text: post("result", path, name, text), Qt.DirectConnection)
+        worker.finished_file.connect(lambda path, name: post("file", path, name), Qt.DirectConnection)
+        worker.progress_update.connect(lambda done, total: post("progress", done, total), Qt.DirectConnection)
+
+        thread = Thread(target=worker.run)
+        thread.start()
+        recycling = False
+        while thread.is_alive():
+            thread.join(ENGINE_FLUSH_INTERVAL)
+            flush(search_id)
+            # Recycle the whole process once it has parsed enough files or grown too large (0 = no limit)
+            if not recycling and (0 < budget["recycle_files"] <= files_done
+                                  or 0 < budget["recycle_rss_mb"] * 1024 * 1024 < process_rss()):
+                recycling = True
+                worker.drain()
+            while conn.poll():
+                request = receive()
+                if request[0] == "quit":
+                    worker.stop()
+                    return
+                if request == ("stop", search_id):
+                    worker.stop()
+                else:
+                    pending.append(request)  # e.g. the next search, sent while this one winds down
+        thread.join()
+        flush(search_id)
+        # Only the keyword searches sample their memory while running
+        peak_rss = max(getattr(worker, "peak_rss", 0), process_rss())
+        report = getattr(worker, "report", {})
+        if recycling:
+            conn.send(("recycle", search_id, peak_rss, report))
+            return
+        conn.send(("finished", search_id, peak_rss, report))
+
+
+class ScanEngine:
+    """Owns the scan engine helper process and the pipe to it; restarts it after a crash"""
+
+    def __init__(self, folders_config):
+        self.folders_config = folders_config
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # Stops are sent from the GUI thread, searches from clients
+        self.search_ids = itertools.count(1)
+
+    def ensure_started(self):
+        with self.lock:
+            if self.process is not None and self.process.is_alive():
+                return
+            # Spawn rather than fork: forking a process that runs Qt threads is unsafe
+            context = multiprocessing.get_context("spawn")
+            self.conn, child_conn = context.Pipe()
+            self.process = context.Process(target=scan_engine_main, args=(child_conn, self.folders_config),
+                                           daemon=True)
+            self.process.start()
+            child_conn.close()
+
+    def send(self, message):
+        with self.send_lock:
+            try:
+                self.conn.send(message)
+            except (OSError, AttributeError) as e:
+                print(f"Scan engine not reachable: {e}")
+
+    def recv(self):
+        return self.conn.recv()
+
+    def restart(self):
+        with self.lock:
+            if self.process is not None and self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        self.ensure_started()
+
+    def shutdown(self):
+        if self.process is None:
+            return
+        self.send(("quit",))
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class ScanEngineClient(QObject):
+    """Runs one search in the scan engine process; has the same interface as SearchWorker"""
+    update_result = Signal(str, str, str)  # file_path, file_name, found_text
+    finished_file = Signal(str, str)  # file_path, file_name
+    finished = Signal()
+    progress_update = Signal(int, int)  # current, total
+
+    def __init__(self, engine, kind, kwargs, memory_budget=None):
+        super().__init__()
+        self.engine = engine
+        self.kind = kind
+        self.kwargs = kwargs
+        self.memory_budget = memory_budget or dict(DEFAULT_MEMORY_BUDGET)
+        self.peak_rss = 0
+        self.report = {}  # The workers' reports, merged over helper restarts
+        self.should_stop = False
+        self.search_id = None  # Id of the request currently running in the helper
+
+    def stop(self):
+        self.should_stop = True
+        if self.search_id is not None:
+            self.engine.send(("stop", self.search_id))
+
+    def run(self):
+        done = set()  # Files finished across helper restarts
+        restarts = 0
+        kwargs = self.kwargs
+        while True:
+            started, finished_files = set(), set()
+            outcome = "crashed"
+            try:
+                self.engine.ensure_started()
+                self.search_id = next(self.engine.search_ids)
+                self.engine.send(("search", self.search_id, self.kind, kwargs, self.memory_budget))
+                # stop() may have run before the id was set
+                if self.should_stop:
+                    self.engine.send(("stop", self.search_id))
+                outcome = self.read_events(started, finished_files, len(done))
+            except (EOFError, OSError) as e:
+                # The helper died (e.g. a pathological workbook exhausted its memory)
+                print(f"Scan engine crashed: {e}")
+            done |= finished_files
+            # Files checked without being listed (e.g. no fuzzy match) aren't read again either
+            done.update(self.report.get("checked", ()))
+            if outcome == "finished" or self.should_stop:
+                break
 
-        self.executor.shutdown(wait=True)
+            self.engine.restart()
+            if outcome == "crashed":
+                # Files that were being read when it died are reported and skipped on resume
+                for file_path in started - finished_files:
+                    print(f"Skipped {file_path}: scan engine crashed while reading it")
+                    self.finished_file.emit(file_path, Path(file_path).name)
+                    done.add(file_path)
+                restarts += 1
+                if restarts > ENGINE_MAX_RESTARTS:
+                    break
+            kwargs = self.resume_kwargs(done)
+            if self.kind != "roots" and not kwargs["files"]:
+                break  # Every file was done before the helper went away
         self.finished.emit()
 
+    def resume_kwargs(self, done):
+        """Request arguments that continue the search without the files already done"""
+        if self.kind == "roots":
+            return dict(self.kwargs, skip_files=set(done))
+        return dict(self.kwargs, files=[f for f in self.kwargs["files"] if str(f) not in done])
+
+    def read_events(self, started, finished_files, done_before):
+        """Dispatch events until the helper reports "finished" or "recycle"; returns which"""
+        while True:
+            message = self.engine.recv()
+            if message[1] != self.search_id:
+                continue  # Left over from an earlier request
+            if message[0] in ("finished", "recycle"):
+                self.peak_rss = max(self.peak_rss, message[2])
+                # Lists (files checked, fuzzy matches) add up; the planning figures are the first run's
+                for key, value in message[3].items():
+                    if isinstance(value, list):
+                        self.report.setdefault(key, []).extend(value)
+                    else:
+                        self.report.setdefault(key, value)
+                return message[0]
+            for event in message[2]:
+                if event[0] == "started":
+                    started.add(event[1])
+                elif event[0] == "result":
+                    self.update_result.emit(event[1], event[2], event[3])
+                elif event[0] == "file":
+                    finished_files.add(event[1])
+                    self.finished_file.emit(event[1], event[2])
+                elif event[0] == "progress":
+                    # A resumed search counts only what was left, after planning
+                    self.progress_update.emit(done_before + event[1], done_before + event[2])
+
 
 class KeywordSearchApp(QWidget):
     def __init__(self):
@@ -242,24 +4068,49 @@ class KeywordSearchApp(QWidget):
         self.settings = QSettings("MyCompany", "KeywordSearchApp")
 
         self.folder_path = Path()  # Ensure folder_path attribute exists
+        self.folders_config = load_folders_config()
+        self.network_folders = self.folders_config["Folders"]
+        self.share_governors = ShareGovernors(self.folders_config)
+
+        # Start the helper process early so the first search doesn't wait for it
+        self.scan_engine = None
+        if USE_SCAN_ENGINE:
+            self.scan_engine = ScanEngine(self.folders_config)
+            self.scan_engine.ensure_started()
         self.worker = None
         self.search_thread = None
+        self.job_thread = None
 
         # Default search settings
         self.col_end_keywords = {'E. & O.E.', 'SUB-TOTAL'}
         self.row_end = 'N'
         self.max_rows = 1000
+        self.max_matches = 0
+        self.fuzzy_max_edits = FUZZY_MAX_EDITS
+        self.memory_budget = dict(DEFAULT_MEMORY_BUDGET)
+        self.last_peak_rss = 0
+        self.template = load_template()
 
         self.layout = QVBoxLayout(self)
 
         # Dropdown for selecting predefined network folders
         self.network_combo = QComboBox()
         self.network_combo.addItem("-- Select Network Folder --")
-        for name in NETWORK_FOLDERS:
-            self.network_combo.addItem(name)
+        for name in self.network_folders:
+            self.network_combo.addItem(f"{name} (checking...)", userData=name)
         self.network_combo.currentIndexChanged.connect(self.open_network_folder)
         self.layout.addWidget(self.network_combo)
 
+        # Probe every share in the background and refresh the status periodically
+        self.pending_network_folder = None
+        self.share_prober = ShareProber(self.network_folders)
+        self.share_prober.status_changed.connect(self.update_share_status)
+        self.share_prober.probe_all()
+        self.probe_timer = QTimer(self)
+        self.probe_timer.setInterval(SHARE_STATUS_TTL * 1000)
+        self.probe_timer.timeout.connect(self.share_prober.probe_all)
+        self.probe_timer.start()
+
         # Shows the currently selected folder path
         self.folder_label = QLabel("No folder selected")
         self.layout.addWidget(self.folder_label)
@@ -279,6 +4130,31 @@ class KeywordSearchApp(QWidget):
         self.exact_match_checkbox.setChecked(True)
         self.layout.addWidget(self.exact_match_checkbox)
 
+        # Fuzzy search: files ranked by how closely a cell matches, allowing typos
+        self.fuzzy_match_checkbox = QCheckBox("Fuzzy Match (ranked, allows typos)")
+        self.layout.addWidget(self.fuzzy_match_checkbox)
+
+        # Filters applied to file metadata before any file is opened
+        filter_layout = QHBoxLayout()
+        self.name_filter_input = QLineEdit()
+        self.name_filter_input.setPlaceholderText("File name (glob, or re:regex)")
+        filter_layout.addWidget(self.name_filter_input)
+        self.modified_after_input = QLineEdit()
+        self.modified_after_input.setPlaceholderText("Modified after (YYYY-MM-DD or 30d)")
+        filter_layout.addWidget(self.modified_after_input)
+        self.modified_before_input = QLineEdit()
+        self.modified_before_input.setPlaceholderText("Modified before (YYYY-MM-DD or 30d)")
+        filter_layout.addWidget(self.modified_before_input)
+        self.size_filter_input = QLineEdit()
+        self.size_filter_input.setPlaceholderText("Size in KB (e.g., 10-500)")
+        filter_layout.addWidget(self.size_filter_input)
+        self.layout.addLayout(filter_layout)
+
+        # Filter over the parsed quotation headers (answered from the stored header table)
+        self.header_query_input = QLineEdit()
+        self.header_query_input.setPlaceholderText("Header filter (e.g., Sales Person = WINSTON NG and Date in 2025-07)")
+        self.layout.addWidget(self.header_query_input)
+
         # Settings button
         self.settings_button = QPushButton("Search Settings")
         self.settings_button.clicked.connect(self.show_settings)
@@ -290,6 +4166,26 @@ class KeywordSearchApp(QWidget):
         self.search_button.clicked.connect(self.search_keywords)
         button_layout.addWidget(self.search_button)
 
+        self.search_all_button = QPushButton("Search All Folders")
+        self.search_all_button.clicked.connect(self.search_all_folders)
+        button_layout.addWidget(self.search_all_button)
+
+        self.header_filter_button = QPushButton("Filter Headers")
+        self.header_filter_button.clicked.connect(self.filter_headers)
+        button_layout.addWidget(self.header_filter_button)
+
+        self.bulk_export_button = QPushButton("Bulk Export")
+        self.bulk_export_button.clicked.connect(self.bulk_export)
+        button_layout.addWidget(self.bulk_export_button)
+
+        self.parquet_export_button = QPushButton("Export Parquet")
+        self.parquet_export_button.clicked.connect(self.parquet_export)
+        button_layout.addWidget(self.parquet_export_button)
+
+        self.build_index_button = QPushButton("Build Index")
+        self.build_index_button.clicked.connect(self.build_index)
+        button_layout.addWidget(self.build_index_button)
+
         self.stop_button = QPushButton("Stop")
         self.stop_button.clicked.connect(self.stop_search)
         self.stop_button.setEnabled(False)
@@ -323,10 +4219,17 @@ class KeywordSearchApp(QWidget):
 
         self.files = []
         self.file_paths = {}  # Map file names to full paths
+        self.file_stats = {}  # Map str(path) to (size, mtime) from the directory listing
+        self.result_items = {}  # Map file names to their result list items
+        self.matched_files = set()  # Names of the files the last search matched
+        self.job_worker = None  # Bulk export or index build
+        self.listing_worker = None
         self.load_settings()
 
     def closeEvent(self, event):
         self.stop_search()
+        if self.scan_engine:
+            self.scan_engine.shutdown()
         self.save_settings()
         super().closeEvent(event)
 
@@ -340,111 +4243,394 @@ class KeywordSearchApp(QWidget):
     def open_network_folder(self, index):
         if index <= 0:
             return
-        key = self.network_combo.currentText()
-        path_str = NETWORK_FOLDERS.get(key, "")
-        if path_str:
+        key = self.network_combo.currentData()
+        path_str = self.network_folders.get(key, "")
+        if not path_str:
+            return
+
+        # Never touch the share on the GUI thread; rely on the prober's cached state
+        status = self.share_prober.cached_status(key)
+        if status is None:
+            self.pending_network_folder = key
+            self.folder_label.setText(f"{path_str} (checking...)")
+            self.share_prober.probe(key)
+        elif status:
+            self.pending_network_folder = None
             self.folder_path = Path(path_str)
             self.folder_label.setText(str(self.folder_path))
-            if self.folder_path.exists():
-                self.list_files()
+            self.list_files()
+        else:
+            self.pending_network_folder = None
+            self.folder_label.setText(f"{path_str} (unreachable)")
+
+    def update_share_status(self, name, reachable):
+        index = self.network_combo.findData(name)
+        if index != -1:
+            self.network_combo.setItemText(index, f"{name} ({'online' if reachable else 'unreachable'})")
+        # Finish opening a share that was selected while its status was unknown
+        if name == self.pending_network_folder:
+            self.open_network_folder(index)
 
     def list_files(self):
         self.result_list.clear()
+        self.result_items = {}
         self.files = []
         self.file_paths = {}
+        self.file_stats = {}
 
-        # Ensure folder_path is a valid directory before proceeding
-        if not hasattr(self, 'folder_path') or not self.folder_path.is_dir():
+        if not hasattr(self, 'folder_path') or str(self.folder_path) in ("", "."):
             return
 
-        for file_path in self.folder_path.iterdir():
-            try:
-                if file_path.name.startswith("~$"):  # Ignore temporary Excel lock files
-                    continue
-                if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_EXTENSIONS:
-                    self.files.append(file_path)
-                    self.file_paths[file_path.name] = file_path
-                    item = QListWidgetItem(file_path.name)  # Show only file name
-                    self.result_list.addItem(item)
-            except (PermissionError, OSError) as e:
-                # Skip files that can't be accessed (e.g., locked, permission denied, network delays)
-                print(f"Skipped file {file_path}: {e}")
-                continue
+        # Draw the list from the last snapshot immediately (no network access on the GUI thread)
+        snapshot = load_folder_snapshot(self.folder_path)
+        if snapshot:
+            self.apply_listing(snapshot)
 
-    def search_keywords(self):
-        self.result_list.clear()
-        self.preview_box.clear()
-        self.file_paths = {}
+        # Reconcile against a fresh os.scandir in the background
+        self.listing_worker = FolderListingWorker(self.folder_path)
+        self.listing_worker.listing_ready.connect(self.reconcile_listing)
+        Thread(target=self.listing_worker.run, daemon=True).start()
+
+    def apply_listing(self, entries):
+        """Add files from a {name: (size, mtime)} listing to the file list"""
+        searching = self.stop_button.isEnabled()
+        for name, stat in entries.items():
+            file_path = self.folder_path / name
+            self.file_stats[str(file_path)] = stat
+            self.files.append(file_path)
+            self.file_paths[name] = file_path
+            if not searching:
+                self.add_result_item(name)
+
+    def reconcile_listing(self, folder_path, entries):
+        """Apply only the differences between the displayed listing and a fresh scan"""
+        if folder_path != str(self.folder_path):
+            return  # The user switched folders while the scan was running
 
+        stats = {str(self.folder_path / name): stat for name, stat in entries.items()}
+        removed = set(self.file_stats) - set(stats)
+        added = {Path(key).name: stat for key, stat in stats.items() if key not in self.file_stats}
+        changed = {key: stat for key, stat in stats.items()
+                   if key in self.file_stats and self.file_stats[key] != stat}
+
+        if removed:
+            self.files = [f for f in self.files if str(f) not in removed]
+            for key in removed:
+                del self.file_stats[key]
+                name = Path(key).name
+                self.file_paths.pop(name, None)
+                item = self.result_items.pop(name, None)
+                if item is not None and not self.stop_button.isEnabled():
+                    self.result_list.takeItem(self.result_list.row(item))
+        self.file_stats.update(changed)
+        if added:
+            self.apply_listing(added)
+
+    def get_keyword_list(self):
         keywords = self.keyword_input.text().strip()
-        if not keywords:
+        return [k.strip() for k in re.split('[;,]', keywords) if k.strip()]
+
+    def get_file_filter(self):
+        """Build the FileFilter from the filter inputs, or None (after a warning) if one is invalid"""
+        try:
+            min_size, max_size = parse_size_filter(self.size_filter_input.text())
+            return FileFilter(parse_date_filter(self.modified_after_input.text()),
+                              parse_date_filter(self.modified_before_input.text()),
+                              min_size, max_size, self.name_filter_input.text().strip())
+        except (ValueError, re.error) as e:
+            QMessageBox.warning(self, "Invalid Filter", str(e))
+            return None
+
+    def search_keywords(self):
+        if is_boolean_query(self.keyword_input.text()):
+            self.search_query()
+            return
+        keyword_list = self.get_keyword_list()
+        if not keyword_list:
+            return
+        if self.fuzzy_match_checkbox.isChecked():
+            self.search_fuzzy(keyword_list)
+            return
+        exact_match = self.exact_match_checkbox.isChecked()
+        file_filter = self.get_file_filter()
+        if file_filter is None:
+            return
+
+        # Create a background worker to handle the file scanning; it asks the folder's index (or its
+        # in-memory one) first, off the GUI thread
+        # Interactive searches always run in the foreground I/O profile. Stats come from the listing:
+        # file_paths only holds the files the last search opened
+        files = list(self.files)
+        self.start_search(self.create_worker("folder", dict(
+            files=files, keywords=keyword_list, exact_match=exact_match,
+            col_end_keywords=self.col_end_keywords, row_end=self.row_end, max_rows=self.max_rows,
+            file_stats=dict(self.file_stats), tuning_key=self.folder_path, max_matches=self.max_matches,
+            file_filter=file_filter, folder_path=self.folder_path)), len(files))
+
+    def search_query(self):
+        """Search the folder with a boolean query (e.g. brand:JADEVER AND 60kg NOT stainless)"""
+        try:
+            query = parse_query(self.keyword_input.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid Query", str(e))
+            return
+        file_filter = self.get_file_filter()
+        if file_filter is None:
             return
+        files = [f for f in self.files
+                 if file_filter.matches(f, *self.file_stats.get(str(f), (None, None)))]
+        self.start_search(self.create_worker("query", dict(
+            folder_path=self.folder_path, files=files, file_stats=dict(self.file_stats), query=query,
+            exact_match=self.exact_match_checkbox.isChecked(), col_end_keywords=self.col_end_keywords,
+            row_end=self.row_end, max_rows=self.max_rows)), len(files))
 
-        keyword_list = [k.strip() for k in re.split('[;,]', keywords) if k.strip()]
+    def search_fuzzy(self, keyword_list):
+        """Rank the folder's files by how closely a cell matches the keywords (typos allowed)"""
+        file_filter = self.get_file_filter()
+        if file_filter is None:
+            return
+        files = [f for f in self.files
+                 if file_filter.matches(f, *self.file_stats.get(str(f), (None, None)))]
+        self.start_search(self.create_worker("fuzzy", dict(
+            folder_path=self.folder_path, files=files, file_stats=dict(self.file_stats), keywords=keyword_list,
+            max_edits=self.fuzzy_max_edits, col_end_keywords=self.col_end_keywords, row_end=self.row_end,
+            max_rows=self.max_rows)), len(files))
+
+    def search_all_folders(self):
+        """Fan the query out over every configured folder that isn't known to be unreachable"""
+        keyword_list = self.get_keyword_list()
+        if not keyword_list:
+            return
         exact_match = self.exact_match_checkbox.isChecked()
+        file_filter = self.get_file_filter()
+        if file_filter is None:
+            return
+
+        roots = {name: path for name, path in self.network_folders.items()
+                 if self.share_prober.cached_status(name) is not False}
+        if not roots:
+            return
+        # Full-share sweeps use the gentler background profile during office hours
+        self.start_search(self.create_worker("roots", dict(
+            roots=roots, keywords=keyword_list, exact_match=exact_match,
+            col_end_keywords=self.col_end_keywords, row_end=self.row_end, max_rows=self.max_rows,
+            limits=self.folders_config["Limits"], background=self.share_governors.is_daytime(),
+            max_matches=self.max_matches, file_filter=file_filter)), 0)
+
+    def filter_headers(self):
+        """List the folder's quotations whose parsed header fields match the header filter"""
+        if not self.header_query_input.text().strip():
+            return
+        try:
+            clauses = parse_header_query(self.header_query_input.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid Filter", str(e))
+            return
+        self.start_search(self.create_worker("headers", dict(
+            folder_path=self.folder_path, files=list(self.files), file_stats=dict(self.file_stats),
+            clauses=clauses)), len(self.files))
+
+    def create_worker(self, kind, kwargs):
+        """Worker for a search: hosted in the scan engine process if enabled, otherwise in-process"""
+        if self.scan_engine is not None:
+            return ScanEngineClient(self.scan_engine, kind, kwargs, self.memory_budget)
+        return make_search_worker(kind, kwargs, self.share_governors, self.memory_budget)
+
+    def start_search(self, worker, total_files):
+        self.result_list.clear()
+        self.result_items = {}
+        self.matched_files = set()
+        self.preview_box.clear()
+        self.file_paths = {}
 
         # Setup progress bar
-        self.progress_bar.setMaximum(len(self.files))
+        self.progress_bar.setMaximum(total_files)
         self.progress_bar.setValue(0)
         self.progress_bar.setVisible(True)
 
-        # Disable search button and enable stop button
-        self.search_button.setEnabled(False)
-        self.stop_button.setEnabled(True)
+        # Disable search buttons and enable stop button
+        self.set_busy(True)
 
-        # Create a background worker to handle the file scanning
-        self.worker = SearchWorker(self.files, keyword_list, exact_match,
-                                   self.col_end_keywords, self.row_end, self.max_rows)
+        self.worker = worker
         self.worker.update_result.connect(self.handle_result)
         self.worker.finished_file.connect(self.mark_file_scanned)
         self.worker.finished.connect(self.scan_complete)
         self.worker.progress_update.connect(self.update_progress)
 
-        self.search_thread = Thread(target=self.worker.run)
+        # A stopped search is over once it reported finished, but its thread must be gone before the
+        # next one reads the scan engine pipe; the new thread waits for it, not the GUI
+        self.search_thread = Thread(target=self.run_search_worker, args=(self.worker, self.search_thread))
         self.search_thread.start()
 
+    def run_search_worker(self, worker, previous_thread):
+        """Search thread body: run the worker once the previous search's thread has exited"""
+        if previous_thread is not None:
+            previous_thread.join()
+        worker.run()
+
     def show_settings(self):
         dialog = SettingsDialog(self)
-        dialog.set_settings(self.col_end_keywords, self.row_end, self.max_rows)
+        dialog.set_settings(self.col_end_keywords, self.row_end, self.max_rows, self.max_matches,
+                            self.fuzzy_max_edits, self.memory_budget)
 
         if dialog.exec() == QDialog.Accepted:
-            self.col_end_keywords, self.row_end, self.max_rows = dialog.get_settings()
+            (self.col_end_keywords, self.row_end, self.max_rows, self.max_matches,
+             self.fuzzy_max_edits, self.memory_budget) = dialog.get_settings()
             self.save_settings()  # Save settings immediately
 
     def stop_search(self):
         if self.worker:
             self.worker.stop()
-        self.search_button.setEnabled(True)
-        self.stop_button.setEnabled(False)
+        if self.job_worker:
+            self.job_worker.stop()
+        # The buttons come back when the stopped search or job reports it has finished
+        running = [thread for thread in (self.search_thread, self.job_thread) if thread is not None]
+        if any(thread.is_alive() for thread in running):
+            self.stop_button.setEnabled(False)
+            self.preview_box.append("Stopping...")
+            return
+        self.set_busy(False)
+        self.progress_bar.setVisible(False)
+
+    def set_busy(self, busy):
+        """Only the stop button is usable while a search or export runs"""
+        self.search_button.setEnabled(not busy)
+        self.search_all_button.setEnabled(not busy)
+        self.header_filter_button.setEnabled(not busy)
+        self.bulk_export_button.setEnabled(not busy)
+        self.parquet_export_button.setEnabled(not busy)
+        self.build_index_button.setEnabled(not busy)
+        self.stop_button.setEnabled(busy)
+
+    def export_selection(self):
+        """Ask for the save folder; returns it with the files to export (the files the last search
+        matched, or every listed file), or (None, []) if cancelled"""
+        save_folder = QFileDialog.getExistingDirectory(self, "Select Save Folder", self.save_folder_path)
+        if not save_folder:
+            return None, []
+        self.save_folder_path = save_folder
+
+        names = [name for name in self.file_paths if name in self.matched_files]
+        return save_folder, [self.file_paths[name] for name in names] or list(self.files)
+
+    def start_job(self, worker, message, on_finished):
+        """Run a background job (export or index build) over worker.files with progress"""
+        self.progress_bar.setMaximum(len(worker.files))
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(True)
+        self.set_busy(True)
+        self.preview_box.append(message)
+
+        self.job_worker = worker
+        self.job_worker.progress_update.connect(self.update_progress)
+        self.job_worker.finished.connect(on_finished)
+        self.job_thread = Thread(target=self.job_worker.run)
+        self.job_thread.start()
+
+    def start_export(self, worker, save_folder):
+        self.start_job(worker, f"\nExporting {len(worker.files)} files to {save_folder}...", self.export_complete)
+
+    def build_index(self):
+        """Index the folder's new and changed workbooks so searches can skip files that can't match"""
+        if not self.files:
+            return
+        worker = IndexBuildWorker(self.folder_path, list(self.files), dict(self.file_stats),
+                                  governors=self.share_governors)
+        self.start_job(worker, f"\nIndexing {len(worker.files)} workbooks...", self.index_complete)
+
+    def index_complete(self, indexed, unchanged, failed):
+        self.set_busy(False)
+        self.progress_bar.setVisible(False)
+        self.preview_box.append(f"✅ Indexed {indexed} files, {unchanged} unchanged, {failed} failed.")
+        for file_path, error in list(self.job_worker.errors.items())[:10]:
+            self.preview_box.append(f"  {Path(file_path).name}: {error}")
+        self.job_worker = None
+
+    def bulk_export(self):
+        """Export the files the last search matched, or every listed file, to <stem>.json files"""
+        save_folder, files = self.export_selection()
+        if not files:
+            return
+        # Outputs made with other extraction settings are stale
+        settings_key = hashlib.sha1(json.dumps(
+            [sorted(self.col_end_keywords), self.row_end, self.max_rows]).encode()).hexdigest()
+        self.start_export(BulkExportWorker(files, save_folder, self.extract_json_data, settings_key,
+                                           governors=self.share_governors), save_folder)
+
+    def parquet_export(self):
+        """Export the cells of the matched (or all listed) files into one Parquet dataset"""
+        if pa is None:
+            QMessageBox.warning(self, "Parquet Export", "Parquet export needs pyarrow (pip install pyarrow).")
+            return
+        save_folder, files = self.export_selection()
+        if not files:
+            return
+        worker = ParquetExportWorker(files, save_folder, self.get_keyword_list(),
+                                     self.exact_match_checkbox.isChecked(), governors=self.share_governors)
+        self.start_export(worker, save_folder)
+
+    def export_complete(self, exported, skipped, failed):
+        self.set_busy(False)
         self.progress_bar.setVisible(False)
+        self.preview_box.append(f"✅ Exported {exported} files, {skipped} unchanged, {failed} failed.")
+        if failed:
+            self.preview_box.append(f"Errors: {Path(self.save_folder_path) / EXPORT_ERRORS_NAME}")
+            for file_path, error in list(self.job_worker.errors.items())[:10]:
+                self.preview_box.append(f"  {Path(file_path).name}: {error}")
+        self.job_worker = None
 
     def update_progress(self, current, total):
+        # Multi-root searches discover their total while running
+        if total != self.progress_bar.maximum():
+            self.progress_bar.setMaximum(total)
         self.progress_bar.setValue(current)
 
+    def add_result_item(self, file_name):
+        """Append a file to the result list; items are looked up by name through result_items"""
+        item = QListWidgetItem(file_name)  # Show only file name
+        self.result_list.addItem(item)
+        self.result_items[file_name] = item
+        return item
+
     def handle_result(self, file_path, file_name, found_text):
         self.file_paths[file_name] = Path(file_path)
-        items = self.result_list.findItems(file_name, Qt.MatchExactly)
-        if not items:
-            item = QListWidgetItem(file_name)
-            self.result_list.addItem(item)
-        else:
-            item = items[0]
+        item = self.result_items.get(file_name) or self.add_result_item(file_name)
         item.setBackground(Qt.green)
+        self.matched_files.add(file_name)
 
     def mark_file_scanned(self, file_path, file_name):
         if file_name not in self.file_paths:
             self.file_paths[file_name] = Path(file_path)
-        items = self.result_list.findItems(file_name, Qt.MatchExactly)
-        if not items:
-            item = QListWidgetItem(file_name)
-            self.result_list.addItem(item)
+        if file_name not in self.result_items:
+            self.add_result_item(file_name)
 
     def scan_complete(self):
-        self.search_button.setEnabled(True)
-        self.stop_button.setEnabled(False)
+        self.set_busy(False)
         self.progress_bar.setVisible(False)
         self.preview_box.append("\n✅ Scanning complete.")
 
+        # Searches planned on an index report how much it narrowed them down
+        report = getattr(self.worker, "report", {})
+        if "ruled_out" in report:
+            self.preview_box.append(f"Index: skipped {report['ruled_out']} of {report['files']} files "
+                                    f"(planned in {report['plan_seconds'] * 1000:.0f} ms)")
+        # Fuzzy matches are listed best first; a search resumed in a fresh scan engine ranked each
+        # part on its own, so the list is put in order again
+        ranked = sorted(report.get("ranked", []), key=lambda match: (match[0], Path(match[1]).name))
+        for position, (_, file_path, _) in enumerate(ranked):
+            item = self.result_items.get(Path(file_path).name)
+            if item is not None:
+                self.result_list.insertItem(position, self.result_list.takeItem(self.result_list.row(item)))
+        for edits, file_path, texts in ranked[:20]:
+            plural = "" if edits == 1 else "s"
+            self.preview_box.append(f"{edits} edit{plural}: {Path(file_path).name} ({texts[0]})")
+
+        # Record the peak memory of the scan (the helper process when the scan engine is used)
+        peak_rss = getattr(self.worker, "peak_rss", 0)
+        if peak_rss:
+            self.last_peak_rss = peak_rss
+            self.preview_box.append(f"Peak memory: {peak_rss / (1024 * 1024):.0f} MB")
+
     def show_context_menu(self, item):
         file_name = item.text()
         if file_name not in self.file_paths:
@@ -455,6 +4641,8 @@ class KeywordSearchApp(QWidget):
         open_action = menu.addAction("Open")
         preview_action = menu.addAction("Preview")
         export_json_action = menu.addAction("Export to JSON")
+        fields_action = menu.addAction("Extract Fields")
+        learn_action = menu.addAction("Learn Template From This File")
 
         action = menu.exec(self.result_list.mapToGlobal(self.result_list.pos()))
 
@@ -464,6 +4652,34 @@ class KeywordSearchApp(QWidget):
             self.preview_file(file_name)
         elif action == export_json_action:
             self.export_to_json(file_name)
+        elif action == fields_action:
+            self.show_fields(file_name)
+        elif action == learn_action:
+            self.learn_template(file_name)
+
+    def learn_template(self, file_name):
+        path = self.file_paths[file_name]
+        try:
+            self.template = QuotationTemplate.learn(path)
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Failed to learn template: {e}")
+            return
+        save_template(self.template)
+        found = "\n".join(f"{field['label']} {field['anchor']}" for field in self.template.fields)
+        QMessageBox.information(self, "Template Learned", f"Fields found in {file_name}:\n{found}")
+
+    def show_fields(self, file_name):
+        path = self.file_paths[file_name]
+        try:
+            template = self.template or QuotationTemplate(QUOTATION_FIELD_LABELS, [])
+            fields = template.extract(path)
+        except Exception as e:
+            self.preview_box.setText(f"Error extracting fields: {e}")
+            return
+        self.preview_box.clear()
+        self.preview_box.append(f"Fields: {file_name}\n" + "=" * 50 + "\n")
+        for label, value in fields.items():
+            self.preview_box.append(f"{label} {value}")
 
     def open_file(self, file_name):
         if file_name not in self.file_paths:
@@ -503,17 +4719,21 @@ class KeywordSearchApp(QWidget):
 
             json_data = self.extract_json_data(path)
 
-            # Save to JSON file
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(json_data, f, indent=2, ensure_ascii=False)
+            # Save to JSON file, streaming the row sections; the file only appears once complete
+            with JsonStreamWriter(json_path, indent=2) as writer:
+                writer.write(json_data)
 
             QMessageBox.information(self, "Success", f"JSON file saved to:\n{json_path}")
 
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to export JSON: {e}")
 
-    def extract_json_data(self, file_path):
-        """Extract structured data from Excel file and convert to JSON format"""
+    def extract_json_data(self, file_path, grid=None):
+        """Extract structured data from Excel file and convert to JSON format
+
+        Row sections (table_data, raw_data) are generators, to be written with JsonStreamWriter.
+        A workbook's grid may be passed in when it was already decoded (e.g. by a bulk export).
+        """
         json_data = {
             "file_info": {
                 "filename": file_path.name,
@@ -524,35 +4744,29 @@ class KeywordSearchApp(QWidget):
         }
 
         if file_path.suffix.lower() in ['.xls', '.xlsx']:
-            # Read Excel file
-            df = pd.read_excel(file_path, header=None, dtype=str)
-
-            # Find the actual end row using column end keywords
-            end_row = len(df)
-            if self.col_end_keywords:
-                for idx, row in df.iterrows():
-                    for value in row:
-                        if isinstance(value, str):
-                            for keyword in self.col_end_keywords:
-                                if keyword.lower() in value.lower():
-                                    end_row = idx
-                                    break
-                            if end_row != len(df):
-                                break
-                    if end_row != len(df):
-                        break
+            # Read Excel file into a sparse grid of its non-empty cells. A grid passed in stays the
+            # caller's; one loaded here is closed once extracted (the sections copy what they need)
+            loaded = grid is None
+            if loaded:
+                grid = load_sheet_grid(file_path)
+            try:
+                # Find the actual end row using column end keywords
+                end_row = grid.end_row(self.col_end_keywords)
 
-            # Limit columns based on row_end setting
-            max_col = self.get_column_number(self.row_end)
+                # Limit columns based on row_end setting
+                max_col = self.get_column_number(self.row_end)
 
-            # Extract structured data
-            structured_data = self.extract_structured_sections(df, end_row, max_col)
-            json_data["content"] = structured_data
+                # Extract structured data
+                structured_data = self.extract_structured_sections(grid, end_row, max_col)
+                json_data["content"] = structured_data
+            finally:
+                if loaded:
+                    grid.close()
 
         elif file_path.suffix.lower() == '.csv':
             # Handle CSV files
-            df = pd.read_csv(file_path, header=None, dtype=str, nrows=self.max_rows)
-            json_data["content"]["raw_data"] = df.fillna("").to_dict(orient='records')
+            grid = read_sheet_grid(file_path, self.max_rows)
+            json_data["content"]["raw_data"] = (dict(enumerate(row)) for row in grid.dense_rows(grid.nrows, grid.ncols))
 
         else:
             # Handle text files
@@ -569,67 +4783,69 @@ class KeywordSearchApp(QWidget):
             result = result * 26 + (ord(char) - ord('A') + 1)
         return result
 
-    def extract_structured_sections(self, df, end_row, max_col):
-        """Extract structured sections from DataFrame"""
+    def extract_structured_sections(self, grid, end_row, max_col):
+        """Extract structured sections from a SheetGrid with array operations over its cells
+
+        table_data and raw_data are generators that build each row's dict as it is written.
+        """
         structured_data = {
             "header_info": {},
             "table_data": [],
+            "tables": [],
             "summary_info": {},
             "raw_data": []
         }
 
-        # Convert DataFrame to limited area
-        limited_df = df.iloc[:end_row, :max_col].fillna("")
-
-        # Extract header information (first few rows)
-        header_rows = min(10, len(limited_df))
-        for i in range(header_rows):
-            row_data = limited_df.iloc[i].to_dict()
-            # Look for key-value pairs in header
-            for col_idx, value in enumerate(row_data.values()):
-                if isinstance(value, str) and value.strip():
-                    if ':' in value:
-                        parts = value.split(':', 1)
-                        if len(parts) == 2:
-                            key = parts[0].strip()
-                            val = parts[1].strip()
-                            if key and val:
-                                structured_data["header_info"][key] = val
-
-        # Extract table data (look for structured tables)
-        table_start = -1
-        for i in range(len(limited_df)):
-            row = limited_df.iloc[i]
-            # Look for table headers (rows with multiple non-empty cells)
-            non_empty_count = sum(1 for cell in row if str(cell).strip())
-            if non_empty_count >= 3:  # Assume table if 3+ columns have data
-                table_start = i
-                break
+        # Cells of the limited area, with each distinct text stripped once
+        nrows, ncols = min(end_row, grid.nrows), min(max_col, grid.ncols)
+        in_window = (grid.rows < nrows) & (grid.cols < ncols)
+        rows, cols = grid.rows[in_window], grid.cols[in_window]
+        codes, local = np.unique(grid.codes[in_window], return_inverse=True)
+        texts = np.array([grid.string(code) for code in codes.tolist()], dtype=object)
+        stripped = pd.Series(texts, dtype=object).str.strip().to_numpy()
+
+        # Dense views of the area: original texts, stripped texts and non-empty flags
+        dense = np.full((nrows, ncols), "", dtype=object)
+        dense[rows, cols] = texts[local]
+        clean = np.full((nrows, ncols), "", dtype=object)
+        clean[rows, cols] = stripped[local]
+        filled = np.zeros((nrows, ncols), dtype=bool)
+        filled[rows, cols] = stripped[local] != ""
+        non_empty_count = filled.sum(axis=1)
 
-        if table_start != -1:
-            # Extract table data
-            table_end = min(table_start + 20, len(limited_df))  # Limit table rows
-            for i in range(table_start, table_end):
-                row_data = limited_df.iloc[i].to_list()
-                # Skip empty rows
-                if any(str(cell).strip() for cell in row_data):
-                    structured_data["table_data"].append({
-                        f"col_{j}": str(cell).strip() if str(cell).strip() else ""
-                        for j, cell in enumerate(row_data)
-                    })
+        # Extract header information (key: value cells in the first few rows, row-major)
+        header_cells = pd.Series(texts[local[rows < 10]], dtype=object)
+        parts = header_cells.str.partition(":").reindex(columns=[0, 1, 2], fill_value="")
+        keys, values = parts[0].str.strip(), parts[2].str.strip()
+        is_pair = (parts[1] == ":") & (keys != "") & (values != "")
+        for key, value in zip(keys[is_pair], values[is_pair]):
+            structured_data["header_info"][key] = value
+
+        # Extract table data: a table starts at a row with 3+ non-empty cells and runs to the
+        # next empty row; every table in the area is taken, however long
+        table_starts = np.flatnonzero(non_empty_count >= 3)
+        empty_rows = np.flatnonzero(non_empty_count == 0)
+        table_end = 0
+        for table_start in table_starts:
+            if table_start < table_end:
+                continue
+            following = empty_rows[empty_rows > table_start]
+            table_end = int(following[0]) if len(following) else nrows
+            structured_data["tables"].append({"start_row": int(table_start), "end_row": table_end})
+        column_names = [f"col_{j}" for j in range(ncols)]
+        structured_data["table_data"] = (dict(zip(column_names, row.tolist()))
+                                         for table in structured_data["tables"]
+                                         for row in clean[table["start_row"]:table["end_row"]])
 
         # Extract summary information (last few rows before end keywords)
-        summary_start = max(0, end_row - 5)
-        for i in range(summary_start, end_row):
-            row_data = limited_df.iloc[i].to_dict()
-            for col_idx, value in enumerate(row_data.values()):
-                if isinstance(value, str) and value.strip():
-                    # Look for summary patterns
-                    if any(keyword in value.lower() for keyword in ['total', 'subtotal', 'amount', 'gst', 'tax']):
-                        structured_data["summary_info"][f"row_{i}_col_{col_idx}"] = value.strip()
+        summary = np.flatnonzero(rows >= end_row - 5)
+        summary = summary[pd.Series(texts[local[summary]], dtype=object).str.contains(SUMMARY_PATTERN).to_numpy(dtype=bool)
+                          & (stripped[local[summary]] != "")]
+        for i in summary:
+            structured_data["summary_info"][f"row_{rows[i]}_col_{cols[i]}"] = stripped[local[i]]
 
         # Raw data for reference
-        structured_data["raw_data"] = limited_df.to_dict(orient='records')
+        structured_data["raw_data"] = (dict(enumerate(row.tolist())) for row in dense)
 
         return structured_data
 
@@ -648,7 +4864,8 @@ class KeywordSearchApp(QWidget):
 
             if path.suffix.lower() in ['.xls', '.xlsx']:
                 # Preview Excel file
-                df = pd.read_excel(path, header=None, dtype=str, nrows=50)  # Limit to 50 rows
+                with load_sheet_grid(path, 50) as grid:  # Limit to 50 rows
+                    df = grid.to_frame()
                 preview_text = df.to_string(index=False, header=False, max_rows=50)
                 self.preview_box.append(preview_text)
             else:
@@ -670,22 +4887,34 @@ class KeywordSearchApp(QWidget):
         self.col_end_keywords = {k.strip() for k in col_end_str.split(';') if k.strip()}
         self.row_end = self.settings.value("row_end", "N")
         self.max_rows = self.settings.value("max_rows", 1000, type=int)
+        self.max_matches = self.settings.value("max_matches", 0, type=int)
+        self.fuzzy_max_edits = self.settings.value("fuzzy_max_edits", FUZZY_MAX_EDITS, type=int)
+        self.save_folder_path = self.settings.value("paths/save_folder_path", "")
+        for key, default in DEFAULT_MEMORY_BUDGET.items():
+            self.memory_budget[key] = self.settings.value(f"memory/{key}", default, type=int)
 
         self.folder_path = Path(folder_str) if folder_str else Path()
         self.folder_label.setText(str(self.folder_path))
         self.exact_match_checkbox.setChecked(exact_match)
-        if self.folder_path.is_dir():
+        self.fuzzy_match_checkbox.setChecked(self.settings.value("fuzzy_match", False, type=bool))
+        if folder_str:
             self.list_files()
 
 
     def save_settings(self):
         self.settings.setValue("last_folder", str(self.folder_path))
         self.settings.setValue("exact_match", self.exact_match_checkbox.isChecked())
+        self.settings.setValue("fuzzy_match", self.fuzzy_match_checkbox.isChecked())
 
         # Save search settings
         self.settings.setValue("col_end_keywords", ";".join(self.col_end_keywords))
         self.settings.setValue("row_end", self.row_end)
         self.settings.setValue("max_rows", self.max_rows)
+        self.settings.setValue("max_matches", self.max_matches)
+        self.settings.setValue("fuzzy_max_edits", self.fuzzy_max_edits)
+        self.settings.setValue("paths/save_folder_path", self.save_folder_path)
+        for key, value in self.memory_budget.items():
+            self.settings.setValue(f"memory/{key}", value)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,244 @@
+"""Headless tests of new_app_3.0.py (run with QT_QPA_PLATFORM=offscreen if there is no display)"""
+import os
+import sys
+import time
+import datetime
+import importlib.util
+from pathlib import Path
+
+import openpyxl
+import pandas as pd
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtCore import QSettings
+from PySide6.QtWidgets import QApplication
+
+APP_PATH = Path(__file__).with_name("new_app_3.0.py")
+
+
+def load_app_module():
+    # The file name isn't importable as a module name
+    sys.path.insert(0, str(APP_PATH.parent))
+    spec = importlib.util.spec_from_file_location("new_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_app_module()
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def app_data(tmp_path, monkeypatch):
+    """Per-user state (snapshots, caches, index, settings) kept under tmp_path"""
+    data_dir = tmp_path / "app_data"
+    for name, sub in [("APP_DATA_DIR", ""), ("SNAPSHOT_DIR", "snapshots"), ("ROW_INDEX_DIR", "row_index"),
+                      ("HEADER_DIR", "headers"), ("SHEET_CACHE_DIR", "sheet_cache"), ("INDEX_DIR", "index")]:
+        monkeypatch.setattr(app, name, data_dir / sub)
+    monkeypatch.setattr(app, "WORKER_TUNING_PATH", data_dir / "worker_tuning.json")
+    monkeypatch.setattr(app, "TEMPLATE_PATH", data_dir / "quotation_template.json")
+    monkeypatch.setattr(app, "SHEET_CACHE", app.SheetCache(data_dir / "sheet_cache"))
+    QSettings.setPath(QSettings.NativeFormat, QSettings.UserScope, str(tmp_path / "settings"))
+    return data_dir
+
+
+@pytest.fixture
+def window(qapp, app_data, monkeypatch):
+    # Searches run in-process so the test can see which files they open
+    monkeypatch.setattr(app, "USE_SCAN_ENGINE", False)
+    widget = app.KeywordSearchApp()
+    yield widget
+    widget.stop_search()
+    widget.probe_timer.stop()
+
+
+def run_search(window, qapp):
+    window.search_keywords()
+    window.search_thread.join()
+    qapp.processEvents()
+
+
+def test_repeated_search_keeps_listing_metadata(window, qapp, tmp_path, monkeypatch):
+    folder = tmp_path / "quotes"
+    folder.mkdir()
+    old = time.time() - 90 * 86400
+    for i in range(6):
+        path = folder / f"q{i}.xlsx"
+        pd.DataFrame([[f"Item {i}"]]).to_excel(path, header=False, index=False)
+        if i < 3:
+            os.utime(path, (old, old))
+
+    opened = []
+    scan_file = app.SearchWorker.scan_file
+    monkeypatch.setattr(app.SearchWorker, "scan_file",
+                        lambda worker, file_path: opened.append(file_path.name) or scan_file(worker, file_path))
+
+    window.folder_path = folder
+    window.apply_listing(app.scan_folder_entries(folder))
+    window.keyword_input.setText("Item")
+    window.exact_match_checkbox.setChecked(False)
+    window.modified_after_input.setText("30d")
+
+    # The second search must filter on the listing just like the first, not on what it opened
+    for _ in range(2):
+        opened.clear()
+        run_search(window, qapp)
+        assert sorted(opened) == ["q3.xlsx", "q4.xlsx", "q5.xlsx"]
+        assert window.matched_files == {"q3.xlsx", "q4.xlsx", "q5.xlsx"}
+
+
+@pytest.mark.parametrize("epoch", [openpyxl.utils.datetime.CALENDAR_WINDOWS_1900,
+                                   openpyxl.utils.datetime.CALENDAR_MAC_1904])
+def test_streaming_reader_matches_pandas(app_data, tmp_path, epoch):
+    workbook = openpyxl.Workbook()
+    workbook.epoch = epoch
+    sheet = workbook.active
+    values = [datetime.datetime(2025, 7, 1), datetime.datetime(2025, 7, 1, 13, 45, 10), datetime.date(2024, 2, 29),
+              datetime.time(12, 30), datetime.timedelta(hours=30), 45839, 1.5, 0.1 + 0.2, 12345678901234567890,
+              True, False, "N/A", "NA", "null", " ", "  N/A ", "#N/A", "Item 7", "=1/0"]
+    for row, value in enumerate(values, 1):
+        sheet.cell(row=row, column=1, value=value)
+    formats = ["dd/mm/yyyy", "0.00%", "yyyy-mm-dd h:mm", "[h]:mm:ss", "h:mm AM/PM", "General", "yyyy-mm-dd"]
+    for row, number_format in enumerate(formats, 1):
+        sheet.cell(row=row, column=3, value=45839.25 if row != 5 else 0.75).number_format = number_format
+    path = tmp_path / "dates.xlsx"
+    workbook.save(path)
+
+    expected = {(row, col): text for row, col, text in app.read_sheet_grid(path).cells()}
+    streamed = {(row, col): text for row, cells in app.iter_xlsx_rows(path) for col, text in cells}
+    assert streamed == expected
+    assert expected[(0, 0)] == "2025-07-01 00:00:00"
+    assert (11, 0) not in expected
+    assert app.read_xlsx_cells(path, ["C1", "A12"]) == {"C1": expected[(0, 2)]}
+
+
+def test_merge_writes_without_index_lock(app_data, tmp_path, monkeypatch):
+    folder = tmp_path / "quotes"
+    folder.mkdir()
+    directory = app.index_dir(folder)
+    files = []
+    for i in range(6):
+        path = folder / f"q{i}.xlsx"
+        pd.DataFrame([[f"Item {i}", "Scale" if i % 2 else "Printer"]]).to_excel(path, header=False, index=False)
+        files.append(path)
+    # Three segments; q0 is indexed again (with other text) in the last one
+    for number, batch in enumerate([files[:2], files[2:4], files[4:] + files[:1]]):
+        writer = app.IndexWriter(directory)
+        for path in batch:
+            grid = app.read_sheet_grid(path)
+            if number == 2 and path == files[0]:
+                grid = app.SheetGrid.from_frame(pd.DataFrame([["Item 0", "Scale"]]))
+            writer.add(path, 1, 2.0, grid)
+        writer.commit()
+    stats = {str(path): (1, 2.0) for path in files}
+    query = app.keywords_query(["scale"])
+    with app.FolderIndex(directory) as index:
+        before = index.candidates(files, stats, query, False)
+
+    write_index_file = app.write_index_file
+    locked = []
+    monkeypatch.setattr(app, "write_index_file",
+                        lambda *args: locked.append(app.INDEX_LOCK.locked()) or write_index_file(*args))
+    app.merge_index_segments(directory)
+
+    assert locked == [False]
+    assert len(app.index_segment_paths(directory)) == 1
+    assert not list(directory.glob("*.tmp"))
+    with app.FolderIndex(directory) as index:
+        assert index.candidates(files, stats, query, False) == before
+    assert sorted(path.name for path in before[0]) == ["q0.xlsx", "q1.xlsx", "q3.xlsx", "q5.xlsx"]
+
+
+def test_sheet_cache_hits_are_closed(app_data, tmp_path, monkeypatch):
+    path = tmp_path / "q.xlsx"
+    pd.DataFrame([["Item", "Scale"]]).to_excel(path, header=False, index=False)
+    with app.SHEET_CACHE.load(path) as grid:  # A miss: decoded and cached
+        assert not isinstance(grid, app.MappedGrid)
+
+    # The key is taken from a stat of the workbook; it is never opened for it
+    monkeypatch.setattr(app, "open", lambda *args, **kwargs: pytest.fail("key read the workbook"), raising=False)
+    key = app.SHEET_CACHE.key(path)
+    monkeypatch.delattr(app, "open")
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 1000))
+    assert app.SHEET_CACHE.key(path) != key
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns - 1000))
+
+    closed = []
+    close = app.MappedGrid.close
+    monkeypatch.setattr(app.MappedGrid, "close", lambda grid: closed.append(grid.path) or close(grid))
+    worker = app.SearchWorker([path], ["Scale"], False)
+    assert worker.scan_file(path)[2] == "Scale"
+    assert len(closed) == 1
+    with app.SHEET_CACHE.lookup(path, max_rows=1) as grid:
+        assert isinstance(grid, app.MappedGrid) and grid.cell(0, 1) == "Scale"
+    assert len(closed) == 2 and grid.mm.closed
+
+
+def test_query_and_fuzzy_searches_read_through_share_governors(window, qapp, tmp_path, monkeypatch):
+    folder = tmp_path / "quotes"
+    folder.mkdir()
+    for i, model in enumerate(["SS-60K", "SS-6OK", "LP7611"]):
+        pd.DataFrame([[f"Model : {model}"], ["Brand : JADEVER"]]).to_excel(folder / f"q{i}.xlsx",
+                                                                          header=False, index=False)
+    # Every file counts as being on one share
+    monkeypatch.setattr(app, "unc_share", lambda path: ("host", "share"))
+    slots = []
+    open_slot = app.ShareGovernor.open_slot
+    monkeypatch.setattr(app.ShareGovernor, "open_slot",
+                        lambda governor, nbytes, background=False, should_stop=lambda: False:
+                        slots.append(background) or open_slot(governor, nbytes, background, should_stop))
+
+    window.folder_path = folder
+    window.apply_listing(app.scan_folder_entries(folder))
+    window.exact_match_checkbox.setChecked(False)
+    window.keyword_input.setText("brand:JADEVER AND SS-60K")
+    run_search(window, qapp)
+    assert window.matched_files == {"q0.xlsx"}
+    assert slots == [False] * 3
+    assert window.worker.report["files"] == 3 and len(window.worker.report["checked"]) == 3
+
+    slots.clear()
+    window.fuzzy_match_checkbox.setChecked(True)
+    window.keyword_input.setText("SS-60K")
+    run_search(window, qapp)
+    assert slots == [False] * 3
+    assert [(edits, Path(path).name) for edits, path, _ in window.worker.report["ranked"]] == [(0, "q0.xlsx"),
+                                                                                              (1, "q1.xlsx")]
+    assert [window.result_list.item(i).text() for i in range(window.result_list.count())] == ["q0.xlsx", "q1.xlsx"]
+
+
+def test_timeout_requeues_rest_of_batch(app_data, qapp, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "FILE_TIMEOUT", 0.5)
+    # Newest first, so the first batch runs q0, q1, ... in order and q2 is in the middle of it
+    files = [tmp_path / f"q{i}.xlsx" for i in range(40)]
+    file_stats = {str(f): (1000, 1_700_000_000 - i) for i, f in enumerate(files)}
+    stuck = files[2]
+    release = app.threading.Event()
+    scanned = []
+
+    def search_file(worker, file_path):
+        scanned.append(file_path)
+        if file_path == stuck:
+            release.wait(10)
+        return str(file_path), file_path.name, "hit"
+
+    monkeypatch.setattr(app.SearchWorker, "search_file", search_file)
+    worker = app.SearchWorker(files, ["hit"], False, max_workers=2, file_stats=file_stats)
+    matched, finished = [], []
+    worker.update_result.connect(lambda path, name, text: matched.append(path))
+    worker.finished_file.connect(lambda path, name: finished.append(path))
+    try:
+        worker.run()
+    finally:
+        release.set()
+
+    assert sorted(finished) == sorted(str(f) for f in files)
+    assert sorted(matched) == sorted(str(f) for f in files if f != stuck)
+    assert sorted(scanned) == sorted(files)
@@ -0,0 +1,197 @@
+"""Streaming reader for the first worksheet of an .xlsx, shared by the search apps
+
+Cells come back as the text pd.read_excel(header=None, dtype=str) would give them: number formats
+from the styles part turn date serials into dates, and pandas' default NA strings count as empty.
+"""
+import zipfile
+import xml.etree.ElementTree as ElementTree
+
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel, from_ISO8601
+
+# Namespaces of the .xlsx parts read by the streaming worksheet reader
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+OFFICE_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+# Texts pandas reads as NaN by default (pandas._libs.parsers.STR_NA_VALUES)
+NA_STRINGS = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+
+
+def column_index(letters):
+    """0-based index of column letters (A=0, B=1, ..., AA=26)"""
+    index = 0
+    for char in letters:
+        index = index * 26 + (ord(char) - ord('A') + 1)
+    return index - 1
+
+
+def split_cell_ref(ref):
+    """0-based (row, col) of a cell reference such as "B12" """
+    letters = ref.rstrip("0123456789")
+    return int(ref[len(letters):]) - 1, column_index(letters)
+
+
+def first_sheet_part(archive):
+    """Zip member name of the first worksheet, as listed in the workbook"""
+    try:
+        workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        rel_id = workbook.find(f"{XLSX_NS}sheets/{XLSX_NS}sheet").get(f"{OFFICE_REL_NS}id")
+        rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        target = next(rel.get("Target") for rel in rels if rel.get("Id") == rel_id)
+    except (KeyError, AttributeError, StopIteration, ElementTree.ParseError):
+        return "xl/worksheets/sheet1.xml"
+    return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+
+
+def rich_text(element):
+    """Text of a <si> or <is> element: a plain <t>, or the <t> of each rich-text run"""
+    text = element.find(f"{XLSX_NS}t")
+    if text is not None:
+        return text.text or ""
+    return "".join(run.findtext(f"{XLSX_NS}t", "") for run in element.findall(f"{XLSX_NS}r"))
+
+
+class SharedStrings:
+    """Shared-string table of an .xlsx, parsed only as far as the highest index asked for"""
+
+    def __init__(self, archive):
+        self.strings = []
+        self.stream = None
+        self.events = None
+        if "xl/sharedStrings.xml" in archive.NameToInfo:
+            self.stream = archive.open("xl/sharedStrings.xml")
+            self.events = ElementTree.iterparse(self.stream, events=("end",))
+
+    def __getitem__(self, index):
+        while index >= len(self.strings) and self.events is not None:
+            try:
+                _, element = next(self.events)
+            except StopIteration:
+                self.close()
+                break
+            if element.tag == f"{XLSX_NS}si":
+                self.strings.append(rich_text(element))
+                element.clear()
+        return self.strings[index]
+
+    def close(self):
+        self.events = None
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class CellStyles:
+    """Which cell styles (the s attribute of a <c>) format numbers as dates or durations, and the
+    date epoch of the workbook; read from the small styles and workbook parts, as openpyxl does
+    """
+
+    def __init__(self, archive):
+        self.dates = set()
+        self.durations = set()
+        self.epoch = CALENDAR_WINDOWS_1900
+        try:
+            workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+            properties = workbook.find(f"{XLSX_NS}workbookPr")
+            if properties is not None and properties.get("date1904") in ("1", "true"):
+                self.epoch = CALENDAR_MAC_1904
+            styles = ElementTree.fromstring(archive.read("xl/styles.xml"))
+        except (KeyError, ElementTree.ParseError):
+            return
+
+        custom = {int(fmt.get("numFmtId")): fmt.get("formatCode", "")
+                  for fmt in styles.iterfind(f"{XLSX_NS}numFmts/{XLSX_NS}numFmt")}
+        for style_id, xf in enumerate(styles.iterfind(f"{XLSX_NS}cellXfs/{XLSX_NS}xf")):
+            fmt_id = int(xf.get("numFmtId", 0))
+            code = custom[fmt_id] if fmt_id in custom else builtin_format_code(fmt_id)
+            if code and is_date_format(code):
+                self.dates.add(style_id)
+            if code and is_timedelta_format(code):
+                self.durations.add(style_id)
+
+    def number_text(self, value, style_id):
+        """Text of a numeric cell value: a date, time or duration if its style says so"""
+        number = float(value) if any(char in value for char in ".Ee") else int(value)
+        if style_id in self.dates:
+            try:
+                return str(from_excel(number, self.epoch, timedelta=style_id in self.durations))
+            except (OverflowError, ValueError):
+                return None  # openpyxl turns an out-of-range date into an error cell
+        return str(int(number)) if int(number) == number else str(number)
+
+
+def xlsx_cell_text(cell, shared_strings, styles):
+    """Text of a <c> element as pd.read_excel(dtype=str) renders it, or None if it is empty or NA"""
+    kind = cell.get("t", "n")
+    if kind == "inlineStr":
+        inline = cell.find(f"{XLSX_NS}is")
+        text = rich_text(inline) if inline is not None else ""
+    else:
+        value = cell.findtext(f"{XLSX_NS}v")
+        if not value or kind == "e":
+            return None
+        if kind == "s":
+            text = shared_strings[int(value)]
+        elif kind == "b":
+            text = "True" if value == "1" else "False"
+        elif kind == "n":
+            text = styles.number_text(value, int(cell.get("s", 0)))
+        elif kind == "d":
+            text = str(from_ISO8601(value))
+        else:
+            text = value  # "str" (formula result)
+    return None if text is None or text in NA_STRINGS else text
+
+
+def xlsx_row_cells(row, shared_strings, styles):
+    """[(col, text), ...] for the non-empty cells of a <row> element"""
+    cells = []
+    next_col = 0
+    for cell in row.findall(f"{XLSX_NS}c"):
+        ref = cell.get("r")
+        col = split_cell_ref(ref)[1] if ref else next_col
+        next_col = col + 1
+        text = xlsx_cell_text(cell, shared_strings, styles)
+        if text is not None:
+            cells.append((col, text))
+    return cells
+
+
+def iter_xlsx_rows(file_path, max_rows=None):
+    """Stream the first sheet of an .xlsx as (row, [(col, text), ...]) for each row with text
+
+    The sheet is inflated and parsed as it is read, so stopping early leaves the rest of it
+    compressed; shared strings are resolved lazily, and of the other parts only the workbook and
+    styles are read (for date formats), never themes or drawings.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        styles = CellStyles(archive)
+        shared_strings = SharedStrings(archive)
+        try:
+            with archive.open(first_sheet_part(archive)) as stream:
+                sheet_data = None
+                next_row = 0
+                for event, element in ElementTree.iterparse(stream, events=("start", "end")):
+                    if event == "start":
+                        if element.tag == f"{XLSX_NS}sheetData":
+                            sheet_data = element
+                        continue
+                    if element.tag != f"{XLSX_NS}row":
+                        continue
+
+                    ref = element.get("r")
+                    row = int(ref) - 1 if ref else next_row
+                    next_row = row + 1
+                    if max_rows is not None and row >= max_rows:
+                        break
+                    cells = xlsx_row_cells(element, shared_strings, styles)
+                    # Drop parsed rows so memory stays flat however long the sheet is
+                    if sheet_data is not None:
+                        sheet_data.clear()
+                    if cells:
+                        yield row, cells
+        finally:
+            shared_strings.close()